@@ -1,37 +1,97 @@
 #!/usr/bin/python3
-from flask import Flask, render_template, request, redirect, url_for
-from flask_mysqldb import MySQL
+from flask import Flask, render_template, request, redirect, url_for, jsonify
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, Table, func, text
+import click
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import photohub_db
+from photohub_db.pagination import decode_cursor, page_of, page_size_arg, BadCursor
+from photohub_db.cache import make_cache
 
 app = Flask(__name__)
 
-# MySQL configurations
-app.config['MYSQL_HOST'] = 'localhost'
-app.config['MYSQL_USER'] = 'root'
-app.config['MYSQL_PASSWORD'] = ''
-app.config['MYSQL_DB'] = 'photohub'
+app.config.from_mapping(photohub_db.config_from_env())
+app.config['PAGE_SIZE'] = int(os.environ.get('PAGE_SIZE', 24))
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')
+app.config['CACHE_PATH'] = os.environ.get('CACHE_PATH', 'uploads/cache.sqlite3')
+app.config['CACHE_DEFAULT_TTL'] = int(os.environ.get('CACHE_DEFAULT_TTL', 300))
+
+db = photohub_db.Database(app)
+instrumentation = photohub_db.Instrumentation(app, db.engine)
+cache = make_cache(app.config)
+search_index = photohub_db.PhotographerSearch(app.config['SEARCH_INDEX_PATH'])
+
+# the photographers_profiles columns paging needs; upgrade-schema adds
+# them to a table created before they were
+profiles_table = Table(
+    'photographers_profiles',
+    MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('created_at', DateTime, nullable=False, server_default=func.now()),
+    Index('ix_profiles_created', 'created_at', 'id'),
+)
+
+PROFILE_COLUMNS = "id, first_name, last_name, user_name, email, phone_number, location, created_at"
+
+
+def _load_profiles_page(cursor, page_size):
+    position = decode_cursor(cursor)
+    # rows come back as dicts so templates can use profile.first_name
+    if position:
+        created_at, profile_id = position
+        # seek past the last row of the previous page instead of OFFSET
+        sql = text(
+            "SELECT " + PROFILE_COLUMNS + " FROM photographers_profiles"
+            " WHERE created_at < :created_at OR (created_at = :created_at AND id < :id)"
+            " ORDER BY created_at DESC, id DESC LIMIT :limit")
+        params = {'created_at': created_at, 'id': profile_id, 'limit': page_size + 1}
+    else:
+        sql = text(
+            "SELECT " + PROFILE_COLUMNS + " FROM photographers_profiles"
+            " ORDER BY created_at DESC, id DESC LIMIT :limit")
+        params = {'limit': page_size + 1}
+    profiles = db.fetch_all(sql.columns(created_at=DateTime), params)
+
+    # the extra row only tells us whether there is a next page
+    return page_of(profiles, page_size, lambda p: (p['created_at'], p['id']))
+
+
+def profiles_page():
+    """One page of profiles, newest first, keyed on (created_at, id)"""
+    page_size = page_size_arg(request.args, app.config['PAGE_SIZE'])
+    cursor = request.args.get('cursor') or ''
+    # every page is dropped when a profile is created; its author
+    # refreshes them from the primary while pinned there
+    return cache.get_or_set('profiles', f'{cursor}:{page_size}',
+                            lambda: _load_profiles_page(cursor, page_size),
+                            refresh=db.replicas.pinned())
+
+
+@app.errorhandler(BadCursor)
+def bad_cursor(error):
+    return "Invalid cursor", 400
 
-mysql = MySQL(app)
 
 @app.route('/')
 def index():
-    cur = mysql.connection.cursor()
+    profiles, next_cursor = profiles_page()
 
-    # Execute the MySQL query to fetch all profiles
-    cur.execute("SELECT * FROM photohub.photographers_profiles")
+    return render_template('index.html', profiles=profiles, next_cursor=next_cursor)
 
-    # Fetch all profiles
-    profiles = cur.fetchall()
 
-    # Close the cursor
-    cur.close()
+@app.route('/api/profiles')
+def api_profiles():
+    profiles, next_cursor = profiles_page()
+    items = [dict(profile, created_at=profile['created_at'].isoformat()) for profile in profiles]
 
-    return render_template('index.html', profiles=profiles)
+    return jsonify(items=items, next_cursor=next_cursor)
 
 
 @app.route('/create_profile', methods=['GET', 'POST'])
 def create_profile():
     if request.method == 'POST':
-        cur = mysql.connection.cursor()
         first_name = request.form['first_name']
         last_name = request.form['last_name']
         username = request.form['username']
@@ -43,20 +103,30 @@ def create_profile():
         if not first_name or not last_name or not username or not email or not phone_number or not location:
             return "All fields must be filled out."
 
-        # Execute the MySQL query to insert the new profile
-        cur.execute("INSERT INTO photohub.photographers_profiles (first_name, last_name, user_name, email, phone_number, location) VALUES (%s, %s, %s, %s, %s, %s)", (first_name, last_name, username, email, phone_number, location))
+        # Execute the query to insert the new profile
+        db.execute(
+            "INSERT INTO photographers_profiles (first_name, last_name, user_name, email, phone_number, location, created_at)"
+            " VALUES (:first_name, :last_name, :user_name, :email, :phone_number, :location, CURRENT_TIMESTAMP)",
+            {'first_name': first_name, 'last_name': last_name, 'user_name': username,
+             'email': email, 'phone_number': phone_number, 'location': location})
 
         # Commit changes to the database
-        mysql.connection.commit()
-
-        # Close the cursor
-        cur.close()
+        db.commit()
+        cache.invalidate('profiles')
+        search_index.upsert(username, name=f'{first_name} {last_name}', location=location)
 
         return redirect(url_for('index'))
 
     return render_template('profile.html')
 
 
+@app.cli.command('upgrade-schema')
+def upgrade_schema():
+    """Add created_at and its index to a photographers_profiles table created before them"""
+    for change in photohub_db.upgrade_schema(db.engine, profiles_table.metadata):
+        click.echo(change)
+    click.echo('schema is up to date')
+
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -9,44 +9,90 @@ from flask import (
     session,
     send_file,
 )
-from flask_mysqldb import MySQL
+from sqlalchemy import Column, DateTime, Integer, LargeBinary, MetaData, String, Table, func, text
+from werkzeug.http import is_resource_modified
+import click
+import hashlib
 import io
+import os
 import imghdr
+import sys
+
+try:
+    from PIL import Image as PILImage
+except ImportError:  # Pillow is optional, dimensions are left empty without it
+    PILImage = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import photohub_db
 
 
 app = Flask(__name__)
 
-app.config["MYSQL_DATABASE_HOST"] = "localhost"
-app.config["MYSQL_DATABASE_USER"] = "root"
-app.config["MYSQL_DATABASE_PASSWORD"] = ""
-app.config["MYSQL_DATABASE_DB"] = "photohub"
+app.config.from_mapping(photohub_db.config_from_env())
+# werkzeug refuses larger request bodies with a 413 before parsing them
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+
+db = photohub_db.Database(app)
+instrumentation = photohub_db.Instrumentation(app, db.engine)
+
+# the images columns this app reads beyond the original id, image_data
+# and category_id; upgrade-schema adds them to an older table
+images_table = Table(
+    "images",
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("image_data", LargeBinary),
+    Column("category_id", Integer),
+    Column("mime_type", String(32)),
+    Column("byte_size", Integer),
+    Column("width", Integer),
+    Column("height", Integer),
+    Column("content_hash", String(64)),
+    Column("uploaded_at", DateTime, nullable=False, server_default=func.now()),
+)
 
-mysql = MySQL(app)
+# image ids never change content, so browsers and proxies may keep them a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def image_metadata(file_data):
+    # computed once at upload and stored next to the bytes
+    image_type = imghdr.what(None, h=file_data)
+    width = height = None
+    if PILImage is not None:
+        try:
+            with PILImage.open(io.BytesIO(file_data)) as img:
+                width, height = img.size
+        except Exception:
+            pass
+    return {
+        "mime_type": f"image/{image_type}" if image_type else None,
+        "byte_size": len(file_data),
+        "width": width,
+        "height": height,
+        "content_hash": hashlib.sha256(file_data).hexdigest(),
+    }
 
 
 @app.route("/")
 def idx():
-    cursor = mysql.connection.cursor()
-    cursor.execute("USE photohub")
-    # left join returns all the rows in the images table that match the condition
-    cursor.execute(
-        "SELECT c.category_id, c.category_name,i.id, i.image_data from categories c LEFT JOIN images i ON c.category_id = i.category_id"
-    )
-    data = cursor.fetchall()
+    # left join returns all the rows in the images table that match the condition,
+    # the content type comes from the stored metadata so no image bytes are read
+    data = db.execute(
+        "SELECT c.category_id, c.category_name, i.id, i.mime_type from categories c LEFT JOIN images i ON c.category_id = i.category_id"
+    ).all()
 
     category_images = {}
-    for category_id, category_name, image_id, image_data in data:
+    for category_id, category_name, image_id, content_type in data:
         if category_id not in category_images:
             # appends all the images in a specific category to a list whose key name is the category name
             category_images[category_id] = {
                 "category_name": category_name,
                 "images": [],
             }
-        if image_id:
-            image_type = imghdr.what(None, h=image_data)
-            if image_type:
-                content_type = f"image/{image_type}"
-                category_images[category_id]["images"].append((image_id, content_type))
+        if image_id and content_type:
+            category_images[category_id]["images"].append((image_id, content_type))
     return render_template("load_upload_images.html", category_images=category_images)
 
 
@@ -57,29 +103,59 @@ def upload():
         category_id = request.form["category"]
         if file.filename != "":
             file_data = file.read()
+            meta = image_metadata(file_data)
 
-            cursor = mysql.connection.cursor()
-            cursor.execute(
-                "INSERT INTO photohub.images (image_data, category_id) VALUES (%s, %s)",
-                (file_data, category_id),
+            db.execute(
+                "INSERT INTO images (image_data, category_id, mime_type, byte_size, width, height, content_hash, uploaded_at)"
+                " VALUES (:image_data, :category_id, :mime_type, :byte_size, :width, :height, :content_hash, CURRENT_TIMESTAMP)",
+                dict(meta, image_data=file_data, category_id=category_id),
             )
-            mysql.connection.commit()
+            db.commit()
 
         return redirect(url_for("idx"))
 
 
+def cache_headers(rv, etag, last_modified):
+    rv.set_etag(etag)
+    if last_modified is not None:
+        rv.last_modified = last_modified
+    rv.cache_control.public = True
+    rv.cache_control.max_age = IMMUTABLE_MAX_AGE
+    rv.cache_control.immutable = True
+    return rv
+
+
 @app.route("/image/<int:image_id>")
 def get_images(image_id):
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT image_data FROM photohub.images WHERE id = %s", (image_id,))
-    image_data = cursor.fetchone()
-
-    if image_data:
-        image_type = imghdr.what(None, h=image_data[0])
-        if image_type:
-            # content type based on image type
-            content_type = f"image/{image_type}"
-            return send_file(io.BytesIO(image_data[0]), mimetype=content_type)
+    # validators first, so a revalidation never reads the blob
+    row = db.execute(
+        text("SELECT mime_type, content_hash, uploaded_at FROM images WHERE id = :id").columns(uploaded_at=DateTime),
+        {"id": image_id},
+    ).first()
+
+    if row:
+        content_type, etag, last_modified = row
+        if etag and (request.if_none_match or request.if_modified_since):
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                return cache_headers(Response(status=304), etag, last_modified)
+
+        image_data = db.execute("SELECT image_data FROM images WHERE id = :id", {"id": image_id}).scalar()
+        if content_type is None:
+            # rows uploaded before mime_type was stored
+            image_type = imghdr.what(None, h=image_data)
+            content_type = f"image/{image_type}" if image_type else None
+        if content_type:
+            # conditional=True also answers Range requests with a 206
+            rv = send_file(
+                io.BytesIO(image_data),
+                mimetype=content_type,
+                conditional=True,
+                etag=etag or False,
+                last_modified=last_modified,
+            )
+            if etag:
+                cache_headers(rv, etag, last_modified)
+            return rv
         else:
             return "Unknown image type"
     else:
@@ -94,5 +170,33 @@ def logout():
     return redirect(url_for("idx"))
 
 
+@app.cli.command("upgrade-schema")
+def upgrade_schema():
+    """Add the metadata columns to an images table created before them and fill them in"""
+    for change in photohub_db.upgrade_schema(db.engine, images_table.metadata):
+        click.echo(change)
+    filled = 0
+    last_id = 0
+    with db.engine.connect() as conn:
+        while True:
+            # one row at a time, the bytes of a batch could be large
+            row = conn.execute(
+                text("SELECT id, image_data FROM images WHERE id > :id AND mime_type IS NULL"
+                     " AND image_data IS NOT NULL ORDER BY id LIMIT 1"),
+                {"id": last_id},
+            ).first()
+            if row is None:
+                break
+            conn.execute(
+                text("UPDATE images SET mime_type = :mime_type, byte_size = :byte_size, width = :width,"
+                     " height = :height, content_hash = :content_hash WHERE id = :id"),
+                dict(image_metadata(row.image_data), id=row.id),
+            )
+            conn.commit()
+            filled += 1
+            last_id = row.id
+    click.echo(f"schema is up to date, filled in {filled} images")
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -3,18 +3,29 @@
 starts a Flask web application
 """
 
+import os
+import sys
+
 from flask import Flask, render_template, request, session
-from flask_mysqldb import MySQL
+from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import photohub_db
+from photohub_db.orm import RoutingSession
+
 app = Flask(__name__)
 
-app.config['MYSQL_DATABASE_HOST'] = 'localhost'
-app.config['MYSQL_DATABASE_USER'] = 'root'
-app.config['MYSQL_DATABASE_PASSWORD'] = 'Raelynn@2017'
-app.config['MYSQL_DATABASE_DB'] = photo_hub
+app.config.from_mapping(photohub_db.config_from_env())
+app.config['SQLALCHEMY_DATABASE_URI'] = app.config['DATABASE_URL']
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = photohub_db.engine_options(app.config)
 
-mysql = MYSQL(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+with app.app_context():
+    photohub_db.prepare_engine(db.engine, app.config)
+    instrumentation = photohub_db.Instrumentation(app, db.engine)
+    replicas = photohub_db.ReadReplicas(app, db.engine)
+search_index = photohub_db.PhotographerSearch(app.config['SEARCH_INDEX_PATH'])
 
 
 # Define a Photographer class to represent the photographers table
@@ -84,15 +95,16 @@ def photographer_signup():
             surname=surname,
             middle_name=middle_name,
             gender=gender,
-            dob=dob,
+            date_of_birth=dob,
             location=location,
-            preferred_username=preferred_username,
+            username=preferred_username,
             password=hashed_password  # Store hashed password in the database
         )
 
         # Adds the new photographer to the session and commit to the database
         db.session.add(new_photographer)
         db.session.commit()
+        search_index.upsert(preferred_username, name=f'{first_name} {surname}', location=location)
 
         # Redirect to login page after successful signup
         return render_template('login.html')
@@ -115,7 +127,7 @@ def photographer_login():
         password = request.form['password']
 
         # Retrieve the user from the database based on the username
-        user = Photographer.query.filter_by(preferred_username=username).first()
+        user = Photographer.query.filter_by(username=username).first()
 
         if user and check_password_hash(user.password, password):
             # Successful login
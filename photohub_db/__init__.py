@@ -0,0 +1,19 @@
+#!/usr/bin/python3
+"""
+data access shared by the PhotoHub apps
+
+Every app builds its engine from the same settings (DATABASE_URL and the
+DB_* pool variables, see config_from_env) so a deployment tunes the
+connections it opens against MySQL in one place. Point DATABASE_URL at
+sqlite:///photohub.sqlite3 to run any of the apps locally.
+DATABASE_REPLICA_URLS adds read replicas for the reads of GET requests.
+
+The apps are run from their own directories, so each one puts the
+repository root on sys.path before importing this package.
+"""
+from .engine import DEFAULT_DATABASE_URL, config_from_env, engine_options, prepare_engine, make_engine
+from .database import Database
+from .replicas import ReadReplicas
+from .schema import upgrade_schema
+from .instrumentation import Instrumentation
+from .search import PhotographerSearch
@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+"""
+application cache with an in-process LRU and a shared sqlite backend
+"""
+from collections import OrderedDict
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+
+
+MISSING = object()
+
+
+class LRUBackend:
+    """Per-process least recently used cache with per entry expiry"""
+
+    # other processes, server workers or commands, never see its entries
+    process_local = True
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def incr(self, key):
+        with self.lock:
+            value, expires = self.entries.get(key, (0, None))
+            self.entries[key] = (value + 1, expires)
+            return value + 1
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class SQLiteBackend:
+    """Cache in a local sqlite file, shared by every worker on the host"""
+
+    process_local = False
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, value BLOB, expires REAL)"
+            )
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            # WAL lets readers in other workers carry on during a write
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value, expires FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return MISSING
+        value, expires = row
+        if expires is not None and expires <= time.time():
+            self.delete(key)
+            return MISSING
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        conn = self._connection()
+        expires = time.time() + ttl if ttl else None
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires),
+        )
+        if random.random() < 0.01:
+            self._prune(conn)
+
+    def _prune(self, conn):
+        conn.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache"
+            " WHERE expires IS NOT NULL ORDER BY expires LIMIT"
+            " max(0, (SELECT count(*) FROM cache) - ?))",
+            (self.max_entries,),
+        )
+
+    def incr(self, key):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            value = (pickle.loads(row[0]) if row else 0) + 1
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, NULL)",
+                (key, pickle.dumps(value)),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def delete(self, key):
+        self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+
+class Cache:
+    """Namespaced cache; bumping a namespace invalidates everything in it
+
+    Each namespace has a generation number that is part of every key
+    stored under it, so invalidation is a single counter update and the
+    stale entries simply age out of the backend.
+    """
+
+    def __init__(self, backend, default_ttl=300):
+        self.backend = backend
+        self.default_ttl = default_ttl
+
+    @property
+    def process_local(self):
+        """Whether invalidate() only reaches this process"""
+        return self.backend.process_local
+
+    def _generation(self, namespace):
+        key = f"gen:{namespace}"
+        generation = self.backend.get(key)
+        if generation is MISSING:
+            # start from the clock so an evicted counter never reuses an
+            # old generation and resurrects entries written under it
+            generation = time.time_ns()
+            self.backend.set(key, generation)
+        return generation
+
+    def _key(self, namespace, key):
+        return f"{namespace}:{self._generation(namespace)}:{key}"
+
+    def get(self, namespace, key):
+        return self.backend.get(self._key(namespace, key))
+
+    def set(self, namespace, key, value, ttl=None):
+        self.backend.set(self._key(namespace, key), value, ttl or self.default_ttl)
+
+    def get_or_set(self, namespace, key, producer, ttl=None, refresh=False):
+        """The cached value, or producer()'s stored in its place
+
+        refresh skips the lookup and replaces any cached value, for callers
+        that must not be served what a lagging replica produced.
+        """
+        full_key = self._key(namespace, key)
+        value = MISSING if refresh else self.backend.get(full_key)
+        if value is MISSING:
+            value = producer()
+            self.backend.set(full_key, value, ttl or self.default_ttl)
+        return value
+
+    def invalidate(self, namespace):
+        key = f"gen:{namespace}"
+        if self.backend.get(key) is MISSING:
+            self._generation(namespace)
+        self.backend.incr(key)
+
+
+def make_cache(config):
+    if config.get("CACHE_BACKEND", "memory") == "sqlite":
+        backend = SQLiteBackend(config["CACHE_PATH"])
+    else:
+        backend = LRUBackend(config.get("CACHE_MAX_ENTRIES", 1024))
+    return Cache(backend, config.get("CACHE_DEFAULT_TTL", 300))
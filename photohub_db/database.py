@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+"""
+pooled connections for the Flask apps that write their SQL by hand
+"""
+from flask import g
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from .engine import make_engine
+from .replicas import ReadReplicas, is_read
+
+
+class Database:
+    """Lends each request one pooled connection, returned at teardown
+
+    Statements use named parameters (:name) and may be given as text()
+    clauses where result columns need typing. Nothing is committed unless
+    the view calls commit(); an uncommitted connection is rolled back
+    when it goes back to the pool. Plain SELECTs of GET requests run on a
+    second connection to a replica when DATABASE_REPLICA_URLS names any,
+    and again on the primary if the replica fails them.
+    """
+
+    def __init__(self, app=None):
+        self.engine = None
+        self.replicas = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.engine = make_engine(app.config)
+        self.replicas = ReadReplicas(app, self.engine)
+        app.extensions["photohub_db"] = self
+        app.teardown_appcontext(self._release)
+
+    @property
+    def connection(self):
+        if "photohub_db_connection" not in g:
+            g.photohub_db_connection = self.engine.connect()
+        return g.photohub_db_connection
+
+    def _connection_for(self, sql):
+        replica = self.replicas.engine_for_request() if is_read(sql) else None
+        if replica is None:
+            return self.connection
+        if "photohub_db_replica_connection" not in g:
+            g.photohub_db_replica_connection = replica.connect()
+        return g.photohub_db_replica_connection
+
+    def execute(self, sql, params=None):
+        if isinstance(sql, str):
+            sql = text(sql)
+        connection = self._connection_for(sql)
+        try:
+            return connection.execute(sql, params or {})
+        except OperationalError as exc:
+            if connection is self.connection:
+                raise
+            g.pop("photohub_db_replica_connection").close()
+            self.replicas.fall_back(exc)
+        return self.connection.execute(sql, params or {})
+
+    def fetch_all(self, sql, params=None):
+        """Rows as dicts, the way the templates read them"""
+        return [dict(row) for row in self.execute(sql, params).mappings()]
+
+    def fetch_one(self, sql, params=None):
+        row = self.execute(sql, params).mappings().first()
+        return dict(row) if row is not None else None
+
+    def commit(self):
+        self.connection.commit()
+
+    def _release(self, exc):
+        for name in ("photohub_db_connection", "photohub_db_replica_connection"):
+            connection = g.pop(name, None)
+            if connection is not None:
+                connection.close()
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+"""
+one pooled SQLAlchemy engine configuration for every PhotoHub app
+"""
+import os
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+
+DEFAULT_DATABASE_URL = "mysql://root:@localhost/photohub"
+
+
+def config_from_env(environ=os.environ):
+    """Database settings, read from the environment by every app alike
+
+    The pool defaults are deliberately small: each app process keeps its
+    own pool against the same server, so the connection count MySQL sees
+    is roughly processes * (DB_POOL_SIZE + DB_MAX_OVERFLOW).
+    """
+    return {
+        "DATABASE_URL": environ.get("DATABASE_URL", DEFAULT_DATABASE_URL),
+        # comma separated; reads of GET requests are spread over these, see ReadReplicas
+        "DATABASE_REPLICA_URLS": environ.get("DATABASE_REPLICA_URLS", ""),
+        # how long a client that wrote keeps reading from the primary
+        "DB_REPLICA_PIN_SECONDS": int(environ.get("DB_REPLICA_PIN_SECONDS", 10)),
+        "DB_REPLICA_CHECK_SECONDS": float(environ.get("DB_REPLICA_CHECK_SECONDS", 5)),
+        "DB_REPLICA_MAX_LAG_SECONDS": int(environ.get("DB_REPLICA_MAX_LAG_SECONDS", 5)),
+        "DB_POOL_SIZE": int(environ.get("DB_POOL_SIZE", 5)),
+        "DB_MAX_OVERFLOW": int(environ.get("DB_MAX_OVERFLOW", 5)),
+        "DB_POOL_TIMEOUT": int(environ.get("DB_POOL_TIMEOUT", 10)),
+        # below MySQL's wait_timeout, so the server never drops a pooled connection first
+        "DB_POOL_RECYCLE": int(environ.get("DB_POOL_RECYCLE", 1800)),
+        "DB_POOL_PRE_PING": environ.get("DB_POOL_PRE_PING", "1") != "0",
+        # 0 disables the limit
+        "DB_STATEMENT_TIMEOUT_MS": int(environ.get("DB_STATEMENT_TIMEOUT_MS", 10000)),
+        # one file for every app on the host, so it must not depend on the working directory
+        "SEARCH_INDEX_PATH": environ.get("SEARCH_INDEX_PATH", os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), os.pardir, "uploads", "search.sqlite3")),
+    }
+
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def engine_options(config):
+    """create_engine keyword arguments for config, also usable as
+    Flask-SQLAlchemy's SQLALCHEMY_ENGINE_OPTIONS"""
+    url = make_url(config["DATABASE_URL"])
+    backend = url.get_backend_name()
+    timeout_ms = config.get("DB_STATEMENT_TIMEOUT_MS", 0)
+    options = {"pool_pre_ping": config.get("DB_POOL_PRE_PING", True)}
+    connect_args = {}
+
+    # an in-memory sqlite database lives and dies with its one connection,
+    # so it keeps SQLAlchemy's single connection pool
+    if not _is_memory_sqlite(url):
+        options.update(
+                pool_size=config.get("DB_POOL_SIZE", 5),
+                max_overflow=config.get("DB_MAX_OVERFLOW", 5),
+                pool_timeout=config.get("DB_POOL_TIMEOUT", 10),
+                pool_recycle=config.get("DB_POOL_RECYCLE", 1800),
+                )
+
+    if backend == "mysql":
+        if timeout_ms:
+            # applies to SELECTs, which is what a runaway listing query is
+            connect_args["init_command"] = f"SET SESSION max_execution_time={int(timeout_ms)}"
+    elif backend == "postgresql":
+        if timeout_ms:
+            connect_args["options"] = f"-c statement_timeout={int(timeout_ms)}"
+    elif backend == "sqlite":
+        # how long to wait on another writer's lock, in seconds
+        connect_args["timeout"] = config.get("DB_POOL_TIMEOUT", 10)
+        connect_args["check_same_thread"] = False
+
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+def prepare_engine(engine, config):
+    """Install the per-connection setup engine_options cannot express
+
+    sqlite has no statement timeout of its own, so one is enforced with a
+    progress handler that aborts the statement once its deadline passes.
+    """
+    if engine.dialect.name != "sqlite":
+        return engine
+    timeout = config.get("DB_STATEMENT_TIMEOUT_MS", 0) / 1000
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, record):
+        if not _is_memory_sqlite(engine.url):
+            # readers carry on while another app writes
+            dbapi_connection.execute("PRAGMA journal_mode=WAL")
+        if timeout:
+            info = record.info
+            dbapi_connection.set_progress_handler(
+                    lambda: time.monotonic() > info.get("deadline", float("inf")), 10000)
+
+    if timeout:
+        @event.listens_for(engine, "before_cursor_execute")
+        def _start(conn, cursor, statement, parameters, context, executemany):
+            conn.info["deadline"] = time.monotonic() + timeout
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _finish(conn, cursor, statement, parameters, context, executemany):
+            conn.info.pop("deadline", None)
+
+    return engine
+
+
+def make_engine(config):
+    return prepare_engine(create_engine(config["DATABASE_URL"], **engine_options(config)), config)
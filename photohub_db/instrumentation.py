@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+"""
+per-request timing and SQL accounting with a Prometheus /metrics endpoint
+"""
+from bisect import bisect_left
+import logging
+import os
+import re
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+
+log = logging.getLogger("photohub.instrumentation")
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+BYTES_BUCKETS = (1024, 16 * 1024, 128 * 1024, 1024 * 1024, 8 * 1024 * 1024, 64 * 1024 * 1024)
+
+# IN lists are expanded per call, so (?, ?, ?) and (?, ?) are one shape
+_IN_LIST = re.compile(r"\((?:\s*(?:\?|%s|:[\w]+)\s*,)+\s*(?:\?|%s|:[\w]+)\s*\)")
+
+
+class Histogram:
+    """Per route Prometheus histogram; buckets are stored non-cumulative"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, route, value):
+        with self.lock:
+            series = self.series.get(route)
+            if series is None:
+                # one slot per bucket, one for +Inf, then the sum
+                series = self.series[route] = [0] * (len(self.buckets) + 1) + [0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} histogram")
+        with self.lock:
+            snapshot = {route: list(series) for route, series in self.series.items()}
+        for route, series in sorted(snapshot.items()):
+            label = _label(route)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{route="{label}",le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{route="{label}",le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{route="{label}"}} {series[-1]}')
+            lines.append(f'{self.name}_count{{route="{label}"}} {cumulative}')
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, route, amount=1):
+        with self.lock:
+            self.values[route] = self.values.get(route, 0) + amount
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} counter")
+        with self.lock:
+            values = sorted(self.values.items())
+        for route, value in values:
+            lines.append(f'{self.name}{{route="{_label(route)}"}} {value}')
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _RequestStats:
+    __slots__ = ("started", "statements", "db_time", "rows", "shapes", "query_started")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.shapes = {}
+        self.query_started = 0.0
+
+
+class Instrumentation:
+    """Records wall time, SQL statements, DB time, rows and image bytes per route
+
+    Statements are counted through SQLAlchemy engine events, so every
+    query made while serving a request is attributed to its route. A
+    statement shape seen more than N_PLUS_ONE_THRESHOLD times in one
+    request is logged once as a likely N+1 loop. Metrics are kept per
+    process; with several workers each one serves its own /metrics.
+    """
+
+    def __init__(self, app=None, engine=None):
+        self.request_seconds = Histogram(
+                "photohub_request_duration_seconds", "Wall time spent serving a request", SECONDS_BUCKETS)
+        self.db_seconds = Histogram(
+                "photohub_request_db_seconds", "Time spent executing SQL per request", SECONDS_BUCKETS)
+        self.statements = Histogram(
+                "photohub_request_sql_statements", "SQL statements executed per request", COUNT_BUCKETS)
+        self.rows = Histogram(
+                "photohub_request_db_rows", "Rows the database driver reported per request", COUNT_BUCKETS)
+        self.image_bytes = Histogram(
+                "photohub_response_image_bytes", "Image bytes sent per response", BYTES_BUCKETS)
+        self.repeated_statements = Counter(
+                "photohub_repeated_statement_warnings_total", "Requests that repeated one statement shape too often")
+        self.threshold = 5
+        if app is not None:
+            self.init_app(app, engine)
+
+    def init_app(self, app, engine=None):
+        self.threshold = app.config.setdefault(
+                "N_PLUS_ONE_THRESHOLD", int(os.environ.get("N_PLUS_ONE_THRESHOLD", 5)))
+        metrics_path = app.config.setdefault("METRICS_PATH", os.environ.get("METRICS_PATH", "/metrics"))
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule(metrics_path, "metrics", self.metrics)
+        app.extensions["photohub_instrumentation"] = self
+        if engine is not None:
+            self.watch_engine(engine)
+        replicas = app.extensions.get("photohub_replicas")
+        if replicas is not None:
+            for replica in replicas.replicas.engines:
+                self.watch_engine(replica)
+
+    def watch_engine(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_request(self):
+        if request.endpoint != "metrics":
+            g.request_stats = _RequestStats()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not has_request_context():
+            return
+        stats = g.get("request_stats")
+        if stats is not None:
+            stats.query_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not has_request_context():
+            return
+        stats = g.get("request_stats")
+        if stats is None:
+            return
+        stats.db_time += time.perf_counter() - stats.query_started
+        stats.statements += 1
+        # drivers that buffer results report the row count of a SELECT,
+        # sqlite reports -1 and contributes nothing here
+        if cursor.rowcount > 0:
+            stats.rows += cursor.rowcount
+        # the ORM inserts new rows one at a time where the database cannot
+        # return generated ids for a batch (MySQL), so a repeated INSERT is
+        # a write per row, not a loop of lookups
+        if statement.lstrip()[:6].upper() == "INSERT":
+            return
+        shape = _IN_LIST.sub("(?)", statement)
+        seen = stats.shapes.get(shape, 0) + 1
+        stats.shapes[shape] = seen
+        if seen == self.threshold + 1:
+            route = request.endpoint or "unmatched"
+            self.repeated_statements.inc(route)
+            log.warning("%s ran the same statement more than %d times, likely an N+1 query: %s",
+                        route, self.threshold, " ".join(shape.split())[:300])
+
+    def _after_request(self, response):
+        stats = g.pop("request_stats", None)
+        if stats is None:
+            return response
+        route = request.endpoint or "unmatched"
+        self.request_seconds.observe(route, time.perf_counter() - stats.started)
+        self.db_seconds.observe(route, stats.db_time)
+        self.statements.observe(route, stats.statements)
+        self.rows.observe(route, stats.rows)
+        if response.mimetype and response.mimetype.startswith("image/") and response.content_length:
+            self.image_bytes.observe(route, response.content_length)
+        return response
+
+    def metrics(self):
+        lines = []
+        for metric in (self.request_seconds, self.db_seconds, self.statements,
+                       self.rows, self.image_bytes, self.repeated_statements):
+            metric.render(lines)
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+"""
+Flask-SQLAlchemy session that reads from the replicas of ReadReplicas
+"""
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy.exc import OperationalError
+
+from .replicas import is_read
+
+
+class RoutingSession(Session):
+    """db.session whose plain SELECTs go to the request's replica
+
+    Pass it as SQLAlchemy(app, session_options={"class_": RoutingSession})
+    and set up photohub_db.ReadReplicas with db.engine. Flushes, DML and
+    locking SELECTs keep to the primary. A read that fails on a replica
+    is run again on the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and clause is not None and is_read(clause):
+            replicas = current_app.extensions.get("photohub_replicas")
+            engine = replicas.engine_for_request() if replicas is not None else None
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _execute_internal(self, statement, *args, **kwargs):
+        # execute(), scalar() and scalars() all come through here
+        try:
+            return super()._execute_internal(statement, *args, **kwargs)
+        except OperationalError as exc:
+            replicas = current_app.extensions.get("photohub_replicas")
+            if replicas is None or not replicas.reading_replica() or self._flushing or not is_read(statement):
+                raise
+            replicas.fall_back(exc)
+        return super()._execute_internal(statement, *args, **kwargs)
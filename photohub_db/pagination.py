@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+"""
+keyset (cursor) pagination over (created_at, id)
+"""
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+class BadCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, row_id):
+    raw = json.dumps([created_at.isoformat() if created_at else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise BadCursor(cursor)
+
+
+def page_size_arg(args, default=DEFAULT_PAGE_SIZE):
+    size = args.get("page_size", default, type=int)
+    return max(1, min(size or default, MAX_PAGE_SIZE))
+
+
+def keyset(stmt, created_col, id_col, cursor, page_size, descending=True):
+    """Restrict stmt to the page after cursor, fetching one extra row
+
+    The extra row tells page_of whether a next page exists without a
+    COUNT; the WHERE clause lets the (created_at, id) index do the seek
+    instead of an OFFSET scan.
+    """
+    position = decode_cursor(cursor)
+    if position is not None:
+        created_at, row_id = position
+        if descending:
+            stmt = stmt.where(or_(
+                created_col < created_at,
+                and_(created_col == created_at, id_col < row_id),
+            ))
+        else:
+            stmt = stmt.where(or_(
+                created_col > created_at,
+                and_(created_col == created_at, id_col > row_id),
+            ))
+    if descending:
+        stmt = stmt.order_by(created_col.desc(), id_col.desc())
+    else:
+        stmt = stmt.order_by(created_col, id_col)
+    return stmt.limit(page_size + 1)
+
+
+def page_of(rows, page_size, key):
+    """Trim the look-ahead row and return (rows, next_cursor)"""
+    rows = list(rows)
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor(*key(rows[-1]))
@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+"""
+read replicas: health-checked engines that serve the reads of safe requests
+"""
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event, text
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.sql.selectable import TextualSelect
+
+from .engine import make_engine
+
+
+log = logging.getLogger("photohub.replicas")
+
+SAFE_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+# set on the response of a request that committed, holding the time the pin ends
+PIN_COOKIE = "photohub_primary_until"
+
+_SELECT = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+_LOCKING = re.compile(r"\bFOR\s+(?:UPDATE|SHARE)\b|\bLOCK\s+IN\s+SHARE\s+MODE\b", re.IGNORECASE)
+
+
+def is_read(statement):
+    """Whether statement only reads without locking, so a replica may run it"""
+    if isinstance(statement, str):
+        sql = statement
+    elif isinstance(statement, TextClause):
+        sql = statement.text
+    elif isinstance(statement, TextualSelect):
+        sql = statement.element.text
+    else:
+        return bool(getattr(statement, "is_select", False)) and getattr(statement, "_for_update_arg", None) is None
+    return bool(_SELECT.match(sql)) and not _LOCKING.search(sql)
+
+
+def replica_lag(conn):
+    """Seconds the server behind conn trails its source, 0 when it is no replica
+
+    None means replication is configured but stopped. Only MySQL reports
+    lag here; any other server counts as current once it answers.
+    """
+    if conn.dialect.name != "mysql":
+        return 0
+    # MySQL 8.0.22 and later
+    status = conn.exec_driver_sql("SHOW REPLICA STATUS").mappings().first()
+    if status is None:
+        return 0
+    return status["Seconds_Behind_Source"]
+
+
+class Replica:
+    __slots__ = ("engine", "name", "healthy")
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.name = engine.url.render_as_string(hide_password=True)
+        self.healthy = True
+
+
+class ReplicaSet:
+    """Engines for DATABASE_REPLICA_URLS, handed out round robin
+
+    A background thread in each process probes every replica each
+    DB_REPLICA_CHECK_SECONDS and takes out the ones that fail or trail
+    by more than DB_REPLICA_MAX_LAG_SECONDS; a replica whose connection
+    drops while serving is taken out at once. With none left, pick()
+    returns None and reads go to the primary until a probe succeeds.
+    """
+
+    def __init__(self, urls, config):
+        self.replicas = [Replica(make_engine(dict(config, DATABASE_URL=url))) for url in urls]
+        self.check_seconds = config.get("DB_REPLICA_CHECK_SECONDS", 5)
+        self.max_lag = config.get("DB_REPLICA_MAX_LAG_SECONDS", 5)
+        self.turns = itertools.count()
+        self.lock = threading.Lock()
+        self.checker_pid = None
+        for replica in self.replicas:
+            event.listen(replica.engine, "handle_error", lambda context, replica=replica: self._failed(replica, context))
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    @property
+    def engines(self):
+        return [replica.engine for replica in self.replicas]
+
+    def pick(self):
+        """A healthy replica engine, or None for the primary"""
+        self._start_checker()
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self.turns) % len(healthy)].engine
+
+    def _start_checker(self):
+        # started on first use, so each forked worker runs its own
+        if self.checker_pid == os.getpid():
+            return
+        with self.lock:
+            if self.checker_pid == os.getpid():
+                return
+            self.checker_pid = os.getpid()
+            threading.Thread(target=self._check_forever, name="replica-check", daemon=True).start()
+
+    def _check_forever(self):
+        while True:
+            self.check()
+            time.sleep(self.check_seconds)
+
+    def check(self):
+        """Probe every replica once, updating which are in rotation"""
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+                    lag = replica_lag(conn)
+            except Exception as exc:
+                self._mark(replica, False, f"probe failed: {exc}")
+                continue
+            if lag is None:
+                self._mark(replica, False, "replication is stopped")
+            elif lag > self.max_lag:
+                self._mark(replica, False, f"{lag}s behind")
+            else:
+                self._mark(replica, True, "")
+
+    def read_failed(self, engine, exc):
+        """Take the replica behind engine out of rotation after a read failed on it"""
+        for replica in self.replicas:
+            if replica.engine is engine:
+                self._mark(replica, False, f"read failed: {exc}")
+
+    def _failed(self, replica, context):
+        # only losing the server counts; a bad statement fails on the primary too
+        if context.is_disconnect or context.connection is None:
+            self._mark(replica, False, f"connection failed: {context.original_exception}")
+
+    def _mark(self, replica, healthy, reason):
+        if replica.healthy == healthy:
+            return
+        replica.healthy = healthy
+        if healthy:
+            log.info("replica %s is back in rotation", replica.name)
+        else:
+            log.warning("replica %s taken out of rotation, %s", replica.name, reason)
+
+
+class ReadReplicas:
+    """Routes the reads of safe requests to replicas, everything else to the primary
+
+    Requests other than GET, HEAD and OPTIONS, and any statement that
+    writes or locks, use the primary. A request that commits on the
+    primary pins its client there for DB_REPLICA_PIN_SECONDS with a
+    cookie, so the pages that follow an upload or a signup read their
+    own writes whatever the replicas' lag. Without DATABASE_REPLICA_URLS
+    everything uses the primary and no cookie is set.
+    """
+
+    def __init__(self, app=None, primary=None):
+        self.replicas = None
+        self.pin_seconds = 0
+        if app is not None:
+            self.init_app(app, primary)
+
+    def init_app(self, app, primary):
+        urls = [url.strip() for url in app.config.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+        self.replicas = ReplicaSet(urls, app.config)
+        self.pin_seconds = app.config.get("DB_REPLICA_PIN_SECONDS", 10)
+        app.extensions["photohub_replicas"] = self
+        instrumentation = app.extensions.get("photohub_instrumentation")
+        if instrumentation is not None:
+            for engine in self.replicas.engines:
+                instrumentation.watch_engine(engine)
+        if self.replicas:
+            event.listen(primary, "commit", self._committed)
+            app.after_request(self._after_request)
+
+    def pinned(self):
+        """Whether this request's client wrote recently and must read the primary"""
+        if not self.replicas or not has_request_context():
+            return False
+        try:
+            until = float(request.cookies.get(PIN_COOKIE, 0))
+        except ValueError:
+            return False
+        now = time.time()
+        # a pin never lasts longer than one the app could have set
+        return now < until <= now + self.pin_seconds
+
+    def engine_for_request(self):
+        """The replica engine this request reads from, or None for the primary"""
+        if not self.replicas or not has_request_context():
+            return None
+        if "photohub_replica" not in g:
+            g.photohub_replica = None
+            if request.method in SAFE_METHODS and not self.pinned():
+                g.photohub_replica = self.replicas.pick()
+        return g.photohub_replica
+
+    def fall_back(self, exc):
+        """Send this request's reads to the primary after one failed on its replica
+
+        Called for any OperationalError, not only lost connections: a
+        replica that answers but lacks a table or column a migration
+        added fails the same way. The next probe puts it back.
+        """
+        engine = g.get("photohub_replica")
+        g.photohub_replica = None
+        if engine is not None:
+            self.replicas.read_failed(engine, exc)
+
+    def reading_replica(self):
+        """Whether this request's reads are going to a replica"""
+        return has_request_context() and g.get("photohub_replica") is not None
+
+    def _committed(self, conn):
+        if has_request_context():
+            g.photohub_wrote = True
+
+    def _after_request(self, response):
+        if g.pop("photohub_wrote", False) and self.pin_seconds:
+            response.set_cookie(PIN_COOKIE, str(int(time.time() + self.pin_seconds)),
+                                max_age=self.pin_seconds, httponly=True, samesite="Lax")
+        return response
@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+"""
+bringing tables created by an older release up to date with the models
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+
+def _add_column(conn, table, column):
+    dialect = conn.dialect
+    name = dialect.identifier_preparer.format_table(table)
+    if dialect.name != "sqlite" and (column.nullable or column.server_default is not None):
+        # the server fills existing rows with the default
+        conn.execute(text(f"ALTER TABLE {name} ADD COLUMN {CreateColumn(column).compile(dialect=dialect)}"))
+        return
+    # sqlite cannot add a column with a non-constant default, and a NOT
+    # NULL column without one cannot be added anywhere, so the column is
+    # added nullable and any default written into the existing rows
+    column_name = dialect.identifier_preparer.format_column(column)
+    conn.execute(text(f"ALTER TABLE {name} ADD COLUMN {column_name} {column.type.compile(dialect=dialect)}"))
+    if column.server_default is not None:
+        default = dialect.ddl_compiler(dialect, None).get_column_default_string(column)
+        conn.execute(text(f"UPDATE {name} SET {column_name} = {default}"))
+
+
+def upgrade_schema(engine, metadata):
+    """Add the columns and indexes of metadata that existing tables lack
+
+    create_all() creates missing tables but never alters one, so a table
+    from an older release keeps its old columns. Missing tables are left
+    to create_all(). Returns a line describing each change made.
+    """
+    changes = []
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    _add_column(conn, table, column)
+                    changes.append(f"added column {table.name}.{column.name}")
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+                    changes.append(f"created index {index.name}")
+    return changes
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+"""
+photographer search over an sqlite FTS5 index shared by the apps on a host
+"""
+from datetime import datetime
+import os
+import re
+import sqlite3
+import threading
+
+from .pagination import decode_cursor, page_of
+
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def _prefix_query(text, columns=None):
+    """FTS5 query matching every word of text as a prefix, or None"""
+    terms = [f'"{token}"*' for token in _TOKEN.findall(text or "")]
+    if not terms:
+        return None
+    query = " AND ".join(terms)
+    if columns:
+        query = "{" + " ".join(columns) + "} : (" + query + ")"
+    return query
+
+
+class PhotographerSearch:
+    """Photographers keyed by username, with their text and categories
+
+    A photographer can come from a sign-up in the main app (user_id) and
+    from Profile_Creation (name and location); both write to the same
+    row, matched on username. The FTS5 table indexes 1 to 3 character
+    prefixes, so as-you-type queries do not scan the term list.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection().executescript(
+            "CREATE TABLE IF NOT EXISTS photographer ("
+            " id INTEGER PRIMARY KEY, username TEXT NOT NULL UNIQUE, user_id INTEGER UNIQUE,"
+            " name TEXT, location TEXT, created_at TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS ix_photographer_created ON photographer (created_at, id);"
+            "CREATE VIRTUAL TABLE IF NOT EXISTS photographer_text USING fts5("
+            " username, name, location, prefix='1 2 3');"
+            "CREATE TABLE IF NOT EXISTS photographer_category ("
+            " category_id INTEGER NOT NULL, user_id INTEGER NOT NULL,"
+            " PRIMARY KEY (category_id, user_id)) WITHOUT ROWID;"
+        )
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self.local.conn = conn
+        return conn
+
+    def _write(self, conn, username, user_id, name, location, created_at):
+        row = conn.execute(
+            "INSERT INTO photographer (username, user_id, name, location, created_at)"
+            " VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (username) DO UPDATE SET"
+            " user_id = coalesce(excluded.user_id, user_id),"
+            " name = coalesce(excluded.name, name),"
+            " location = coalesce(excluded.location, location)"
+            " RETURNING id, username, name, location",
+            (username, user_id, name, location, (created_at or datetime.utcnow()).isoformat()),
+        ).fetchone()
+        conn.execute("DELETE FROM photographer_text WHERE rowid = ?", (row[0],))
+        conn.execute(
+            "INSERT INTO photographer_text (rowid, username, name, location) VALUES (?, ?, ?, ?)", tuple(row))
+
+    def upsert(self, username, user_id=None, name=None, location=None, created_at=None):
+        """Add a photographer or fill in the fields given for an existing one"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._write(conn, username, user_id, name, location, created_at)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def add_categories(self, pairs):
+        """Record (user_id, category_id) pairs of uploaded images"""
+        self._connection().executemany(
+            "INSERT OR IGNORE INTO photographer_category (user_id, category_id) VALUES (?, ?)", pairs)
+
+    def remove_categories(self, pairs):
+        """Forget (user_id, category_id) pairs whose last image was deleted"""
+        self._connection().executemany(
+            "DELETE FROM photographer_category WHERE user_id = ? AND category_id = ?", pairs)
+
+    def rebuild(self, photographers, categories):
+        """Replace the whole index in one transaction
+
+        photographers yields (username, user_id, name, location, created_at)
+        and categories yields (user_id, category_id); searches keep seeing
+        the old index until the rebuild commits.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM photographer")
+            conn.execute("DELETE FROM photographer_text")
+            conn.execute("DELETE FROM photographer_category")
+            for photographer in photographers:
+                self._write(conn, *photographer)
+            conn.executemany(
+                "INSERT OR IGNORE INTO photographer_category (user_id, category_id) VALUES (?, ?)", categories)
+            count = conn.execute("SELECT count(*) FROM photographer").fetchone()[0]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return count
+
+    def search(self, text=None, location=None, category_id=None, cursor=None, page_size=24):
+        """One page of matches, newest first, as (rows, next_cursor)"""
+        where, params = [], []
+        match = " AND ".join(q for q in (
+                _prefix_query(text),
+                _prefix_query(location, ["location"]),
+                ) if q)
+        if match:
+            where.append("p.id IN (SELECT rowid FROM photographer_text WHERE photographer_text MATCH ?)")
+            params.append(match)
+        if category_id is not None:
+            where.append("p.user_id IN (SELECT user_id FROM photographer_category WHERE category_id = ?)")
+            params.append(category_id)
+        position = decode_cursor(cursor)
+        if position is not None:
+            created_at, row_id = position
+            where.append("(p.created_at < ? OR (p.created_at = ? AND p.id < ?))")
+            params += [created_at.isoformat(), created_at.isoformat(), row_id]
+        sql = "SELECT p.id, p.username, p.user_id, p.name, p.location, p.created_at FROM photographer p"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY p.created_at DESC, p.id DESC LIMIT ?"
+        params.append(page_size + 1)
+
+        rows = [dict(row) for row in self._connection().execute(sql, params)]
+        return page_of(rows, page_size, lambda row: (datetime.fromisoformat(row["created_at"]), row["id"]))
@@ -0,0 +1,292 @@
+#!/usr/bin/python3
+"""
+asynchronous image server sharing the models and storage of the Flask app
+
+Run it next to the Flask app and send /image/ traffic to it, e.g.
+    uvicorn asgi_images:app --port 8001
+"""
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+import time
+
+from sqlalchemy.exc import OperationalError
+from werkzeug.http import http_date, parse_etags, parse_date, parse_range_header
+
+import photographer_signup_and_login as photohub
+from image_cache import CachedImage
+from image_response import IMMUTABLE_MAX_AGE
+from renditions import RENDITION_SIZES, generate_rendition, rendition_format
+
+
+CHUNK_SIZE = 256 * 1024
+ROUTE = re.compile(r"^/image/(\d+)(?:/(\d+))?$")
+
+# blocking work (database lookups and file reads) runs on this pool so the
+# event loop only ever waits on sockets
+io_pool = ThreadPoolExecutor(
+        max_workers=int(os.environ.get("ASGI_IO_THREADS", 64)),
+        thread_name_prefix="image-io",
+        )
+
+with photohub.app.app_context():
+    engine = photohub.db.engine
+
+Image = photohub.Image
+
+
+class MetadataCache:
+    """LRU of image rows; an id's content never changes, only disappears
+
+    Deletes go through the Flask app, so a row is looked up again after
+    ttl seconds to notice that its image is gone.
+    """
+
+    def __init__(self, max_entries=100000, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.rows = OrderedDict()
+
+    def get(self, image_id):
+        entry = self.rows.get(image_id)
+        if entry is None:
+            return None
+        row, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            self.rows.pop(image_id, None)
+            return None
+        self.rows.move_to_end(image_id)
+        return row
+
+    def put(self, image_id, row):
+        self.rows[image_id] = (row, time.monotonic() + self.ttl if self.ttl else None)
+        self.rows.move_to_end(image_id)
+        if len(self.rows) > self.max_entries:
+            self.rows.popitem(last=False)
+
+    def discard(self, image_id):
+        self.rows.pop(image_id, None)
+
+
+metadata = MetadataCache(ttl=photohub.app.config["IMAGE_CACHE_TTL"])
+
+
+def _load_row(image_id):
+    # a replica may not have an image uploaded a moment ago, so a miss
+    # there is asked of the primary before it becomes a 404
+    replica = photohub.replicas.replicas.pick()
+    for source in ((replica, engine) if replica is not None else (engine,)):
+        try:
+            with source.connect() as conn:
+                row = conn.execute(
+                        photohub.db.select(
+                            Image.blob_key, Image.mime_type, Image.content_hash,
+                            Image.uploaded_at, Image.byte_size,
+                            ).where(Image.id == image_id)
+                        ).first()
+        except OperationalError as exc:
+            if source is engine:
+                raise
+            photohub.replicas.replicas.read_failed(source, exc)
+            continue
+        if row is not None:
+            return row
+    return None
+
+
+async def lookup(image_id):
+    row = metadata.get(image_id)
+    if row is None:
+        row = await asyncio.get_running_loop().run_in_executor(io_pool, _load_row, image_id)
+        if row is not None:
+            metadata.put(image_id, row)
+    return row
+
+
+async def send_text(send, status, text):
+    body = text.encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"text/plain"), (b"content-length", str(len(body)).encode())],
+        })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _headers(scope):
+    return {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+
+
+def _not_modified(headers, etag, last_modified):
+    if "if-none-match" in headers:
+        return parse_etags(headers["if-none-match"]).contains(etag)
+    since = parse_date(headers.get("if-modified-since"))
+    if since is not None and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= since.replace(tzinfo=None)
+    return False
+
+
+def _cache_headers(etag, last_modified):
+    headers = [
+            (b"etag", f'"{etag}"'.encode()),
+            (b"cache-control", f"public, max-age={IMMUTABLE_MAX_AGE}, immutable".encode()),
+            (b"accept-ranges", b"bytes"),
+            ]
+    if photohub.renditions.formats:
+        headers.append((b"vary", b"Accept"))
+    if last_modified is not None:
+        headers.append((b"last-modified", http_date(last_modified).encode()))
+    return headers
+
+
+def _byte_range(headers, size, etag):
+    """(start, stop) of a single satisfiable Range, or None for the whole body"""
+    if "range" not in headers:
+        return None
+    if_range = headers.get("if-range")
+    if if_range and if_range.strip('"') != etag:
+        return None
+    ranges = parse_range_header(headers["range"])
+    if ranges is None or len(ranges.ranges) != 1:
+        return None
+    return ranges.range_for_length(size)
+
+
+async def stream_response(scope, send, etag, last_modified, mime_type, size, read_at):
+    """Send a body of size bytes; read_at(offset, n) returns a chunk"""
+    headers = _headers(scope)
+    if _not_modified(headers, etag, last_modified):
+        await send({"type": "http.response.start", "status": 304, "headers": _cache_headers(etag, last_modified)})
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    status, start, stop = 200, 0, size
+    response_headers = _cache_headers(etag, last_modified) + [(b"content-type", mime_type.encode())]
+    byte_range = _byte_range(headers, size, etag)
+    if byte_range is not None:
+        status, (start, stop) = 206, byte_range
+        response_headers.append((b"content-range", f"bytes {start}-{stop - 1}/{size}".encode()))
+    response_headers.append((b"content-length", str(stop - start).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": response_headers})
+
+    if scope["method"] == "HEAD":
+        await send({"type": "http.response.body", "body": b""})
+        return
+    offset = start
+    while offset < stop:
+        chunk = await read_at(offset, min(CHUNK_SIZE, stop - offset))
+        if not chunk:
+            break
+        offset += len(chunk)
+        # send() only returns once the server has room for more, which is
+        # what keeps a slow client from piling chunks up in memory
+        await send({"type": "http.response.body", "body": chunk, "more_body": offset < stop})
+    if offset < stop or start == stop:
+        await send({"type": "http.response.body", "body": b""})
+
+
+async def send_cached(scope, send, cached):
+    async def read_at(offset, n):
+        return cached.data[offset:offset + n]
+    await stream_response(scope, send, cached.etag, cached.last_modified,
+                          cached.mime_type, len(cached.data), read_at)
+
+
+async def send_path(scope, send, path, etag, last_modified, mime_type):
+    loop = asyncio.get_running_loop()
+    fd = await loop.run_in_executor(io_pool, os.open, path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+
+        async def read_at(offset, n):
+            # pread does not share a file position, so no locking is needed
+            return await loop.run_in_executor(io_pool, os.pread, fd, n, offset)
+
+        await stream_response(scope, send, etag, last_modified, mime_type, size, read_at)
+    finally:
+        os.close(fd)
+
+
+async def serve_image(scope, send, image_id, size):
+    accepted = photohub.renditions.accepted(_headers(scope).get("accept"))
+    cache_key = (image_id, size, accepted)
+    cached = photohub.image_cache.get(cache_key)
+    if cached:
+        return await send_cached(scope, send, cached)
+
+    row = await lookup(image_id)
+    # rows still holding their bytes in MySQL are only served by the Flask
+    # app until `flask migrate-blobs` has moved them
+    if row is None or not row.blob_key or not row.mime_type:
+        return await send_text(send, 404, "Image not found")
+    src_path = photohub.blob_store.path(row.blob_key)
+    if src_path is None:
+        return await send_text(send, 404, "Image not found")
+
+    loop = asyncio.get_running_loop()
+    if size is None:
+        etag = row.content_hash
+    else:
+        etag = f"{row.blob_key}-{size}"
+        path = photohub.renditions.path(row.blob_key, size)
+        if not os.path.exists(path):
+            # generated on the shared process pool, or on the io threads
+            # when there is none; the loop keeps serving either way
+            await loop.run_in_executor(
+                    photohub.renditions.executor() if photohub.renditions.workers else io_pool,
+                    generate_rendition, src_path, path, size, rendition_format(row.mime_type))
+    try:
+        # stats every candidate file, so it runs off the loop too
+        (path, mime_type, fmt), final = await loop.run_in_executor(
+                io_pool, photohub.renditions.negotiate,
+                src_path, row.blob_key, row.mime_type, size, accepted)
+    except FileNotFoundError:
+        # deleted since its row was cached
+        metadata.discard(image_id)
+        return await send_text(send, 404, "Image not found")
+    if fmt:
+        etag = f"{etag}.{fmt}"
+
+    if size is not None and os.path.getsize(path) <= photohub.image_cache.max_entry_bytes:
+        data = await loop.run_in_executor(io_pool, _read_file, path)
+        cached = CachedImage(data, mime_type, etag, row.uploaded_at)
+        # the choice can still change while variants are being generated
+        if final:
+            photohub.image_cache.put(cache_key, cached)
+        return await send_cached(scope, send, cached)
+    try:
+        await send_path(scope, send, path, etag, row.uploaded_at, mime_type)
+    except FileNotFoundError:
+        metadata.discard(image_id)
+        await send_text(send, 404, "Image not found")
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                io_pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+    if scope["method"] not in ("GET", "HEAD"):
+        return await send_text(send, 405, "Method not allowed")
+    match = ROUTE.match(scope["path"])
+    if match is None:
+        return await send_text(send, 404, "Not found")
+    image_id = int(match.group(1))
+    size = int(match.group(2)) if match.group(2) else None
+    if size is not None and size not in RENDITION_SIZES:
+        return await send_text(send, 404, "Not found")
+    await serve_image(scope, send, image_id, size)
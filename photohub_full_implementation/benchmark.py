@@ -0,0 +1,353 @@
+#!/usr/bin/python3
+"""
+benchmarks the main routes against a synthetic catalog on sqlite
+
+    python benchmark.py --photographers 50 --categories 8 --images 5 -o before.json
+    python benchmark.py ... -o after.json --compare before.json
+
+The catalog is generated into --workdir (a temporary directory by default)
+and reused when the same directory and catalog options are given again.
+Requests go through the Flask test client, so the numbers cover routing,
+queries and templates but not the network. Application caches are off
+unless --cache is given, so every request takes the database path.
+"""
+import argparse
+from datetime import datetime, timedelta
+import io
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from werkzeug.security import generate_password_hash
+
+
+# a few source images of camera-like sizes; blob store rows share them, so
+# a large catalog costs little disk, while rows kept in the database each
+# get a copy with a unique tail
+BASE_DIMENSIONS = [(640, 480), (1024, 768), (1600, 1067), (2048, 1365), (1200, 1600), (3000, 2000)]
+
+
+class Counters:
+    queries = 0
+    db_bytes = 0
+
+
+def _value_bytes(value):
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    return 8 if value is not None else 0
+
+
+def _row_bytes(row):
+    return sum(_value_bytes(value) for value in row)
+
+
+class CountingCursor(sqlite3.Cursor):
+    """Adds the size of every fetched row to Counters.db_bytes"""
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            Counters.db_bytes += _row_bytes(row)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        Counters.db_bytes += sum(_row_bytes(row) for row in rows)
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        Counters.db_bytes += sum(_row_bytes(row) for row in rows)
+        return rows
+
+
+class CountingConnection(sqlite3.Connection):
+    def cursor(self, factory=CountingCursor):
+        return super().cursor(factory)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--photographers", type=int, default=50)
+    parser.add_argument("--categories", type=int, default=8)
+    parser.add_argument("--images", type=int, default=5, help="images per photographer and category")
+    parser.add_argument("--legacy-fraction", type=float, default=0.1,
+                        help="share of images whose bytes are still held in the database")
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--cache", action="store_true", help="leave the application caches on")
+    parser.add_argument("--workdir", help="where the catalog is kept, reused between runs")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="earlier JSON results to print the change against")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args, workdir):
+    """Point the app at the benchmark catalog; must run before it is imported"""
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "catalog.sqlite3")
+    os.environ["BLOB_STORE_ROOT"] = os.path.join(workdir, "blobs")
+    os.environ["RENDITION_ROOT"] = os.path.join(workdir, "renditions")
+    os.environ["UPLOAD_SESSION_ROOT"] = os.path.join(workdir, "sessions")
+    os.environ["CACHE_PATH"] = os.path.join(workdir, "cache.sqlite3")
+    # no rendition pool: copies are drawn inline by the request that needs
+    # them, so their cost is timed rather than left running in the background
+    os.environ["RENDITION_WORKERS"] = "0"
+    if not args.cache:
+        os.environ["CACHE_BACKEND"] = "memory"
+        os.environ["CACHE_MAX_ENTRIES"] = "0"
+        os.environ["IMAGE_CACHE_BYTES"] = "0"
+
+
+def base_images(rnd):
+    """JPEG bytes for each of BASE_DIMENSIONS, textured so they compress like photos"""
+    from PIL import Image as PILImage
+
+    images = []
+    for width, height in BASE_DIMENSIONS:
+        noise = PILImage.frombytes("RGB", (width // 8, height // 8), rnd.randbytes(width // 8 * (height // 8) * 3))
+        buf = io.BytesIO()
+        noise.resize((width, height), PILImage.BICUBIC).save(buf, "JPEG", quality=85)
+        images.append((buf.getvalue(), width, height))
+    return images
+
+
+def catalog_options(args):
+    return {
+        "photographers": args.photographers,
+        "categories": args.categories,
+        "images": args.images,
+        "legacy_fraction": args.legacy_fraction,
+        "seed": args.seed,
+    }
+
+
+def build_catalog(photohub, args, workdir):
+    """Create the schema and rows unless workdir already holds this catalog"""
+    marker = os.path.join(workdir, "catalog.json")
+    options = catalog_options(args)
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f) == options:
+                return False
+        raise SystemExit(f"{workdir} holds a different catalog, use another --workdir")
+
+    db, Image = photohub.db, photohub.Image
+    rnd = random.Random(args.seed)
+    bases = [
+            (data, width, height, photohub.blob_store.put_bytes(data), photohub.placeholder(io.BytesIO(data)))
+            for data, width, height in base_images(rnd)
+            ]
+    # one hash that every synthetic photographer shares, hashing is not what is measured
+    password = generate_password_hash("benchmark")
+    start = datetime(2023, 1, 1)
+
+    db.create_all()
+    db.session.execute(db.insert(photohub.Category), [
+            {"name": f"Category {c}", "created_at": start + timedelta(minutes=c)}
+            for c in range(args.categories)
+            ])
+    db.session.execute(db.insert(photohub.User), [
+            {
+                "preferred_username": f"photographer{p}",
+                "email": f"photographer{p}@example.com",
+                "password": password,
+                "created_at": start + timedelta(hours=p),
+            }
+            for p in range(args.photographers)
+            ])
+    rows = []
+    for user_id in range(1, args.photographers + 1):
+        for category_id in range(1, args.categories + 1):
+            for _ in range(args.images):
+                data, width, height, blob_key, placeholder = rnd.choice(bases)
+                tail = rnd.randbytes(16)
+                row = {
+                    "user_id": user_id,
+                    "category_id": category_id,
+                    "mime_type": "image/jpeg",
+                    "byte_size": len(data),
+                    "width": width,
+                    "height": height,
+                    "placeholder": placeholder,
+                    "uploaded_at": start + timedelta(seconds=rnd.randrange(365 * 24 * 3600)),
+                }
+                if rnd.random() < args.legacy_fraction:
+                    # the tail makes each row's bytes distinct, decoders ignore it
+                    data = data + tail
+                    row.update(image_data=data, blob_key=None, byte_size=len(data), content_hash=tail.hex() + "0" * 32)
+                else:
+                    row.update(image_data=None, blob_key=blob_key, content_hash=blob_key)
+                rows.append(row)
+                if len(rows) >= 1000:
+                    db.session.execute(db.insert(Image), rows)
+                    rows = []
+    if rows:
+        db.session.execute(db.insert(Image), rows)
+    db.session.commit()
+    photohub.reconcile_stats()
+    with open(marker, "w") as f:
+        json.dump(options, f)
+    return True
+
+
+def percentile(quantiles, p):
+    return round(quantiles[p - 1] * 1000, 3)
+
+
+def run_endpoint(app, client, urls, user_ids, args, rnd):
+    """Time requests to urls, then trace one pass for peak allocations"""
+    def request(url, user_id):
+        if user_id is not None:
+            with client.session_transaction() as session:
+                session["_user_id"] = str(user_id)
+                session["_fresh"] = True
+        response = client.get(url)
+        response.close()
+        if response.status_code != 200:
+            raise SystemExit(f"{url} returned {response.status_code}")
+
+    picks = [rnd.randrange(len(urls)) for _ in range(args.warmup + args.requests)]
+    for i in picks[:args.warmup]:
+        request(urls[i], user_ids[i])
+
+    timings = []
+    Counters.queries = Counters.db_bytes = 0
+    for i in picks[args.warmup:]:
+        started = time.perf_counter()
+        request(urls[i], user_ids[i])
+        timings.append(time.perf_counter() - started)
+    queries, db_bytes = Counters.queries, Counters.db_bytes
+
+    # tracing slows every allocation down, so it gets its own short pass
+    tracemalloc.start()
+    peak = 0
+    for i in picks[args.warmup:args.warmup + 20]:
+        tracemalloc.reset_peak()
+        request(urls[i], user_ids[i])
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    quantiles = statistics.quantiles(timings, n=100, method="inclusive")
+    return {
+        "requests": len(timings),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 3),
+        "p50_ms": percentile(quantiles, 50),
+        "p95_ms": percentile(quantiles, 95),
+        "p99_ms": percentile(quantiles, 99),
+        "queries_per_request": round(queries / len(timings), 2),
+        "db_bytes_per_request": round(db_bytes / len(timings)),
+        "peak_alloc_bytes": peak,
+        # the process high-water mark once this endpoint has run
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def endpoints(photohub, args):
+    """name -> (urls, user to log in as for each url or None)"""
+    db, Image = photohub.db, photohub.Image
+    users = range(1, args.photographers + 1)
+    categories = range(1, args.categories + 1)
+    blob_ids = db.session.scalars(db.select(Image.id).where(Image.blob_key.isnot(None))).all()
+    legacy_ids = db.session.scalars(db.select(Image.id).where(Image.blob_key.is_(None))).all()
+    plan = {
+        "dashboard": (["/dashboard"] * len(users), list(users)),
+        "browse_category_images": ([f"/browse_category_images/{c}" for c in categories], [None] * len(categories)),
+        "photographer_profile": ([f"/photographer_profile/{u}" for u in users], [None] * len(users)),
+        "get_image": ([f"/image/{i}" for i in blob_ids], [None] * len(blob_ids)),
+        "get_image_legacy": ([f"/image/{i}" for i in legacy_ids], [None] * len(legacy_ids)),
+    }
+    return {name: urls for name, urls in plan.items() if urls[0]}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+                ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    columns = ("p50_ms", "p95_ms", "p99_ms", "queries_per_request", "db_bytes_per_request", "peak_alloc_bytes")
+    print(f"{'endpoint':24}" + "".join(f"{c:>22}" for c in columns))
+    for name, result in results["endpoints"].items():
+        cells = []
+        for column in columns:
+            cell = str(result[column])
+            before = (baseline or {}).get("endpoints", {}).get(name, {}).get(column)
+            if before:
+                cell += f" ({(result[column] - before) / before:+.0%})"
+            cells.append(f"{cell:>22}")
+        print(f"{name:24}" + "".join(cells))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="photohub-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    configure_environment(args, workdir)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import photographer_signup_and_login as photohub
+    from sqlalchemy import event
+
+    app = photohub.app
+    app.config["TESTING"] = True
+    with app.app_context():
+        engine = photohub.db.engine
+
+        @event.listens_for(engine, "do_connect")
+        def _counting_connection(dialect, record, cargs, cparams):
+            cparams["factory"] = CountingConnection
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _count_query(conn, cursor, statement, parameters, context, executemany):
+            Counters.queries += 1
+
+        engine.dispose()
+        started = time.perf_counter()
+        if build_catalog(photohub, args, workdir):
+            print(f"generated catalog in {workdir} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        plan = endpoints(photohub, args)
+        photohub.db.session.remove()
+
+    rnd = random.Random(args.seed)
+    client = app.test_client()
+    results = {
+        "revision": git_revision(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "catalog": dict(catalog_options(args), total_images=args.photographers * args.categories * args.images),
+        "cache": args.cache,
+        "endpoints": {},
+    }
+    for name, (urls, user_ids) in plan.items():
+        results["endpoints"][name] = run_endpoint(app, client, urls, user_ids, args, rnd)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+"""
+content-addressed storage for image bytes
+"""
+import hashlib
+import os
+import tempfile
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class BlobTooLarge(Exception):
+    """Raised by put_file when the stream is longer than max_bytes"""
+
+
+class BlobStore:
+    """Interface every blob backend implements; keys are sha256 hex digests"""
+
+    def put_file(self, fileobj, max_bytes=None):
+        raise NotImplementedError
+
+    def put_bytes(self, data):
+        raise NotImplementedError
+
+    def open(self, key):
+        raise NotImplementedError
+
+    def path(self, key):
+        # backends that keep blobs on the local disk return a real path so
+        # the file can be handed to send_file (and from there to sendfile)
+        return None
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class FileSystemBlobStore(BlobStore):
+    """Blobs live in <root>/<ab>/<cd>/<abcd...>, named after their sha256"""
+
+    def __init__(self, root, depth=2):
+        self.root = root
+        self.depth = depth
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+
+    def path(self, key):
+        shards = [key[i * 2:i * 2 + 2] for i in range(self.depth)]
+        return os.path.join(self.root, *shards, key)
+
+    def put_file(self, fileobj, max_bytes=None):
+        # hash while copying into a temp file on the same filesystem, then
+        # rename into place so readers never see a half written blob
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while True:
+                    chunk = fileobj.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise BlobTooLarge(f"more than {max_bytes} bytes")
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            key = digest.hexdigest()
+            target = self.path(key)
+            if os.path.exists(target):
+                # identical bytes are already stored
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp_path, target)
+            return key
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def put_bytes(self, data):
+        key = hashlib.sha256(data).hexdigest()
+        target = self.path(key)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(data)
+            os.replace(tmp_path, target)
+        return key
+
+    def open(self, key):
+        return open(self.path(key), "rb")
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+# backends selectable through the BLOB_STORE_BACKEND config value
+BACKENDS = {
+    "filesystem": FileSystemBlobStore,
+}
+
+
+def make_blob_store(config):
+    backend = BACKENDS[config.get("BLOB_STORE_BACKEND", "filesystem")]
+    return backend(config["BLOB_STORE_ROOT"])
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+"""
+walks multi-file uploads, ZIP archives and directories one image at a time
+"""
+from collections import namedtuple
+import os
+import zipfile
+
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".tif", ".tiff"}
+
+# folder is the first path component, used to pick a category by name
+Entry = namedtuple("Entry", "name folder size open")
+
+
+def is_image_name(name):
+    base = os.path.basename(name)
+    if not base or base.startswith(".") or "__MACOSX" in name.split("/"):
+        return False
+    return os.path.splitext(base)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _folder(path):
+    parts = path.replace("\\", "/").strip("/").split("/")
+    return parts[0] if len(parts) > 1 else None
+
+
+def iter_zip(fileobj, archive_name=""):
+    """Yield the image entries of a ZIP without extracting the archive
+
+    Each entry is decompressed from the archive as it is read, so only
+    one chunk of one image is in memory at a time.
+    """
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not is_image_name(info.filename):
+                continue
+            yield Entry(
+                    f"{archive_name}/{info.filename}" if archive_name else info.filename,
+                    _folder(info.filename),
+                    info.file_size,
+                    lambda info=info: archive.open(info),
+                    )
+
+
+def iter_uploaded_files(files):
+    """Yield entries for a list of werkzeug FileStorage objects"""
+    for storage in files:
+        if not storage.filename:
+            continue
+        if storage.filename.lower().endswith(".zip"):
+            try:
+                yield from iter_zip(storage.stream, storage.filename)
+            except zipfile.BadZipFile as e:
+                # reported against the archive instead of failing the request
+                yield Entry(storage.filename, None, None, lambda e=e: _raise(e))
+        else:
+            stream = storage.stream
+            yield Entry(storage.filename, None, None, lambda stream=stream: _Unclosed(stream))
+
+
+def iter_directory(root):
+    """Yield entries for every image below root, foldered by top directory"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            rel = os.path.relpath(path, root)
+            if not is_image_name(rel):
+                continue
+            yield Entry(rel, _folder(rel), os.path.getsize(path), lambda path=path: open(path, "rb"))
+
+
+def _raise(error):
+    raise error
+
+
+class _Unclosed:
+    """Context manager over a stream that werkzeug will close itself"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __enter__(self):
+        return self.stream
+
+    def __exit__(self, *exc):
+        return False
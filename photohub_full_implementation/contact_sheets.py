@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+"""
+contact sheets: a photographer's newest previews in a category drawn as one image
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from renditions import SAVE_OPTIONS
+
+try:
+    from PIL import Image as PILImage, ImageOps
+except ImportError:  # without Pillow browse pages show separate previews
+    PILImage = None
+
+
+# previews per sheet, and the box each 1x tile is fitted into
+SHEET_PREVIEWS = 4
+SHEET_TILE_SIZE = 256
+SHEET_DENSITIES = (1, 2)
+
+
+def sheet_layout(images, tile_size=SHEET_TILE_SIZE):
+    """Lay out rows with id, width and height side by side
+
+    Tiles are fitted into tile_size x tile_size the way renditions are.
+    Returns (tiles, width, height) in 1x pixels, each tile a dict with
+    the image id and its x, width and height in the sheet.
+    """
+    tiles = []
+    x = 0
+    for image in images:
+        scale = min(1, tile_size / max(image.width, image.height))
+        width, height = max(1, round(image.width * scale)), max(1, round(image.height * scale))
+        tiles.append({"id": image.id, "x": x, "width": width, "height": height})
+        x += width
+    return tiles, x, max((tile["height"] for tile in tiles), default=0)
+
+
+def sheet_version(images, tiles):
+    """Names the sheet's content, so its URL can be cached forever"""
+    content = [(image.blob_key, tile) for image, tile in zip(images, tiles)]
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def draw_contact_sheet(sources, dest_path, width, height, density):
+    """Paste (src_path, tile) pairs into one JPEG; runs in a worker"""
+    sheet = PILImage.new("RGB", (width * density, height * density), "white")
+    for src_path, tile in sources:
+        size = (tile["width"] * density, tile["height"] * density)
+        with PILImage.open(src_path) as img:
+            img.draft("RGB", size)
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            sheet.paste(img.resize(size, PILImage.LANCZOS), (tile["x"] * density, 0))
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path))
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            sheet.save(tmp, "JPEG", **SAVE_OPTIONS["JPEG"])
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return dest_path
+
+
+class ContactSheets:
+    """Sheet files, named by version, drawn on the rendition pool"""
+
+    def __init__(self, root, renditions):
+        self.root = root
+        self.renditions = renditions
+        # futures still drawing each version in this process
+        self.pending = {}
+
+    @property
+    def enabled(self):
+        return PILImage is not None
+
+    def path(self, version, density):
+        return os.path.join(self.root, version[:2], f"{version}-{density}x.jpg")
+
+    def submit(self, version, sources, width, height):
+        """Queue every density of a sheet that is not drawn yet"""
+        futures = [
+                self.renditions.executor().submit(
+                    draw_contact_sheet, sources, self.path(version, density), width, height, density)
+                for density in SHEET_DENSITIES
+                if not os.path.exists(self.path(version, density))
+                ]
+        for future in futures:
+            self.pending.setdefault(version, set()).add(future)
+            future.add_done_callback(lambda done: self.pending.get(version, set()).discard(done))
+        return futures
+
+    def ensure(self, version, sources, width, height, density):
+        """Return the sheet path, drawing it inline if the pool has not yet"""
+        dest_path = self.path(version, density)
+        if not os.path.exists(dest_path):
+            draw_contact_sheet(sources, dest_path, width, height, density)
+        return dest_path
+
+    def _unlink(self, version):
+        for density in SHEET_DENSITIES:
+            try:
+                os.unlink(self.path(version, density))
+            except FileNotFoundError:
+                pass
+
+    def delete(self, version):
+        # a sheet superseded while still queued is dropped, or removed
+        # once the worker has written it
+        for future in list(self.pending.pop(version, ())):
+            if not future.cancel():
+                future.add_done_callback(lambda _: self._unlink(version))
+        self._unlink(version)
+
+    def versions(self):
+        """Versions of every sheet file on disk"""
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith("x.jpg"):
+                    yield filename.rsplit("-", 1)[0]
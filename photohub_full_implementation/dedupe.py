@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+"""
+perceptual hashes and a multi-index hash table to find near duplicate images
+"""
+import threading
+
+try:
+    from PIL import Image as PILImage
+except ImportError:  # without Pillow only exact duplicates are detected
+    PILImage = None
+
+
+# images whose hashes differ in at most this many bits are near duplicates
+NEAR_DUPLICATE_DISTANCE = 6
+
+
+def dhash(fileobj):
+    """64 bit difference hash as 16 hex digits, None if it can't be decoded"""
+    if PILImage is None:
+        return None
+    try:
+        with PILImage.open(fileobj) as img:
+            # decode at a reduced scale, only 9x8 pixels are needed
+            img.draft("L", (64, 64))
+            small = img.convert("L").resize((9, 8), PILImage.BILINEAR)
+            # one byte per pixel in mode L; getdata is deprecated
+            pixels = list(small.tobytes())
+    except Exception:
+        return None
+    finally:
+        fileobj.seek(0)
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:016x}"
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class MultiIndexHash:
+    """Hamming-distance lookup over 64 bit hashes split into 16 bit chunks
+
+    Two hashes within distance r differ by at most r // 4 bits in one of
+    their four chunks, so a search only probes the chunk tables for values
+    that close and checks the few candidates it finds.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+
+    def __init__(self):
+        self.tables = [{} for _ in range(self.CHUNKS)]
+        self.size = 0
+
+    def _chunks(self, value):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(value >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+
+    def _probes(self, chunk, radius):
+        # every chunk value within radius bits of chunk
+        probes = {chunk}
+        for _ in range(radius):
+            probes |= {p ^ (1 << bit) for p in probes for bit in range(self.CHUNK_BITS)}
+        return probes
+
+    def add(self, value, item):
+        self.size += 1
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            table.setdefault(chunk, []).append((value, item))
+
+    def search(self, value, radius):
+        """Return (distance, item) pairs within radius, closest first"""
+        seen = set()
+        found = []
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            for probe in self._probes(chunk, radius // self.CHUNKS):
+                for candidate, item in table.get(probe, ()):
+                    if item in seen:
+                        continue
+                    seen.add(item)
+                    distance = hamming(value, candidate)
+                    if distance <= radius:
+                        found.append((distance, item))
+        found.sort()
+        return found
+
+
+class DuplicateIndex:
+    """Near duplicate lookup over every stored image hash"""
+
+    def __init__(self, load_rows):
+        # load_rows(after_id) yields (image_id, phash) for ids above after_id
+        self.load_rows = load_rows
+        self.lock = threading.Lock()
+        self.hashes = MultiIndexHash()
+        self.last_id = 0
+
+    def rebuild(self):
+        with self.lock:
+            self.hashes = MultiIndexHash()
+            self.last_id = 0
+            self._catch_up()
+
+    def _catch_up(self):
+        # other workers may have indexed uploads this process has not seen
+        for image_id, phash in self.load_rows(self.last_id):
+            self.hashes.add(int(phash, 16), image_id)
+            self.last_id = max(self.last_id, image_id)
+
+    def add(self, image_id, phash):
+        with self.lock:
+            self._catch_up()
+            if image_id > self.last_id:
+                self.hashes.add(int(phash, 16), image_id)
+                self.last_id = image_id
+
+    def near(self, phash, radius=NEAR_DUPLICATE_DISTANCE):
+        return self.near_all([phash], radius)[0]
+
+    def near_all(self, phashes, radius=NEAR_DUPLICATE_DISTANCE):
+        """near() for each of phashes, catching up with the database once"""
+        with self.lock:
+            self._catch_up()
+            return [self.hashes.search(int(phash, 16), radius) for phash in phashes]
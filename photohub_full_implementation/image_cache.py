@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+"""
+byte budgeted in-memory cache of image responses, using W-TinyLFU
+"""
+from collections import OrderedDict, namedtuple
+import threading
+import time
+
+
+# expires is set by ImageCache.put
+CachedImage = namedtuple("CachedImage", "data mime_type etag last_modified expires", defaults=(None,))
+
+# maps every counter value to half of it, for bytearray.translate
+_HALVE = bytes(i >> 1 for i in range(256))
+
+
+class FrequencySketch:
+    """Count-min sketch of 4 bit counters that halves itself periodically
+
+    The halving keeps the estimates recent, so an image that was popular
+    last week does not keep today's hot images out of the cache.
+    """
+
+    DEPTH = 4
+    SEEDS = (0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D, 0x27D4EB2F)
+
+    def __init__(self, width):
+        self.width = max(64, 1 << (width - 1).bit_length())
+        self.mask = self.width - 1
+        self.rows = [bytearray(self.width) for _ in range(self.DEPTH)]
+        self.sample_size = self.width * 10
+        self.additions = 0
+
+    def _indexes(self, key):
+        h = hash(key)
+        return [((h ^ seed) * 0x01000193 >> 7) & self.mask for seed in self.SEEDS]
+
+    def increment(self, key):
+        for row, i in zip(self.rows, self._indexes(key)):
+            if row[i] < 15:
+                row[i] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            for row in self.rows:
+                row[:] = row.translate(_HALVE)
+            self.additions //= 2
+
+    def frequency(self, key):
+        return min(row[i] for row, i in zip(self.rows, self._indexes(key)))
+
+
+class _Segment:
+    """LRU list that tracks the bytes it holds"""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def add(self, key, value):
+        self.entries[key] = value
+        self.size += len(value.data)
+
+    def remove(self, key):
+        value = self.entries.pop(key)
+        self.size -= len(value.data)
+        return value
+
+    def pop_lru(self):
+        key, value = self.entries.popitem(last=False)
+        self.size -= len(value.data)
+        return key, value
+
+
+class ImageCache:
+    """W-TinyLFU over a byte budget rather than an entry count
+
+    New entries land in a small LRU window. Entries pushed out of the
+    window only enter the main segmented LRU if the sketch says they are
+    requested more often than the entry they would displace, so a crawl
+    over the whole catalog cannot flush the popular thumbnails. Entries
+    older than ttl seconds count as misses, so an image deleted through
+    another process stops being served here too.
+    """
+
+    def __init__(self, max_bytes, max_entry_bytes=None, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # a budget of 0 turns the cache off
+        self.max_entry_bytes = min(max_entry_bytes or max_bytes // 8, max_bytes)
+        window_bytes = max(max_bytes // 100, self.max_entry_bytes)
+        main_bytes = max(max_bytes - window_bytes, 0)
+        self.window = _Segment(window_bytes)
+        self.probation = _Segment(main_bytes // 5)
+        self.protected = _Segment(main_bytes - main_bytes // 5)
+        self.sketch = FrequencySketch(max(max_bytes // (64 * 1024), 64))
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.rejections = 0
+
+    def _expired(self, key):
+        for segment in (self.window, self.probation, self.protected):
+            value = segment.entries.get(key)
+            if value is not None:
+                if value.expires is not None and value.expires <= time.monotonic():
+                    segment.remove(key)
+                    return True
+                return False
+        return False
+
+    def get(self, key):
+        with self.lock:
+            self.sketch.increment(key)
+            if self._expired(key):
+                self.misses += 1
+                return None
+            if key in self.window.entries:
+                self.window.entries.move_to_end(key)
+                value = self.window.entries[key]
+            elif key in self.protected.entries:
+                self.protected.entries.move_to_end(key)
+                value = self.protected.entries[key]
+            elif key in self.probation.entries:
+                # a second hit promotes the entry to the protected segment
+                value = self.probation.remove(key)
+                self.protected.add(key, value)
+                while self.protected.size > self.protected.budget:
+                    demoted_key, demoted = self.protected.pop_lru()
+                    self.probation.add(demoted_key, demoted)
+            else:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if len(value.data) > self.max_entry_bytes:
+            return False
+        if self.ttl:
+            value = value._replace(expires=time.monotonic() + self.ttl)
+        with self.lock:
+            self._expired(key)
+            if key in self.window.entries or key in self.probation.entries or key in self.protected.entries:
+                return True
+            self.window.add(key, value)
+            while self.window.size > self.window.budget:
+                self._admit(*self.window.pop_lru())
+            return True
+
+    def _main_size(self):
+        return self.probation.size + self.protected.size
+
+    def _admit(self, key, value):
+        main_budget = self.probation.budget + self.protected.budget
+        needed = self._main_size() + len(value.data) - main_budget
+        if needed > 0:
+            candidate_frequency = self.sketch.frequency(key)
+            victims = []
+            freed = 0
+            # probation entries go first, each in least recently used order
+            for segment in (self.probation, self.protected):
+                for victim_key, victim in segment.entries.items():
+                    if freed >= needed:
+                        break
+                    if self.sketch.frequency(victim_key) >= candidate_frequency:
+                        self.rejections += 1
+                        return
+                    victims.append((segment, victim_key))
+                    freed += len(victim.data)
+            for segment, victim_key in victims:
+                segment.remove(victim_key)
+                self.evictions += 1
+        self.probation.add(key, value)
+
+    def discard(self, key):
+        with self.lock:
+            for segment in (self.window, self.probation, self.protected):
+                if key in segment.entries:
+                    segment.remove(key)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "rejections": self.rejections,
+                "entries": len(self.window.entries) + len(self.probation.entries) + len(self.protected.entries),
+                "bytes": self.window.size + self._main_size(),
+                "max_bytes": self.max_bytes,
+            }
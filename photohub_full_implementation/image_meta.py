@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""
+works out the metadata stored alongside every image
+"""
+import base64
+import imghdr
+import io
+import zlib
+
+try:
+    from PIL import Image as PILImage, ImageOps, features
+except ImportError:  # Pillow is optional, dimensions are left empty without it
+    PILImage = None
+
+
+class NotAnImage(ValueError):
+    """Raised for bytes in no image format describe_image recognises"""
+
+
+# longest edge of the inline preview; browsers blur it when scaling it up
+PLACEHOLDER_SIZE = 16
+# the length of Image.placeholder; a data URI never grows past it
+PLACEHOLDER_MAX_LENGTH = 1024
+# tried in turn until the data URI fits, JPEG's own tables alone take
+# a few hundred bytes
+_PLACEHOLDER_ENCODINGS = ((PLACEHOLDER_SIZE, 40), (PLACEHOLDER_SIZE, 20), (12, 20), (8, 10))
+
+# EXIF orientations that turn the stored pixels a quarter turn
+_QUARTER_TURNS = (5, 6, 7, 8)
+
+
+def describe_image(fileobj):
+    """Return mime_type, byte_size, crc32, width and height for an open binary file
+
+    width and height are as displayed, after any EXIF rotation, which is
+    also how the renditions are made.
+    """
+    byte_size = 0
+    crc32 = 0
+    # the checksum ZIP downloads need, taken while the bytes are at hand
+    for chunk in iter(lambda: fileobj.read(256 * 1024), b""):
+        byte_size += len(chunk)
+        crc32 = zlib.crc32(chunk, crc32)
+    fileobj.seek(0)
+
+    image_type = imghdr.what(fileobj)
+    fileobj.seek(0)
+    width = height = None
+    if PILImage is not None:
+        try:
+            # only the header is parsed here, pixels are never decoded
+            with PILImage.open(fileobj) as img:
+                width, height = img.size
+                if img.getexif().get(0x0112) in _QUARTER_TURNS:
+                    width, height = height, width
+                if image_type is None and img.format:
+                    image_type = img.format.lower()
+        except Exception:
+            pass
+        fileobj.seek(0)
+
+    return {
+        "mime_type": f"image/{image_type}" if image_type else None,
+        "byte_size": byte_size,
+        "crc32": crc32,
+        "width": width,
+        "height": height,
+    }
+
+
+def placeholder(fileobj, max_length=PLACEHOLDER_MAX_LENGTH):
+    """A data: URI of a tiny preview of at most max_length characters, or None"""
+    if PILImage is None:
+        return None
+    fmt = "WEBP" if features.check("webp") else "JPEG"
+    try:
+        with PILImage.open(fileobj) as img:
+            # only a few pixels survive, so decode at the smallest scale
+            img.draft("RGB", (PLACEHOLDER_SIZE * 4, PLACEHOLDER_SIZE * 4))
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            img.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), PILImage.BILINEAR)
+            for size, quality in _PLACEHOLDER_ENCODINGS:
+                small = img.copy()
+                small.thumbnail((size, size), PILImage.BILINEAR)
+                buf = io.BytesIO()
+                # optimized Huffman tables are the cheapest saving for JPEG
+                small.save(buf, fmt, quality=quality, optimize=True)
+                uri = f"data:image/{fmt.lower()};base64,{base64.b64encode(buf.getvalue()).decode()}"
+                if len(uri) <= max_length:
+                    return uri
+    except Exception:
+        return None
+    finally:
+        fileobj.seek(0)
+    return None
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+"""
+cache friendly responses for image bytes
+"""
+import os
+from urllib.parse import quote
+
+from flask import Response, current_app, request, send_file
+from werkzeug.http import is_resource_modified
+
+
+# image ids never change content, so browsers and proxies may keep them a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# IMAGE_DELIVERY values: stream from the worker, or hand the file to the
+# front server by an internal redirect
+DELIVERY_MODES = ("direct", "x-accel-redirect", "x-sendfile")
+
+
+def _cache_headers(rv, etag, last_modified):
+    rv.set_etag(etag)
+    if last_modified is not None:
+        rv.last_modified = last_modified
+    rv.cache_control.public = True
+    rv.cache_control.max_age = IMMUTABLE_MAX_AGE
+    rv.cache_control.immutable = True
+    return rv
+
+
+def is_not_modified(etag, last_modified):
+    """True when the client copy is current; decided without touching the blob"""
+    if not request.if_none_match and not request.if_modified_since:
+        return False
+    return not is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
+
+def not_modified(etag, last_modified):
+    return _cache_headers(Response(status=304), etag, last_modified)
+
+
+def internal_redirect(path, mimetype):
+    """An empty response telling the front server to send path, or None
+
+    None means the file cannot be handed over: delivery is direct, or the
+    file lies outside IMAGE_ACCEL_ROOT, which nginx cannot reach.
+    """
+    delivery = current_app.config.get("IMAGE_DELIVERY", "direct")
+    if delivery == "direct":
+        return None
+    path = os.path.abspath(path)
+    rv = Response(mimetype=mimetype)
+    if delivery == "x-sendfile":
+        rv.headers["X-Sendfile"] = path
+        return rv
+    relative = os.path.relpath(path, current_app.config["IMAGE_ACCEL_ROOT"])
+    if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        return None
+    rv.headers["X-Accel-Redirect"] = current_app.config["IMAGE_ACCEL_PREFIX"] + quote(relative.replace(os.sep, "/"))
+    return rv
+
+
+def send_image(body, mimetype, etag, last_modified):
+    """Send a path or binary file with validators, immutable caching and Range
+
+    With IMAGE_DELIVERY set, a path is handed to the front server, which
+    then does the Range handling and streams the bytes.
+    """
+    if isinstance(body, str):
+        rv = internal_redirect(body, mimetype)
+        if rv is not None:
+            return _cache_headers(rv, etag, last_modified)
+    # conditional=True makes werkzeug answer Range requests with 206 and
+    # seek into the file instead of reading it from the start
+    rv = send_file(
+            body,
+            mimetype=mimetype,
+            conditional=True,
+            etag=etag,
+            last_modified=last_modified,
+            max_age=IMMUTABLE_MAX_AGE,
+            )
+    return _cache_headers(rv, etag, last_modified)
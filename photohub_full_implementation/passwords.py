@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+"""
+password hashing on a bounded pool, and token buckets to throttle attempts
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusy(Exception):
+    """Raised when more hashes are waiting than the pool accepts"""
+
+
+class PasswordHasher:
+    """Runs password hashing on a fixed number of threads
+
+    hashlib releases the GIL while it hashes, so the pool size is the
+    number of cores logins can occupy at once. Requests beyond
+    max_pending are refused straight away instead of queueing behind a
+    credential stuffing burst.
+    """
+
+    def __init__(self, workers, max_pending):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def _run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            return self.executor.submit(fn, *args).result()
+        finally:
+            self.slots.release()
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def generate(self, password):
+        return self._run(generate_password_hash, password)
+
+
+class RateLimiter:
+    """Token bucket per key: rate tokens per second, holding at most burst
+
+    Buckets are kept for the most recently seen max_keys keys; a key that
+    falls out simply starts again from a full bucket.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key):
+        """0 if a token was taken, otherwise the seconds until one is due"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+            return wait
@@ -1,5 +1,5 @@
 #!/usr/bin/python3
-from flask import Flask, render_template, request, redirect, url_for, session, send_file, flash
+from flask import Flask, Response, render_template, request, redirect, url_for, session, send_file, flash, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import (
         LoginManager,
@@ -10,29 +10,134 @@ from flask_login import (
         current_user,
         )
 from flask_wtf import FlaskForm
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached, object_session
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import DataRequired, Email, EqualTo
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 from flask_uploads import UploadSet, configure_uploads, IMAGES
 import os
 import io
 import imghdr
+import mimetypes
+import zlib
+import re
+import sys
+from collections import Counter
 from datetime import datetime
+import click
+from blob_store import make_blob_store, BlobTooLarge
+from image_meta import describe_image, placeholder, NotAnImage, PLACEHOLDER_MAX_LENGTH
+from renditions import RenditionPipeline, RENDITION_SIZES
+from portfolio_zip import StreamedZip, ZipEntry
+from contact_sheets import ContactSheets, SHEET_DENSITIES, SHEET_PREVIEWS, sheet_layout, sheet_version
+from image_response import DELIVERY_MODES, is_not_modified, not_modified, send_image
+from uploads import UploadSessions, UploadError, CHUNK_SIZE
+from dedupe import DuplicateIndex, dhash
+from bulk import iter_uploaded_files, iter_directory
+from image_cache import ImageCache, CachedImage
+from passwords import PasswordHasher, HasherBusy, RateLimiter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import photohub_db
+from photohub_db.pagination import keyset, page_of, page_size_arg, BadCursor
+from photohub_db.cache import make_cache, MISSING
+from photohub_db.orm import RoutingSession
 
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("FLASK_SECRET_KEY", "default_secret_key")
-app.config["SQLALCHEMY_DATABASE_URI"] = "mysql://root:@localhost/photohub"
+app.config.from_mapping(photohub_db.config_from_env())
+app.config["SQLALCHEMY_DATABASE_URI"] = app.config["DATABASE_URL"]
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = photohub_db.engine_options(app.config)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["UPLOADED_IMAGES_DEST"] = "uploads/images"
+app.config["BLOB_STORE_BACKEND"] = os.environ.get("BLOB_STORE_BACKEND", "filesystem")
+app.config["BLOB_STORE_ROOT"] = os.environ.get("BLOB_STORE_ROOT", "uploads/blobs")
+app.config["RENDITION_ROOT"] = os.environ.get("RENDITION_ROOT", "uploads/renditions")
+# 0 draws renditions and variants inline, in the request that needs them
+app.config["RENDITION_WORKERS"] = int(os.environ.get("RENDITION_WORKERS", 2))
+# variant formats to store and offer, dropped when Pillow cannot write them
+app.config["RENDITION_FORMATS"] = os.environ.get("RENDITION_FORMATS", "avif,webp")
+app.config["MAX_UPLOAD_BYTES"] = int(os.environ.get("MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+# werkzeug refuses larger request bodies with a 413 before parsing them
+app.config["MAX_CONTENT_LENGTH"] = app.config["MAX_UPLOAD_BYTES"] + 64 * 1024
+app.config["UPLOAD_SESSION_ROOT"] = os.environ.get("UPLOAD_SESSION_ROOT", "uploads/sessions")
+# resumable uploads nothing was sent to for this many seconds are removed
+app.config["UPLOAD_SESSION_TTL"] = int(os.environ.get("UPLOAD_SESSION_TTL", 24 * 60 * 60))
+app.config["MAX_OPEN_UPLOADS"] = int(os.environ.get("MAX_OPEN_UPLOADS", 10))
+app.config["MAX_BULK_UPLOAD_BYTES"] = int(os.environ.get("MAX_BULK_UPLOAD_BYTES", 2 * 1024 * 1024 * 1024))
+app.config["BULK_BATCH_SIZE"] = int(os.environ.get("BULK_BATCH_SIZE", 50))
+app.config["PAGE_SIZE"] = int(os.environ.get("PAGE_SIZE", 24))
+app.config["CACHE_BACKEND"] = os.environ.get("CACHE_BACKEND", "memory")
+app.config["CACHE_PATH"] = os.environ.get("CACHE_PATH", "uploads/cache.sqlite3")
+app.config["CACHE_MAX_ENTRIES"] = int(os.environ.get("CACHE_MAX_ENTRIES", 1024))
+app.config["CACHE_DEFAULT_TTL"] = int(os.environ.get("CACHE_DEFAULT_TTL", 300))
+# direct streams files from the worker; x-accel-redirect (nginx) and
+# x-sendfile (Apache, lighttpd) leave it to the front server, see deploy/
+app.config["IMAGE_DELIVERY"] = os.environ.get("IMAGE_DELIVERY", "direct").lower()
+if app.config["IMAGE_DELIVERY"] not in DELIVERY_MODES:
+    raise ValueError(f"IMAGE_DELIVERY must be one of {', '.join(DELIVERY_MODES)}")
+# the directory nginx serves under IMAGE_ACCEL_PREFIX, holding blobs and renditions
+app.config["IMAGE_ACCEL_ROOT"] = os.path.abspath(os.environ.get("IMAGE_ACCEL_ROOT", "uploads"))
+app.config["IMAGE_ACCEL_PREFIX"] = os.environ.get("IMAGE_ACCEL_PREFIX", "/_photohub_files/")
+# when the front server sends the files, keeping their bytes here only
+# puts them back through the worker
+app.config["IMAGE_CACHE_BYTES"] = int(os.environ.get(
+        "IMAGE_CACHE_BYTES", 64 * 1024 * 1024 if app.config["IMAGE_DELIVERY"] == "direct" else 0))
+app.config["IMAGE_CACHE_MAX_ENTRY_BYTES"] = int(os.environ.get("IMAGE_CACHE_MAX_ENTRY_BYTES", 2 * 1024 * 1024))
+# a delete only clears the cache of the process that handled it, the
+# others keep serving the image for at most this many seconds
+app.config["IMAGE_CACHE_TTL"] = int(os.environ.get("IMAGE_CACHE_TTL", 60))
+app.config["USER_CACHE_TTL"] = int(os.environ.get("USER_CACHE_TTL", 60))
+app.config["PASSWORD_HASH_WORKERS"] = int(os.environ.get("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+app.config["PASSWORD_HASH_MAX_PENDING"] = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 16))
+# attempts per minute, with bursts of twice that
+app.config["LOGIN_ATTEMPTS_PER_IP"] = int(os.environ.get("LOGIN_ATTEMPTS_PER_IP", 10))
+app.config["LOGIN_ATTEMPTS_PER_USERNAME"] = int(os.environ.get("LOGIN_ATTEMPTS_PER_USERNAME", 5))
+# reverse proxies in front of the app (1 behind deploy/nginx.conf); their
+# X-Forwarded-* headers give the client address the login limits key on
+app.config["TRUSTED_PROXIES"] = int(os.environ.get("TRUSTED_PROXIES", 0))
+if app.config["TRUSTED_PROXIES"]:
+    proxies = app.config["TRUSTED_PROXIES"]
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
 images = UploadSet("images", IMAGES)
 configure_uploads(app, images)
 
-db = SQLAlchemy(app)
+# GET requests read from DATABASE_REPLICA_URLS when set, see photohub_db.ReadReplicas
+db = SQLAlchemy(app, session_options={"class_": RoutingSession})
+with app.app_context():
+    photohub_db.prepare_engine(db.engine, app.config)
+    instrumentation = photohub_db.Instrumentation(app, db.engine)
+    replicas = photohub_db.ReadReplicas(app, db.engine)
 login_manager = LoginManager(app)
-login_manager.login_view = "login"
+login_manager.login_view = "photographer_login"
+blob_store = make_blob_store(app.config)
+renditions = RenditionPipeline(
+        app.config["RENDITION_ROOT"],
+        app.config["RENDITION_WORKERS"],
+        [fmt.strip() for fmt in app.config["RENDITION_FORMATS"].split(",") if fmt.strip()],
+        )
+contact_sheets = ContactSheets(os.path.join(app.config["RENDITION_ROOT"], "sheets"), renditions)
+DEFAULT_PAGE_SIZE = app.config["PAGE_SIZE"]
+cache = make_cache(app.config)
+image_cache = ImageCache(
+        app.config["IMAGE_CACHE_BYTES"],
+        app.config["IMAGE_CACHE_MAX_ENTRY_BYTES"],
+        app.config["IMAGE_CACHE_TTL"],
+        )
+upload_sessions = UploadSessions(
+        app.config["UPLOAD_SESSION_ROOT"],
+        app.config["MAX_UPLOAD_BYTES"],
+        app.config["UPLOAD_SESSION_TTL"],
+        app.config["MAX_OPEN_UPLOADS"],
+        )
+password_hasher = PasswordHasher(app.config["PASSWORD_HASH_WORKERS"], app.config["PASSWORD_HASH_MAX_PENDING"])
+ip_attempts = RateLimiter(app.config["LOGIN_ATTEMPTS_PER_IP"] / 60, app.config["LOGIN_ATTEMPTS_PER_IP"] * 2)
+username_attempts = RateLimiter(app.config["LOGIN_ATTEMPTS_PER_USERNAME"] / 60, app.config["LOGIN_ATTEMPTS_PER_USERNAME"] * 2)
+search_index = photohub_db.PhotographerSearch(app.config["SEARCH_INDEX_PATH"])
 
 
 class User(UserMixin, db.Model):
@@ -40,25 +145,472 @@ class User(UserMixin, db.Model):
     preferred_username = db.Column(db.String(50), unique=True)
     email = db.Column(db.String(256), unique=True, nullable=False)
     password = db.Column(db.String(256))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, server_default=db.func.now())
     images = db.relationship("Image", backref="user", lazy=True)
 
+    __table_args__ = (db.Index("ix_user_created", "created_at", "id"),)
+
 
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, server_default=db.func.now())
     images = db.relationship("Image", backref="category", lazy=True)
 
 
 class Image(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    image_data = db.Column(db.LargeBinary(length=(2**32)-1))
+    # sha256 of the bytes held by blob_store
+    blob_key = db.Column(db.String(64), index=True)
+    # legacy in-database copy, emptied by `flask migrate-blobs`; deferred so
+    # listing queries never pull the bytes
+    image_data = db.deferred(db.Column(db.LargeBinary(length=(2**32)-1)))
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     category_id = db.Column(db.Integer, db.ForeignKey("category.id"), nullable=False)
+    # filled once at upload time
+    mime_type = db.Column(db.String(32))
+    byte_size = db.Column(db.Integer)
+    # checksum of the stored bytes, which ZIP downloads need up front
+    crc32 = db.Column(db.BigInteger)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    # inline preview shown until the browser loads the image itself
+    placeholder = db.Column(db.String(PLACEHOLDER_MAX_LENGTH))
+    content_hash = db.Column(db.String(64))
+    uploaded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, server_default=db.func.now())
+    # perceptual hash, and the closest earlier image when it is a near copy
+    phash = db.Column(db.String(16))
+    near_duplicate_of = db.Column(db.Integer)
+
+    # keyset pagination seeks on (uploaded_at, id) within a user or category
+    __table_args__ = (
+            db.Index("ix_image_user_uploaded", "user_id", "category_id", "uploaded_at", "id"),
+            db.Index("ix_image_category_uploaded", "category_id", "user_id", "uploaded_at", "id"),
+            )
+
+    def set_metadata(self, fileobj):
+        for name, value in describe_image(fileobj).items():
+            setattr(self, name, value)
+        self.placeholder = placeholder(fileobj)
+
+
+class CategoryStats(db.Model):
+    """Running totals per category, changed in the same transaction as Image"""
+    category_id = db.Column(db.Integer, db.ForeignKey("category.id"), primary_key=True)
+    image_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    photographer_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+
+class PhotographerCategoryStats(db.Model):
+    """Images each photographer has in a category
+
+    The photographer's created_at is copied here so browse pages can seek
+    through a category's photographers on this table's index alone.
+    """
+    category_id = db.Column(db.Integer, db.ForeignKey("category.id"), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    image_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    user_created_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (db.Index("ix_photographer_stats_browse", "category_id", "user_created_at", "user_id"),)
+
+
+class ContactSheet(db.Model):
+    """Where each of a photographer's newest previews in a category sits in one image
+
+    tiles is a list of {"id", "x", "width", "height"} in 1x pixels; the
+    sheet file itself is named by version.
+    """
+    category_id = db.Column(db.Integer, db.ForeignKey("category.id"), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    version = db.Column(db.String(16), nullable=False)
+    tiles = db.Column(db.JSON, nullable=False)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+
+
+# INSERT ... ON CONFLICT / ON DUPLICATE KEY for the dialects PhotoHub runs on
+UPSERT_INSERTS = {"mysql": mysql.insert, "postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _add_category_images(category_id, delta):
+    insert = UPSERT_INSERTS[db.engine.dialect.name]
+    stmt = insert(CategoryStats).values(category_id=category_id, image_count=delta, photographer_count=0)
+    new_count = CategoryStats.image_count + delta
+    if db.engine.dialect.name == "mysql":
+        stmt = stmt.on_duplicate_key_update(image_count=new_count)
+    else:
+        stmt = stmt.on_conflict_do_update(index_elements=[CategoryStats.category_id], set_={"image_count": new_count})
+    db.session.execute(stmt)
+
+
+def count_images(deltas):
+    """Apply {(category_id, user_id): change} to the stats tables
+
+    Runs inside the caller's transaction. The category row is written
+    first, and its row lock makes concurrent uploads to one category take
+    turns, so a photographer's first or last image there is counted once.
+    Returns the (user_id, category_id) pairs that dropped to no images.
+    """
+    by_category = {}
+    for (category_id, user_id), delta in deltas.items():
+        if delta:
+            by_category.setdefault(category_id, {})[user_id] = delta
+    emptied = set()
+    for category_id in sorted(by_category):
+        users = by_category[category_id]
+        _add_category_images(category_id, sum(users.values()))
+        before = dict(db.session.execute(
+                db.select(PhotographerCategoryStats.user_id, PhotographerCategoryStats.image_count)
+                .where(PhotographerCategoryStats.category_id == category_id,
+                       PhotographerCategoryStats.user_id.in_(users))
+                .with_for_update()
+                ).all())
+        missing = [user_id for user_id in users if user_id not in before]
+        created = dict(db.session.execute(
+                db.select(User.id, User.created_at).where(User.id.in_(missing))).all()) if missing else {}
+        joined = 0
+        for user_id, delta in users.items():
+            if user_id in before:
+                db.session.execute(
+                        db.update(PhotographerCategoryStats)
+                        .where(PhotographerCategoryStats.category_id == category_id,
+                               PhotographerCategoryStats.user_id == user_id)
+                        .values(image_count=PhotographerCategoryStats.image_count + delta))
+            else:
+                db.session.execute(db.insert(PhotographerCategoryStats).values(
+                        category_id=category_id, user_id=user_id, image_count=delta,
+                        user_created_at=created[user_id]))
+            old = before.get(user_id, 0)
+            joined += (old + delta > 0) - (old > 0)
+            if old > 0 and old + delta <= 0:
+                emptied.add((user_id, category_id))
+        if joined:
+            db.session.execute(
+                    db.update(CategoryStats)
+                    .where(CategoryStats.category_id == category_id)
+                    .values(photographer_count=CategoryStats.photographer_count + joined))
+    return emptied
+
+
+def refresh_contact_sheets(pairs, redraw=False):
+    """Lay out the sheet of each (user_id, category_id) pair from its newest images
+
+    Runs inside the caller's transaction, after count_images has locked
+    the categories involved. Returns (drawn, superseded): the sheets to
+    draw once it commits, as (version, sources, width, height), and the
+    versions nothing refers to any more. With redraw, sheets whose
+    layout did not change are returned to be drawn too.
+    """
+    drawn, superseded = [], []
+    for user_id, category_id in sorted(pairs):
+        where = (ContactSheet.user_id == user_id, ContactSheet.category_id == category_id)
+        old = db.session.execute(db.select(ContactSheet.version).where(*where)).scalar()
+        images = db.session.execute(
+                db.select(Image.id, Image.blob_key, Image.width, Image.height)
+                .where(Image.user_id == user_id, Image.category_id == category_id,
+                       Image.blob_key.isnot(None), Image.width.isnot(None), Image.height.isnot(None))
+                .order_by(Image.uploaded_at.desc(), Image.id.desc())
+                .limit(SHEET_PREVIEWS)
+                ).all() if contact_sheets.enabled else []
+        src_paths = [blob_store.path(image.blob_key) for image in images]
+        version = None
+        if images and all(src_paths):
+            tiles, width, height = sheet_layout(images)
+            version = sheet_version(images, tiles)
+        if version == old:
+            if redraw and version is not None:
+                drawn.append((version, list(zip(src_paths, tiles)), width, height))
+            continue
+        if old is not None:
+            db.session.execute(db.delete(ContactSheet).where(*where))
+            superseded.append(old)
+        if version is not None:
+            db.session.execute(db.insert(ContactSheet).values(
+                    user_id=user_id, category_id=category_id, version=version,
+                    tiles=tiles, width=width, height=height))
+            drawn.append((version, list(zip(src_paths, tiles)), width, height))
+    return drawn, superseded
+
+
+def draw_contact_sheets(drawn, superseded):
+    """Queue the sheets refresh_contact_sheets laid out, once they are committed"""
+    for version, sources, width, height in drawn:
+        contact_sheets.submit(version, sources, width, height)
+    for version in superseded:
+        contact_sheets.delete(version)
+        for density in SHEET_DENSITIES:
+            image_cache.discard(("sheet", version, density))
+
+
+def reconcile_stats():
+    """Rebuild both stats tables from Image in one transaction
+
+    Uploads that commit while this runs can be counted twice or not at
+    all, so run it while uploads are quiet.
+    """
+    db.session.execute(db.delete(CategoryStats))
+    db.session.execute(db.delete(PhotographerCategoryStats))
+    db.session.execute(db.insert(PhotographerCategoryStats).from_select(
+            ["category_id", "user_id", "image_count", "user_created_at"],
+            db.select(Image.category_id, Image.user_id, db.func.count(Image.id), User.created_at)
+            .join(User, User.id == Image.user_id)
+            .group_by(Image.category_id, Image.user_id, User.created_at),
+            ))
+    db.session.execute(db.insert(CategoryStats).from_select(
+            ["category_id", "image_count", "photographer_count"],
+            db.select(
+                Category.id,
+                db.func.coalesce(db.func.sum(PhotographerCategoryStats.image_count), 0),
+                db.func.count(PhotographerCategoryStats.user_id),
+                )
+            .outerjoin(PhotographerCategoryStats, PhotographerCategoryStats.category_id == Category.id)
+            .group_by(Category.id),
+            ))
+    db.session.commit()
+
+
+def _phash_rows(after_id):
+    return (
+            db.session.query(Image.id, Image.phash)
+            .filter(Image.id > after_id, Image.phash.isnot(None))
+            .order_by(Image.id)
+            .all()
+            )
+
+
+duplicate_index = DuplicateIndex(_phash_rows)
+
+
+# columns listing pages need; the blob and hashes are never selected
+IMAGE_LISTING_COLUMNS = (
+        Image.id,
+        Image.user_id,
+        Image.category_id,
+        Image.mime_type,
+        Image.width,
+        Image.height,
+        Image.placeholder,
+        Image.uploaded_at,
+        )
+
+
+def _image_key(row):
+    return row.uploaded_at, row.id
+
+
+def photographer_images_page(user_id, category_id, cursor=None, page_size=None):
+    """One page of a photographer's images in a category, newest first"""
+    page_size = page_size or DEFAULT_PAGE_SIZE
+    stmt = db.select(*IMAGE_LISTING_COLUMNS).where(
+            Image.user_id == user_id, Image.category_id == category_id)
+    stmt = keyset(stmt, Image.uploaded_at, Image.id, cursor, page_size)
+    return page_of(db.session.execute(stmt).all(), page_size, _image_key)
+
+
+def all_categories():
+    """Every category as (id, name, created_at) rows, served from the cache"""
+    return cache.get_or_set("categories", "all", lambda: db.session.execute(
+            db.select(Category.id, Category.name, Category.created_at)
+            .order_by(Category.created_at, Category.id)
+            ).all(), refresh=replicas.pinned())
+
+
+def first_image_pages(user_id, page_size):
+    """The first page of a photographer's images in every category at once
+
+    ROW_NUMBER per category replaces one query per category; the extra
+    row per category is the look-ahead page_of needs for next_cursor.
+    """
+    rank = db.func.row_number().over(
+            partition_by=Image.category_id,
+            order_by=(Image.uploaded_at.desc(), Image.id.desc()),
+            ).label("rank")
+    ranked = (
+            db.select(*IMAGE_LISTING_COLUMNS, rank)
+            .where(Image.user_id == user_id)
+            .subquery()
+            )
+    grouped = {}
+    for row in db.session.execute(
+            db.select(ranked)
+            .where(ranked.c.rank <= page_size + 1)
+            .order_by(ranked.c.category_id, ranked.c.rank)
+            ):
+        grouped.setdefault(row.category_id, []).append(row)
+    return {
+            category_id: page_of(rows, page_size, _image_key)
+            for category_id, rows in grouped.items()
+            }
+
+
+def categories_page(cursor=None, page_size=None):
+    """A page of categories with their image and photographer counts"""
+    page_size = page_size or DEFAULT_PAGE_SIZE
+    stmt = (
+            db.select(
+                Category.id,
+                Category.name,
+                Category.created_at,
+                db.func.coalesce(CategoryStats.image_count, 0).label("image_count"),
+                db.func.coalesce(CategoryStats.photographer_count, 0).label("photographer_count"),
+                )
+            .outerjoin(CategoryStats, CategoryStats.category_id == Category.id)
+            )
+    stmt = keyset(stmt, Category.created_at, Category.id, cursor, page_size, descending=False)
+    return page_of(db.session.execute(stmt).all(), page_size, lambda c: (c.created_at, c.id))
+
+
+def latest_images_by_photographer(category_id, cursor=None, page_size=None, per_photographer=4):
+    """A page of photographers with images in a category, each with their newest few
+
+    The photographers are a keyset page over (created_at, id), read from
+    PhotographerCategoryStats rather than by probing Image. A single
+    windowed query (MySQL 8 and SQLite >= 3.25 both have ROW_NUMBER) then
+    fetches the previews for just that page, so the cost follows the
+    number of images shown rather than the number stored.
+    """
+    page_size = page_size or DEFAULT_PAGE_SIZE
+    stats = PhotographerCategoryStats
+    stmt = keyset(
+            db.select(User.id, User.preferred_username, stats.user_created_at.label("created_at"), stats.image_count)
+            .join(User, User.id == stats.user_id)
+            .where(stats.category_id == category_id, stats.image_count > 0),
+            stats.user_created_at, stats.user_id, cursor, page_size,
+            )
+    stmt = stmt.outerjoin(ContactSheet, db.and_(
+            ContactSheet.category_id == stats.category_id, ContactSheet.user_id == stats.user_id,
+            )).add_columns(
+            ContactSheet.version.label("sheet_version"), ContactSheet.tiles.label("sheet_tiles"),
+            ContactSheet.width.label("sheet_width"), ContactSheet.height.label("sheet_height"),
+            )
+    users, next_cursor = page_of(db.session.execute(stmt).all(), page_size, lambda u: (u.created_at, u.id))
+    if not users:
+        return [], None
+
+    rank = db.func.row_number().over(
+            partition_by=Image.user_id,
+            order_by=(Image.uploaded_at.desc(), Image.id.desc()),
+            ).label("rank")
+    ranked = (
+            db.select(*IMAGE_LISTING_COLUMNS, rank)
+            .where(Image.category_id == category_id, Image.user_id.in_([u.id for u in users]))
+            .subquery()
+            )
+    previews = {}
+    for row in db.session.execute(
+            db.select(ranked)
+            .where(ranked.c.rank <= per_photographer)
+            .order_by(ranked.c.user_id, ranked.c.rank)
+            ):
+        previews.setdefault(row.user_id, []).append(row)
+
+    photographers = [
+            {
+                "id": u.id,
+                "preferred_username": u.preferred_username,
+                "image_count": u.image_count,
+                "images": previews.get(u.id, []),
+                "sheet": {
+                    "user_id": u.id,
+                    "category_id": category_id,
+                    "version": u.sheet_version,
+                    "tiles": u.sheet_tiles,
+                    "width": u.sheet_width,
+                    "height": u.sheet_height,
+                    } if u.sheet_version else None,
+                }
+            for u in users
+            ]
+    return photographers, next_cursor
+
+
+def image_json(row):
+    return {
+            "id": row.id,
+            "category_id": row.category_id,
+            "mime_type": row.mime_type,
+            "width": row.width,
+            "height": row.height,
+            "placeholder": row.placeholder,
+            "uploaded_at": row.uploaded_at.isoformat(),
+            "url": url_for("get_image", image_id=row.id),
+            "thumbnail_url": url_for("get_image_rendition", image_id=row.id, size=RENDITION_SIZES[0]),
+            }
+
+
+def sheet_json(sheet):
+    return {
+            "urls": {
+                f"{density}x": url_for("get_contact_sheet", user_id=sheet["user_id"], category_id=sheet["category_id"],
+                                       version=sheet["version"], density=density)
+                for density in SHEET_DENSITIES
+                },
+            "width": sheet["width"],
+            "height": sheet["height"],
+            "tiles": sheet["tiles"],
+            }
+
+
+# the password hash is left out, it is loaded only if something reads it
+SESSION_USER_COLUMNS = ("id", "preferred_username", "email", "created_at")
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    """The session user, from the cache for up to USER_CACHE_TTL seconds
+
+    The cached columns are merged into the session without a query, so
+    current_user is still a User and relationships load as usual.
+    """
+    user_id = int(user_id)
+    cached = cache.get(f"user:{user_id}", "session")
+    if cached is MISSING:
+        user = db.session.get(User, user_id)
+        # unknown ids are not cached, the id may be about to be created
+        if user is not None:
+            cache.set(f"user:{user_id}", "session", {name: getattr(user, name) for name in SESSION_USER_COLUMNS},
+                      ttl=app.config["USER_CACHE_TTL"])
+        return user
+    user = User(**cached)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+@db.event.listens_for(User, "after_update")
+@db.event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, user):
+    # dropped once the change commits: dropping it during the flush would
+    # let another request cache the old row again before the commit
+    object_session(user).info.setdefault("photohub_changed_users", set()).add(user.id)
+
+
+@db.event.listens_for(db.session, "after_commit")
+def _user_changes_committed(session):
+    for user_id in session.info.pop("photohub_changed_users", ()):
+        cache.invalidate(f"user:{user_id}")
+
+
+@db.event.listens_for(db.session, "after_rollback")
+def _user_changes_rolled_back(session):
+    session.info.pop("photohub_changed_users", None)
+
+
+def throttle_login(username=None):
+    """Seconds to wait before this client may try again, or 0"""
+    wait = ip_attempts.take(request.remote_addr)
+    if username:
+        wait = max(wait, username_attempts.take(username.lower()))
+    return wait
+
+
+def too_many_attempts(wait):
+    return "Too many attempts, please try again later.", 429, {"Retry-After": str(int(wait) + 1)}
+
+
+@app.errorhandler(HasherBusy)
+def hasher_busy(error):
+    return "The server is busy, please try again.", 503, {"Retry-After": "1"}
 
 
 @app.route("/")
@@ -84,9 +636,13 @@ def photographer_login():
         username = form.username.data
         password = form.password.data
 
+        wait = throttle_login(username)
+        if wait:
+            return too_many_attempts(wait)
+
         user = User.query.filter_by(preferred_username=username).first()
 
-        if user and check_password_hash(user.password, password):
+        if user and password_hasher.check(user.password, password):
             login_user(user)
             flash('Login successful!', 'success')
             return redirect(url_for("dashboard"))
@@ -113,6 +669,10 @@ def photographers_signup():
         email = form.email.data
         password = form.password.data
 
+        wait = throttle_login()
+        if wait:
+            return too_many_attempts(wait)
+
         # Validate username uniqueness
         existing_user = User.query.filter_by(preferred_username=preferred_username).first()
         if existing_user:
@@ -120,7 +680,7 @@ def photographers_signup():
             return redirect(url_for("photographers_signup"))
 
         # Hash the password
-        hashed_password = generate_password_hash(password)
+        hashed_password = password_hasher.generate(password)
 
         # Insert the new user into the database
         new_user = User(preferred_username=preferred_username, email=email, password=hashed_password)
@@ -129,6 +689,7 @@ def photographers_signup():
         try:
             # Attempt to commit changes to the database
             db.session.commit()
+            search_index.upsert(new_user.preferred_username, user_id=new_user.id, created_at=new_user.created_at)
             login_user(new_user)
             flash("Your account has been created!", "success")
             return redirect(url_for("dashboard"))
@@ -146,57 +707,488 @@ def photographers_signup():
 @app.route("/dashboard")
 @login_required
 def dashboard():
-    user_images = db.session.get(User, current_user.id).images
-    categories = Category.query.all()
+    categories = all_categories()
+    category_images = sectioned_images(current_user.id, categories)
+
+    return render_template(
+            "dashboard.html",
+            categories=categories,
+            category_images=category_images,
+            form=DashboardForm(),
+            )
+
+
+def sectioned_images(user_id, categories):
+    """First page of images for each category section
+
+    ?category=<id>&cursor=<next> pages through one section on its own.
+    The query count is the same however many categories exist.
+    """
+    page_size = page_size_arg(request.args, DEFAULT_PAGE_SIZE)
+    only = request.args.get("category", type=int)
+    if only:
+        pages = {only: photographer_images_page(user_id, only, request.args.get("cursor"), page_size)}
+    else:
+        pages = first_image_pages(user_id, page_size)
     category_images = {}
     for category in categories:
+        if only and category.id != only:
+            continue
+        images, next_cursor = pages.get(category.id, ([], None))
         category_images[category.id] = {
                 "category_name": category.name,
-                "images": Image.query.filter_by(category_id=category.id, user_id=current_user.id).all(),
+                "images": images,
+                "next_cursor": next_cursor,
                 }
+    return category_images
 
-    return render_template(
-            "dashboard.html",
-            user_images=user_images,
-            categories=categories,
-            category_images=category_images,
+
+def prepare_image(fileobj, user_id, category_id):
+    """Copy a stream into the blob store and describe it as an unsaved Image
+
+    Nothing touches the database, so a batch of prepared images can be
+    checked for duplicates by add_images at once. Raises NotAnImage for
+    bytes that are no image, after dropping them from the store.
+    """
+    blob_key = blob_store.put_file(fileobj, max_bytes=app.config["MAX_UPLOAD_BYTES"])
+    image = Image(
+            blob_key=blob_key,
+            content_hash=blob_key,
+            user_id=user_id,
+            category_id=int(category_id),
             )
+    with blob_store.open(blob_key) as f:
+        image.set_metadata(f)
+        if image.mime_type is not None:
+            image.phash = dhash(f)
+    if image.mime_type is None:
+        # rows stored before uploads were checked may still point at it
+        if not db.session.execute(db.select(Image.id).where(Image.blob_key == blob_key).limit(1)).first():
+            blob_store.delete(blob_key)
+        raise NotAnImage("not an image")
+    return image
+
+
+def add_images(prepared):
+    """Add the prepared images that are not stored yet to the session
+
+    Returns (image, is_new) for each, in order. The same bytes in the same
+    category are recorded once per photographer, whether they were stored
+    before or appear earlier in prepared; other categories get a new row
+    pointing at the one stored blob. One query finds the stored copies and
+    the duplicate index catches up once for the whole batch.
+    """
+    if not prepared:
+        return []
+    with db.session.no_autoflush:
+        stored = db.session.execute(
+                db.select(Image).where(
+                    Image.blob_key.in_({image.blob_key for image in prepared}),
+                    Image.user_id.in_({image.user_id for image in prepared}),
+                    )
+                ).scalars()
+        seen = {(image.blob_key, image.user_id, image.category_id): image for image in stored}
+    hashed = [image for image in prepared if image.phash]
+    matches = dict(zip(map(id, hashed), duplicate_index.near_all([image.phash for image in hashed])))
+
+    results = []
+    for image in prepared:
+        key = (image.blob_key, image.user_id, image.category_id)
+        if key in seen:
+            results.append((seen[key], False))
+            continue
+        if matches.get(id(image)):
+            image.near_duplicate_of = matches[id(image)][0][1]
+        db.session.add(image)
+        seen[key] = image
+        results.append((image, True))
+    return results
+
+
+def commit_images(images):
+    """Commit newly added images and run the work that follows an upload"""
+    # flushing first assigns ids without the per-row reload a commit forces
+    db.session.flush()
+    added = [(i.id, i.blob_key, i.mime_type, int(i.category_id), int(i.user_id)) for i in images]
+    pairs = Counter((added_image[3], added_image[4]) for added_image in added)
+    count_images(pairs)
+    sheets = refresh_contact_sheets({(user_id, category_id) for category_id, user_id in pairs})
+    db.session.commit()
+
+    # the duplicate index picks the new hashes up from the database on its next lookup
+    for image_id, blob_key, mime_type, category_id, user_id in added:
+        # thumbnails are produced by the worker pool, not this request
+        if mime_type and blob_store.path(blob_key):
+            renditions.submit(blob_store.path(blob_key), blob_key, mime_type)
+    draw_contact_sheets(*sheets)
+    # the browse pages of these categories and the category counts are the
+    # only cached data it changes
+    for category_id in {added_image[3] for added_image in added}:
+        cache.invalidate(f"category:{category_id}")
+    cache.invalidate("category_counts")
+    # photographers become findable by the categories they upload to
+    search_index.add_categories({(added_image[4], added_image[3]) for added_image in added})
+
+
+def existing_category_id(value):
+    """The id of the category value names, or None when there is no such category
+
+    Looked up rather than trusted: an unknown id would leave an orphan
+    image on sqlite and fail on MySQL's foreign key after the blob is
+    written.
+    """
+    try:
+        category_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return category_id if db.session.get(Category, category_id) is not None else None
+
+
+def store_image(fileobj, user_id, category_id):
+    """Copy an uploaded stream into the blob store and record it"""
+    [(image, is_new)] = add_images([prepare_image(fileobj, user_id, category_id)])
+    if is_new:
+        commit_images([image])
+    return image
+
+
+def ingest(entries, user_id, default_category_id=None, batch_size=None):
+    """Store a stream of bulk upload entries, committing once per batch
+
+    Entries whose top folder matches a category name go to that category,
+    the rest to default_category_id. Returns a report with one dict per
+    entry.
+    """
+    batch_size = batch_size or app.config["BULK_BATCH_SIZE"]
+    categories = {c.name.lower(): c.id for c in all_categories()}
+    report = []
+    batch = []
+
+    for entry in entries:
+        item = {"name": entry.name}
+        report.append(item)
+        category_id = categories.get((entry.folder or "").lower(), default_category_id)
+        if category_id is None:
+            item.update(status="skipped", reason="no category")
+            continue
+        if entry.size and entry.size > app.config["MAX_UPLOAD_BYTES"]:
+            item.update(status="skipped", reason="too large")
+            continue
+        try:
+            with entry.open() as f:
+                batch.append((item, prepare_image(f, user_id, category_id)))
+        except BlobTooLarge:
+            item.update(status="skipped", reason="too large")
+            continue
+        except NotAnImage:
+            item.update(status="skipped", reason="not an image")
+            continue
+        except Exception as e:
+            item.update(status="error", reason=str(e))
+            continue
+        item["category_id"] = category_id
+        if len(batch) >= batch_size:
+            _commit_batch(batch)
+            batch = []
+    _commit_batch(batch)
+    return report
+
+
+def _commit_batch(batch):
+    results = add_images([image for item, image in batch])
+    if not results:
+        return
+    db.session.flush()
+    for (item, _), (image, is_new) in zip(batch, results):
+        item.update(status="stored" if is_new else "duplicate", image_id=image.id)
+        if is_new and image.near_duplicate_of:
+            item["near_duplicate_of"] = image.near_duplicate_of
+    new_images = [image for image, is_new in results if is_new]
+    if new_images:
+        commit_images(new_images)
+    else:
+        db.session.commit()
+
+
+class DashboardForm(FlaskForm):
+    """No fields, only the CSRF token of the dashboard's upload and delete forms"""
 
 
 @app.route("/upload", methods=["POST"])
 @login_required
 def upload():
+    if not DashboardForm().validate_on_submit():
+        abort(400)
     if "file" in request.files and "category" in request.form:
         file = request.files["file"]
-        category_id = request.form["category"]
+        category_id = existing_category_id(request.form["category"])
 
-        if file.filename != "":
-            file_data = file.read()
+        if category_id is None:
+            flash("Choose a category to upload to.", "error")
+        elif file.filename != "":
+            try:
+                image = store_image(file.stream, current_user.id, category_id)
+                if image.near_duplicate_of:
+                    flash("This photo looks like one that was already uploaded.", "warning")
+            except BlobTooLarge:
+                flash("That file is too large to upload.", "error")
+            except NotAnImage:
+                flash("That file is not an image.", "error")
 
-            new_image = Image(
-                    image_data=file_data, user_id=current_user.id, category_id=category_id
-                    )
-            db.session.add(new_image)
-            db.session.commit()
+    return redirect(url_for("dashboard"))
 
+
+@app.route("/upload/bulk", methods=["POST"])
+@login_required
+def upload_bulk():
+    # a bulk request may be far larger than a single upload (Flask >= 3.1)
+    request.max_content_length = app.config["MAX_BULK_UPLOAD_BYTES"]
+    if not DashboardForm().validate_on_submit():
+        abort(400)
+    # files in no category folder go to this one
+    category_id = None
+    if request.form.get("category"):
+        category_id = existing_category_id(request.form["category"])
+        if category_id is None:
+            if request.accept_mimetypes.best == "application/json":
+                return jsonify(error="Unknown category"), 400
+            flash("Choose a category to upload to.", "error")
+            return redirect(url_for("dashboard"))
+    # werkzeug has already spooled each file to a temporary file by now,
+    # so memory stays flat but the whole body is on disk before ingest
+    # starts; only the resumable /uploads API is stored as it arrives
+    report = ingest(iter_uploaded_files(request.files.getlist("files")), current_user.id, category_id)
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(report=report)
+    stored = sum(item["status"] == "stored" for item in report)
+    flash(f"Uploaded {stored} of {len(report)} files.", "success")
     return redirect(url_for("dashboard"))
 
 
+@app.errorhandler(UploadError)
+def upload_error(error):
+    return jsonify(error=str(error)), error.status
+
+
+@app.route("/uploads", methods=["POST"])
+@login_required
+def upload_init():
+    data = request.get_json(silent=True) or request.form
+    try:
+        category_id = existing_category_id(data["category"])
+        size = int(data["size"])
+    except (KeyError, ValueError):
+        raise UploadError("category and size are required")
+    if category_id is None:
+        raise UploadError("Unknown category")
+    upload_id = upload_sessions.create(current_user.id, category_id, size, data.get("filename", ""))
+    return jsonify(upload_id=upload_id, chunk_size=CHUNK_SIZE, received=0), 201
+
+
+@app.route("/uploads/<upload_id>", methods=["GET"])
+@login_required
+def upload_status(upload_id):
+    meta = upload_sessions.status(upload_id, current_user.id)
+    return jsonify(upload_id=upload_id, size=meta["size"], received=meta["received"])
+
+
+@app.route("/uploads/<upload_id>", methods=["PUT"])
+@login_required
+def upload_chunk(upload_id):
+    offset = request.args.get("offset", type=int)
+    if offset is None:
+        raise UploadError("offset is required")
+    # the body is read straight off the socket in CHUNK_SIZE pieces
+    received = upload_sessions.append(upload_id, current_user.id, offset, request.stream)
+    return jsonify(upload_id=upload_id, received=received)
+
+
+@app.route("/uploads/<upload_id>/finalize", methods=["POST"])
+@login_required
+def upload_finalize(upload_id):
+    meta, data = upload_sessions.open_complete(upload_id, current_user.id)
+    if existing_category_id(meta["category_id"]) is None:
+        # removed while the upload was in progress
+        data.close()
+        upload_sessions.discard(upload_id, current_user.id)
+        raise UploadError("Unknown category")
+    with data:
+        try:
+            image = store_image(data, current_user.id, meta["category_id"])
+        except NotAnImage:
+            upload_sessions.discard(upload_id, current_user.id)
+            raise UploadError("The upload is not an image", 415)
+    upload_sessions.discard(upload_id, current_user.id)
+    return jsonify(
+            image_id=image.id,
+            url=url_for("get_image", image_id=image.id),
+            near_duplicate_of=image.near_duplicate_of,
+            )
+
+
+def vary_on_accept(rv):
+    # responses differ by the variant formats the client accepts
+    if renditions.formats:
+        rv.vary.add("Accept")
+    return rv
+
+
 @app.route("/image/<int:image_id>")
 def get_image(image_id):
+    accepted = renditions.accepted(request.headers.get("Accept"))
+    # hot images are answered from memory without touching the database
+    cached = image_cache.get((image_id, None, accepted))
+    if cached:
+        return vary_on_accept(send_cached(cached))
+
     image = db.session.get(Image,image_id)
 
     if image:
-        image_type = imghdr.what(None, h=image.image_data)
-        if image_type:
-            content_type = f"image/{image_type}"
-            return send_file(io.BytesIO(image.image_data), mimetype=content_type)
+        etag = image.content_hash
+        content_type = image.mime_type
+        size = image.byte_size
+        path = blob_store.path(image.blob_key) if image.blob_key else None
+        final = True
+        if path and content_type:
+            # the smallest of the upload and its variants this client takes
+            (path, content_type, fmt), final = renditions.negotiate(
+                    path, image.blob_key, content_type, None, accepted)
+            size = os.path.getsize(path)
+            if fmt and etag:
+                etag = f"{etag}.{fmt}"
+        if etag and is_not_modified(etag, image.uploaded_at):
+            return vary_on_accept(not_modified(etag, image.uploaded_at))
+
+        if image.blob_key and content_type and size <= image_cache.max_entry_bytes:
+            with (open(path, "rb") if path else blob_store.open(image.blob_key)) as f:
+                cached = CachedImage(f.read(), content_type, etag, image.uploaded_at)
+            # the choice can still change while variants are being generated
+            if final:
+                image_cache.put((image_id, None, accepted), cached)
+            return vary_on_accept(send_cached(cached))
+        if image.blob_key:
+            # a real path lets werkzeug hand the file to the kernel
+            body = path or blob_store.open(image.blob_key)
+        else:
+            # row not migrated yet, serve the bytes still held in MySQL
+            body = io.BytesIO(image.image_data)
+            image_type = imghdr.what(None, h=image.image_data)
+            content_type = f"image/{image_type}" if image_type else None
+        if content_type:
+            if etag:
+                return vary_on_accept(send_image(body, content_type, etag, image.uploaded_at))
+            return send_file(body, mimetype=content_type, conditional=True)
         else:
             return "Unknown image type"
     else:
         return "Image not found"
 
 
+@app.route("/image/<int:image_id>/<int:size>")
+def get_image_rendition(image_id, size):
+    if size not in RENDITION_SIZES:
+        abort(404)
+    accepted = renditions.accepted(request.headers.get("Accept"))
+    cached = image_cache.get((image_id, size, accepted))
+    if cached:
+        return vary_on_accept(send_cached(cached))
+
+    image = db.session.get(Image, image_id)
+    if image is None:
+        return "Image not found"
+
+    src_path = blob_store.path(image.blob_key) if image.blob_key else None
+    if not (renditions.enabled and src_path and image.mime_type):
+        # nothing to resize from, fall back to the original
+        return redirect(url_for("get_image", image_id=image_id))
+
+    # normally already written by the pool; generated here if it is missing
+    renditions.ensure(src_path, image.blob_key, image.mime_type, size)
+    (path, mime_type, fmt), final = renditions.negotiate(
+            src_path, image.blob_key, image.mime_type, size, accepted)
+    etag = f"{image.blob_key}-{size}" + (f".{fmt}" if fmt else "")
+    if is_not_modified(etag, image.uploaded_at):
+        return vary_on_accept(not_modified(etag, image.uploaded_at))
+
+    if os.path.getsize(path) <= image_cache.max_entry_bytes:
+        with open(path, "rb") as f:
+            cached = CachedImage(f.read(), mime_type, etag, image.uploaded_at)
+        if final:
+            image_cache.put((image_id, size, accepted), cached)
+        return vary_on_accept(send_cached(cached))
+    return vary_on_accept(send_image(path, mime_type, etag, image.uploaded_at))
+
+
+@app.route("/image/<int:image_id>/delete", methods=["POST"])
+@login_required
+def delete_image(image_id):
+    if not DashboardForm().validate_on_submit():
+        abort(400)
+    image = db.session.get(Image, image_id)
+    if image is None or image.user_id != current_user.id:
+        abort(404)
+    blob_key, category_id = image.blob_key, image.category_id
+    db.session.delete(image)
+    emptied = count_images({(category_id, current_user.id): -1})
+    sheets = refresh_contact_sheets({(current_user.id, category_id)})
+    db.session.commit()
+    draw_contact_sheets(*sheets)
+
+    # other rows may point at the same content-addressed blob
+    if blob_key and not db.session.execute(
+            db.select(Image.id).where(Image.blob_key == blob_key).limit(1)).first():
+        blob_store.delete(blob_key)
+        renditions.delete(blob_key)
+    for size in (None,) + RENDITION_SIZES:
+        for accepted in renditions.accept_classes():
+            image_cache.discard((image_id, size, accepted))
+    cache.invalidate(f"category:{category_id}")
+    cache.invalidate("category_counts")
+    search_index.remove_categories(emptied)
+    return redirect(url_for("dashboard"))
+
+
+@app.route("/contact_sheet/<int:user_id>/<int:category_id>/<version>/<int:density>")
+def get_contact_sheet(user_id, category_id, version, density):
+    if density not in SHEET_DENSITIES or not re.fullmatch(r"[0-9a-f]{16}", version):
+        abort(404)
+    # a version names one content forever, so the version is the ETag
+    cached = image_cache.get(("sheet", version, density))
+    if cached:
+        return send_cached(cached)
+    if is_not_modified(version, None):
+        return not_modified(version, None)
+
+    path = contact_sheets.path(version, density)
+    if not os.path.exists(path):
+        # normally drawn by the pool after the upload; drawn here if not
+        sheet = db.session.get(ContactSheet, (category_id, user_id))
+        if sheet is None or sheet.version != version:
+            abort(404)
+        blob_keys = dict(db.session.execute(db.select(Image.id, Image.blob_key).where(
+                Image.id.in_([tile["id"] for tile in sheet.tiles]))).all())
+        sources = [(blob_store.path(blob_keys[tile["id"]]), tile) for tile in sheet.tiles]
+        path = contact_sheets.ensure(version, sources, sheet.width, sheet.height, density)
+    if os.path.getsize(path) <= image_cache.max_entry_bytes:
+        with open(path, "rb") as f:
+            cached = CachedImage(f.read(), "image/jpeg", version, None)
+        image_cache.put(("sheet", version, density), cached)
+        return send_cached(cached)
+    return send_image(path, "image/jpeg", version, None)
+
+
+def send_cached(cached):
+    if is_not_modified(cached.etag, cached.last_modified):
+        return not_modified(cached.etag, cached.last_modified)
+    return send_image(io.BytesIO(cached.data), cached.mime_type, cached.etag, cached.last_modified)
+
+
+@app.route("/image_cache/stats")
+def image_cache_stats():
+    return jsonify(image_cache.stats())
+
+
 @app.route("/logout")
 @login_required
 def logout():
@@ -216,42 +1208,474 @@ def photographer_signup_login():
 
 @app.route("/choose_category")
 def choose_category():
-    # Fetch categories
-    categories = Category.query.all()
+    cursor = request.args.get("cursor")
+    page_size = page_size_arg(request.args, DEFAULT_PAGE_SIZE)
+
+    # the page is the same for every visitor, so the rendered HTML is cached
+    # until a category is added or an upload or delete changes its counts
+    def render():
+        categories, next_cursor = categories_page(cursor, page_size)
+        return render_template("choose_category.html", categories=categories, next_cursor=next_cursor)
 
-    return render_template("choose_category.html", categories=categories)
+    return cache.get_or_set("category_counts", f"html:{cursor}:{page_size}", render, refresh=replicas.pinned())
+
+
+def browse_page(category, cursor, page_size):
+    # cached until an upload to the category invalidates it
+    return cache.get_or_set(
+            f"category:{category}",
+            f"photographers:{cursor}:{page_size}",
+            lambda: latest_images_by_photographer(category, cursor, page_size),
+            refresh=replicas.pinned(),
+            )
 
 
 @app.route("/browse_category_images/<int:category>")
 def browse_category_images(category):
-    photographers = User.query.filter(User.images.any(category_id=category)).all()
-    for photographer in photographers:
-        photographer.category_images = {}
-        for image_data in photographer.images:
-            if image_data.category_id == category:
-                if category not in photographer.category_images:
-                    photographer.category_images[category] = []
-                photographer.category_images[category].append(image_data)
+    cursor = request.args.get("cursor")
+    page_size = page_size_arg(request.args, DEFAULT_PAGE_SIZE)
 
-    return render_template("browse_category_images.html", category=category, photographers=photographers)
+    def render():
+        photographers, next_cursor = browse_page(category, cursor, page_size)
+        return render_template(
+                "browse_category_images.html",
+                category=category,
+                photographers=photographers,
+                next_cursor=next_cursor,
+                )
+
+    # a replica may still lack a write that just invalidated these pages,
+    # so a client pinned to the primary replaces what it cached
+    return cache.get_or_set(f"category:{category}", f"html:{cursor}:{page_size}", render,
+                            refresh=replicas.pinned())
 
 
 @app.route("/photographer_profile/<int:photographer_id>")
 def photographer_profile(photographer_id):
-    photographer = User.query.get(photographer_id)
-    category_images = {}
+    photographer = db.get_or_404(User, photographer_id)
 
-    # Fetch images for each category
-    categories = Category.query.all()
-    for category in categories:
-        category_images[category.id] = {
-                "category_name": category.name,
-                "images": Image.query.filter_by(user_id=photographer.id, category_id=category.id).all(),
-                }
+    # Fetch the first page of images for each category
+    categories = all_categories()
+    category_images = sectioned_images(photographer.id, categories)
 
     return render_template("photographer_profile.html", photographer=photographer, category_images=category_images)
 
 
+@app.route("/photographer_profile/<int:photographer_id>/download")
+def download_portfolio(photographer_id):
+    """Every stored image of a photographer, or of one category, as a streamed ZIP
+
+    Only one image file is open at a time and it is read in chunks, so
+    memory does not grow with the archive. The layout is fixed by the
+    rows, which makes the length known and a single Range resumable.
+    """
+    photographer = db.get_or_404(User, photographer_id)
+    stmt = (
+            db.select(Image.id, Image.blob_key, Image.byte_size, Image.crc32, Image.mime_type,
+                      Image.uploaded_at, Category.name.label("category_name"))
+            .join(Category, Category.id == Image.category_id)
+            .where(Image.user_id == photographer.id, Image.blob_key.isnot(None), Image.byte_size.isnot(None))
+            .order_by(Image.category_id, Image.uploaded_at, Image.id)
+            )
+    only = request.args.get("category", type=int)
+    if only:
+        stmt = stmt.where(Image.category_id == only)
+    entries = []
+    for row in db.session.execute(stmt):
+        folder = row.category_name.replace("/", "_").replace("\\", "_").lstrip(".") or "photos"
+        extension = mimetypes.guess_extension(row.mime_type or "") or ""
+        entries.append(ZipEntry(
+                f"{folder}/{row.uploaded_at:%Y%m%d-%H%M%S}-{row.id}{extension}",
+                row.byte_size,
+                row.crc32,
+                row.uploaded_at,
+                lambda blob_key=row.blob_key: blob_store.open(blob_key),
+                ))
+    archive = StreamedZip(entries)
+    etag = archive.etag()
+    if request.if_none_match.contains(etag):
+        rv = Response(status=304)
+        rv.set_etag(etag)
+        return rv
+
+    status, start, stop = 200, 0, archive.size
+    # a resumed download must not splice two different archives together
+    if_range = request.if_range
+    range_applies = if_range.date is None and if_range.etag in (None, etag)
+    if request.range is not None and range_applies and len(request.range.ranges) == 1:
+        byte_range = request.range.range_for_length(archive.size)
+        if byte_range is None:
+            rv = Response(status=416)
+            rv.headers["Content-Range"] = f"bytes */{archive.size}"
+            return rv
+        status, (start, stop) = 206, byte_range
+
+    rv = Response(archive.iter_bytes(start, stop), status=status, mimetype="application/zip", direct_passthrough=True)
+    rv.content_length = stop - start
+    if status == 206:
+        rv.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{archive.size}"
+    rv.headers["Accept-Ranges"] = "bytes"
+    rv.set_etag(etag)
+    # a portfolio changes with every upload, so clients revalidate
+    rv.cache_control.no_cache = True
+    filename = secure_filename(f"{photographer.preferred_username or photographer.id}-portfolio.zip")
+    rv.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return rv
+
+
+@app.errorhandler(BadCursor)
+def bad_cursor(error):
+    return jsonify(error="Invalid cursor"), 400
+
+
+# JSON versions of the listings above, for infinite scrolling
+
+@app.route("/api/categories")
+def api_categories():
+    categories, next_cursor = categories_page(
+            request.args.get("cursor"), page_size_arg(request.args, DEFAULT_PAGE_SIZE))
+    return jsonify(
+            items=[
+                {
+                    "id": c.id,
+                    "name": c.name,
+                    "image_count": c.image_count,
+                    "photographer_count": c.photographer_count,
+                    }
+                for c in categories
+                ],
+            next_cursor=next_cursor,
+            )
+
+
+@app.route("/api/categories/<int:category>/photographers")
+def api_category_photographers(category):
+    photographers, next_cursor = browse_page(
+            category, request.args.get("cursor"), page_size_arg(request.args, DEFAULT_PAGE_SIZE))
+    return jsonify(
+            items=[
+                {
+                    "id": p["id"],
+                    "preferred_username": p["preferred_username"],
+                    "image_count": p["image_count"],
+                    "profile_url": url_for("photographer_profile", photographer_id=p["id"]),
+                    "images": [image_json(row) for row in p["images"]],
+                    "contact_sheet": sheet_json(p["sheet"]) if p["sheet"] else None,
+                    }
+                for p in photographers
+                ],
+            next_cursor=next_cursor,
+            )
+
+
+@app.route("/api/photographers/<int:photographer_id>/images")
+def api_photographer_images(photographer_id):
+    category = request.args.get("category", type=int)
+    if category is None:
+        return jsonify(error="category is required"), 400
+    images, next_cursor = photographer_images_page(
+            photographer_id, category, request.args.get("cursor"), page_size_arg(request.args, DEFAULT_PAGE_SIZE))
+    return jsonify(items=[image_json(row) for row in images], next_cursor=next_cursor)
+
+
+@app.route("/api/search")
+def api_search():
+    """Photographers matching ?q= (name or username prefixes), ?location= and ?category="""
+    photographers, next_cursor = search_index.search(
+            request.args.get("q"),
+            request.args.get("location"),
+            request.args.get("category", type=int),
+            request.args.get("cursor"),
+            page_size_arg(request.args, DEFAULT_PAGE_SIZE),
+            )
+    items = []
+    for photographer in photographers:
+        item = {key: photographer[key] for key in ("username", "name", "location", "user_id")}
+        if photographer["user_id"]:
+            item["url"] = url_for("photographer_profile", photographer_id=photographer["user_id"])
+        items.append(item)
+    return jsonify(items=items, next_cursor=next_cursor)
+
+
+def invalidate_from_cli(*namespaces):
+    """cache.invalidate() for commands, warning when servers cannot see it
+
+    A command runs in a process of its own. With CACHE_BACKEND=memory
+    each server worker keeps its own cache, which the command never
+    reaches, so their pages stay as they were until CACHE_DEFAULT_TTL.
+    """
+    for namespace in namespaces:
+        cache.invalidate(namespace)
+    meta = click.get_current_context().meta
+    if namespaces and cache.process_local and not meta.get("photohub_cache_warned"):
+        # once per command
+        meta["photohub_cache_warned"] = True
+        click.echo(
+                "warning: CACHE_BACKEND=memory is private to each process, running servers keep "
+                f"their cached pages for up to {cache.default_ttl}s; use CACHE_BACKEND=sqlite "
+                "to have commands reach them", err=True)
+
+
+@app.cli.command("create-category")
+@click.argument("name")
+def create_category(name):
+    """Add a category and drop the cached category lists (see invalidate_from_cli)"""
+    db.session.add(Category(name=name))
+    db.session.commit()
+    invalidate_from_cli("categories", "category_counts")
+    click.echo(f"created category {name}")
+
+
+@app.cli.command("import-directory")
+@click.argument("root", type=click.Path(exists=True, file_okay=False))
+@click.option("--user", "username", required=True, help="preferred_username of the photographer")
+@click.option("--create-categories", is_flag=True, help="create categories for unknown folders")
+@click.option("--batch-size", default=50, show_default=True)
+def import_directory(root, username, create_categories, batch_size):
+    """Import ROOT/<category name>/... images for one photographer"""
+    user = User.query.filter_by(preferred_username=username).first()
+    if user is None:
+        raise click.ClickException(f"no photographer called {username}")
+    if create_categories:
+        known = {c.name.lower() for c in all_categories()}
+        for name in sorted(os.listdir(root)):
+            if os.path.isdir(os.path.join(root, name)) and name.lower() not in known:
+                db.session.add(Category(name=name))
+        db.session.commit()
+        invalidate_from_cli("categories", "category_counts")
+
+    report = ingest(iter_directory(root), user.id, batch_size=batch_size)
+    # ingest has dropped the pages of this process only
+    invalidate_from_cli("category_counts", *{f"category:{item['category_id']}"
+                                            for item in report if item["status"] == "stored"})
+    for item in report:
+        click.echo(f"{item['status']:<10} {item['name']} {item.get('reason', '')}".rstrip())
+    stored = sum(item["status"] == "stored" for item in report)
+    click.echo(f"imported {stored} of {len(report)} files")
+
+
+@app.cli.command("sweep-uploads")
+def sweep_uploads():
+    """Remove resumable uploads idle for longer than UPLOAD_SESSION_TTL"""
+    left = upload_sessions.sweep()
+    click.echo(f"{left} uploads in progress")
+
+
+def upgrade_database():
+    """Create missing tables, then add the columns and indexes older tables lack"""
+    db.create_all()
+    for change in photohub_db.upgrade_schema(db.engine, db.metadata):
+        click.echo(change)
+
+
+@app.cli.command("upgrade-schema")
+def upgrade_schema_command():
+    """Bring a database created by an older release up to the current models"""
+    upgrade_database()
+    click.echo("schema is up to date")
+
+
+def images_by_id(condition, batch_size):
+    """Yield the images matching condition, batch_size at a time, for backfills
+
+    The table is walked by primary key so each batch is a cheap range
+    scan. Changes made to a batch are committed before the next one is
+    read, and the batch is dropped from the identity map so memory stays
+    flat.
+    """
+    last_id = 0
+    while True:
+        batch = (
+                Image.query.filter(Image.id > last_id, condition)
+                .order_by(Image.id)
+                .limit(batch_size)
+                .all()
+                )
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+        db.session.commit()
+        db.session.expunge_all()
+
+
+@app.cli.command("migrate-blobs")
+@click.option("--batch-size", default=100, show_default=True)
+def migrate_blobs(batch_size):
+    """Move image bytes out of MySQL into the blob store"""
+    # the rows it migrates predate the columns it fills
+    upgrade_database()
+    moved = 0
+    # rows stored before metadata existed are backfilled on the way
+    for batch in images_by_id(db.or_(Image.blob_key.is_(None), Image.mime_type.is_(None)), batch_size):
+        for image in batch:
+            if image.blob_key is None and image.image_data is not None:
+                image.blob_key = blob_store.put_bytes(image.image_data)
+                image.image_data = None
+                moved += 1
+            if image.uploaded_at is None:
+                image.uploaded_at = datetime.utcnow()
+            if image.blob_key and image.mime_type is None:
+                image.content_hash = image.blob_key
+                with blob_store.open(image.blob_key) as f:
+                    image.set_metadata(f)
+        click.echo(f"moved {moved} images")
+    click.echo(f"done, {moved} images moved to the blob store")
+
+
+@app.cli.command("rebuild-duplicate-index")
+@click.option("--batch-size", default=100, show_default=True)
+def rebuild_duplicate_index(batch_size):
+    """Hash images stored before perceptual hashing and rebuild the index"""
+    hashed = 0
+    for batch in images_by_id(db.and_(Image.phash.is_(None), Image.blob_key.isnot(None)), batch_size):
+        for image in batch:
+            with blob_store.open(image.blob_key) as f:
+                image.phash = dhash(f)
+            hashed += image.phash is not None
+    duplicate_index.rebuild()
+    click.echo(f"hashed {hashed} images, index holds {duplicate_index.hashes.size}")
+
+
+@app.cli.command("generate-placeholders")
+@click.option("--batch-size", default=100, show_default=True)
+def generate_placeholders(batch_size):
+    """Fill in the placeholder and displayed dimensions of older images"""
+    generated = 0
+    categories = set()
+    for batch in images_by_id(db.and_(Image.placeholder.is_(None), Image.blob_key.isnot(None)), batch_size):
+        for image in batch:
+            with blob_store.open(image.blob_key) as f:
+                image.set_metadata(f)
+            generated += image.placeholder is not None
+            categories.add(image.category_id)
+    # browse pages cached before now have no placeholders
+    invalidate_from_cli(*(f"category:{category_id}" for category_id in categories))
+    click.echo(f"generated {generated} placeholders")
+
+
+@app.cli.command("compute-checksums")
+@click.option("--batch-size", default=100, show_default=True)
+def compute_checksums(batch_size):
+    """Store the CRC-32 of images uploaded before checksums were kept"""
+    computed = 0
+    for batch in images_by_id(db.and_(Image.crc32.is_(None), Image.blob_key.isnot(None)), batch_size):
+        for image in batch:
+            crc32 = 0
+            with blob_store.open(image.blob_key) as f:
+                for chunk in iter(lambda: f.read(256 * 1024), b""):
+                    crc32 = zlib.crc32(chunk, crc32)
+            image.crc32 = crc32
+            computed += 1
+    click.echo(f"computed {computed} checksums")
+
+
+@app.cli.command("transcode-images")
+@click.option("--batch-size", default=100, show_default=True)
+def transcode_images(batch_size):
+    """Generate the missing renditions and AVIF/WebP variants of stored images"""
+    if not renditions.enabled:
+        raise click.ClickException("Pillow is not installed")
+    click.echo(f"variant formats: {', '.join(renditions.formats) or 'none'}")
+    written = failed = done = 0
+    last_key = ""
+    while True:
+        # one pass per stored blob, however many rows share it
+        batch = db.session.execute(
+                db.select(Image.blob_key, db.func.min(Image.mime_type).label("mime_type"))
+                .where(Image.blob_key > last_key, Image.mime_type.isnot(None))
+                .group_by(Image.blob_key)
+                .order_by(Image.blob_key)
+                .limit(batch_size)
+                ).all()
+        if not batch:
+            break
+        futures = []
+        for row in batch:
+            src_path = blob_store.path(row.blob_key)
+            if src_path:
+                futures += renditions.submit(src_path, row.blob_key, row.mime_type)
+            last_key = row.blob_key
+        # waiting per batch keeps the queue, and memory, bounded
+        for future in futures:
+            try:
+                future.result()
+                written += 1
+            except Exception as exc:
+                failed += 1
+                click.echo(f"failed: {exc}", err=True)
+        done += len(batch)
+        click.echo(f"{done} images checked, {written} files written")
+    click.echo(f"done, {written} files written, {failed} failed")
+
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index():
+    """Rebuild the photographer search index from the database"""
+    def photographers():
+        for user in db.session.execute(db.select(User.preferred_username, User.id, User.created_at)).yield_per(1000):
+            if user.preferred_username:
+                yield user.preferred_username, user.id, None, None, user.created_at
+        # profiles are written by Profile_Creation, into the same database
+        if db.inspect(db.engine).has_table("photographers_profiles"):
+            for profile in db.session.execute(db.text(
+                    "SELECT user_name, first_name, last_name, location, created_at FROM photographers_profiles"
+                    ).columns(created_at=db.DateTime)).yield_per(1000):
+                name = " ".join(part for part in (profile.first_name, profile.last_name) if part)
+                yield profile.user_name, None, name or None, profile.location, profile.created_at
+
+    def categories():
+        # only runs once photographers() is exhausted, one streamed result at a time
+        for row in db.session.execute(db.select(Image.user_id, Image.category_id).distinct()).yield_per(1000):
+            yield row.user_id, row.category_id
+
+    count = search_index.rebuild(photographers(), categories())
+    click.echo(f"indexed {count} photographers")
+
+
+@app.cli.command("build-contact-sheets")
+def build_contact_sheets():
+    """Lay out and draw the contact sheet of every photographer in every category"""
+    drawn_total = 0
+    for category_id in db.session.execute(db.select(Category.id).order_by(Category.id)).scalars().all():
+        # the same lock uploads take, so a concurrent upload waits its turn
+        db.session.execute(
+                db.select(CategoryStats.category_id)
+                .where(CategoryStats.category_id == category_id)
+                .with_for_update()
+                )
+        user_ids = db.session.execute(
+                db.select(Image.user_id).where(Image.category_id == category_id).distinct()).scalars().all()
+        drawn, superseded = refresh_contact_sheets({(user_id, category_id) for user_id in user_ids}, redraw=True)
+        db.session.commit()
+        futures = []
+        for version, sources, width, height in drawn:
+            futures += contact_sheets.submit(version, sources, width, height)
+        for future in futures:
+            future.result()
+        draw_contact_sheets([], superseded)
+        if drawn or superseded:
+            invalidate_from_cli(f"category:{category_id}")
+        drawn_total += len(futures)
+    # files superseded while another worker process was still drawing them
+    current = set(db.session.execute(db.select(ContactSheet.version)).scalars())
+    stale = set(contact_sheets.versions()) - current
+    for version in stale:
+        contact_sheets.delete(version)
+    click.echo(f"drew {drawn_total} contact sheet files, removed {len(stale)} stale sheets")
+
+
+@app.cli.command("reconcile-stats")
+def reconcile_stats_command():
+    """Recount the category and photographer stats tables from Image"""
+    reconcile_stats()
+    invalidate_from_cli("category_counts")
+    totals = db.session.execute(db.select(
+            db.func.count(CategoryStats.category_id), db.func.coalesce(db.func.sum(CategoryStats.image_count), 0),
+            )).one()
+    click.echo(f"recounted {totals[1]} images in {totals[0]} categories")
+
+
 if __name__ == "__main__":
     with app.app_context():
         db.create_all()
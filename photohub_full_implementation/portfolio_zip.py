@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+"""
+ZIP archives streamed straight from stored files, resumable with Range
+
+Entries are stored, not deflated: photos are already compressed. Since
+every header is a fixed size, the whole layout, and so the length and
+the offset of every byte, is known before anything is read, which is
+what lets a Range request start in the middle of the archive.
+"""
+from collections import namedtuple
+import hashlib
+import struct
+import zlib
+
+
+CHUNK_SIZE = 256 * 1024
+
+# past these the ZIP64 records take over
+_MAX_16 = 0xFFFF
+_MAX_32 = 0xFFFFFFFF
+
+# UTF-8 names
+_FLAGS = 0x0800
+# made by unix, so the external attributes are permission bits
+_MADE_BY = (3 << 8) | 45
+_FILE_MODE = 0o100644 << 16
+
+# name: path inside the archive; open: returns a binary file of the bytes;
+# crc32: None when it has to be computed from the bytes
+ZipEntry = namedtuple("ZipEntry", "name size crc32 modified open")
+
+
+def _dos_time(modified):
+    date = ((max(modified.year, 1980) - 1980) << 9) | (modified.month << 5) | modified.day
+    time = (modified.hour << 11) | (modified.minute << 5) | (modified.second // 2)
+    return time, date
+
+
+def _crc32(entry):
+    crc = 0
+    with entry.open() as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+class StreamedZip:
+    """Byte layout of an archive of entries, and its bytes for any range"""
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self.names = [entry.name.encode("utf-8") for entry in self.entries]
+        self.offsets = []
+        offset = 0
+        for entry, name in zip(self.entries, self.names):
+            if entry.size > _MAX_32:
+                raise ValueError(f"{entry.name} is too large to store")
+            self.offsets.append(offset)
+            offset += 30 + len(name) + entry.size
+        self.directory_offset = offset
+        self.directory_size = sum(46 + len(name) + self._offset_extra_size(o)
+                                  for name, o in zip(self.names, self.offsets))
+        self.zip64 = (len(self.entries) >= _MAX_16 or self.directory_offset >= _MAX_32
+                      or self.directory_size >= _MAX_32)
+        self.size = self.directory_offset + self.directory_size + (56 + 20 if self.zip64 else 0) + 22
+        self.crcs = {}
+
+    @staticmethod
+    def _offset_extra_size(offset):
+        return 12 if offset >= _MAX_32 else 0
+
+    def etag(self):
+        """Strong validator for the layout, so If-Range can resume safely"""
+        digest = hashlib.sha256()
+        for entry in self.entries:
+            digest.update(repr((entry.name, entry.size, entry.crc32, entry.modified)).encode())
+        return digest.hexdigest()[:32]
+
+    def _crc(self, i):
+        entry = self.entries[i]
+        if entry.crc32 is not None:
+            return entry.crc32
+        if i not in self.crcs:
+            self.crcs[i] = _crc32(entry)
+        return self.crcs[i]
+
+    def _local_header(self, i):
+        entry = self.entries[i]
+        time, date = _dos_time(entry.modified)
+        return struct.pack(
+                "<IHHHHHIIIHH", 0x04034B50, 20, _FLAGS, 0, time, date,
+                self._crc(i), entry.size, entry.size, len(self.names[i]), 0,
+                ) + self.names[i]
+
+    def _directory_header(self, i):
+        entry = self.entries[i]
+        time, date = _dos_time(entry.modified)
+        offset = self.offsets[i]
+        extra = b""
+        if offset >= _MAX_32:
+            extra = struct.pack("<HHQ", 0x0001, 8, offset)
+            offset = _MAX_32
+        return struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014B50, _MADE_BY, 45 if extra else 20, _FLAGS, 0, time, date,
+                self._crc(i), entry.size, entry.size, len(self.names[i]), len(extra), 0, 0, 0,
+                _FILE_MODE, offset,
+                ) + self.names[i] + extra
+
+    def _end_records(self):
+        count = len(self.entries)
+        records = b""
+        if self.zip64:
+            end64_offset = self.directory_offset + self.directory_size
+            records += struct.pack(
+                    "<IQHHIIQQQQ", 0x06064B50, 44, _MADE_BY, 45, 0, 0,
+                    count, count, self.directory_size, self.directory_offset)
+            records += struct.pack("<IIQI", 0x07064B50, 0, end64_offset, 1)
+        return records + struct.pack(
+                "<IHHHHIIH", 0x06054B50, 0, 0, min(count, _MAX_16), min(count, _MAX_16),
+                min(self.directory_size, _MAX_32), min(self.directory_offset, _MAX_32), 0)
+
+    def _segments(self):
+        """(start, length, produce) for every piece of the archive, in order
+
+        produce(skip, length) yields the piece's bytes from skip on.
+        """
+        for i, entry in enumerate(self.entries):
+            header_length = 30 + len(self.names[i])
+            yield self.offsets[i], header_length, self._bytes_producer(lambda i=i: self._local_header(i))
+            yield self.offsets[i] + header_length, entry.size, self._file_producer(entry)
+
+        def directory():
+            for i in range(len(self.entries)):
+                yield self._directory_header(i)
+            yield self._end_records()
+        yield self.directory_offset, self.size - self.directory_offset, self._chunks_producer(directory)
+
+    @staticmethod
+    def _bytes_producer(make):
+        def produce(skip, length):
+            yield make()[skip:skip + length]
+        return produce
+
+    @staticmethod
+    def _chunks_producer(make):
+        def produce(skip, length):
+            for chunk in make():
+                if skip >= len(chunk):
+                    skip -= len(chunk)
+                    continue
+                chunk = chunk[skip:skip + length]
+                skip = 0
+                length -= len(chunk)
+                yield chunk
+                if length <= 0:
+                    return
+        return produce
+
+    @staticmethod
+    def _file_producer(entry):
+        def produce(skip, length):
+            # one open file at a time, read in fixed chunks
+            with entry.open() as f:
+                f.seek(skip)
+                while length > 0:
+                    chunk = f.read(min(CHUNK_SIZE, length))
+                    if not chunk:
+                        raise IOError(f"{entry.name} is shorter than recorded")
+                    length -= len(chunk)
+                    yield chunk
+        return produce
+
+    def iter_bytes(self, start=0, stop=None):
+        """Yield the archive's bytes from start up to stop"""
+        stop = self.size if stop is None else stop
+        for segment_start, length, produce in self._segments():
+            segment_stop = segment_start + length
+            if segment_stop <= start or length == 0:
+                continue
+            if segment_start >= stop:
+                break
+            skip = max(start - segment_start, 0)
+            yield from produce(skip, min(stop, segment_stop) - segment_start - skip)
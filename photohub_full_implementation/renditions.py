@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+"""
+resized copies of uploaded images, generated off the request path
+"""
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from functools import lru_cache
+from itertools import combinations
+import os
+import tempfile
+import threading
+
+from werkzeug.http import parse_accept_header
+
+try:
+    from PIL import Image as PILImage, ImageOps, features
+except ImportError:  # without Pillow the original is served for every size
+    PILImage = None
+
+
+# longest edge, in pixels, of each rendition kept for an image
+RENDITION_SIZES = (256, 768, 1600)
+
+# modern formats stored next to each image and rendition, smallest first
+VARIANT_FORMATS = ("avif", "webp")
+VARIANT_MIME_TYPES = {"avif": "image/avif", "webp": "image/webp"}
+
+SAVE_OPTIONS = {
+        "JPEG": dict(quality=82, optimize=True, progressive=True),
+        "PNG": dict(optimize=True),
+        # settings that look the same as the quality 82 JPEGs above
+        "WEBP": dict(quality=80, method=4),
+        "AVIF": dict(quality=60, speed=6),
+        }
+
+
+def rendition_format(mime_type):
+    # PNG and GIF can carry transparency, everything else becomes a JPEG
+    if mime_type in ("image/png", "image/gif"):
+        return "PNG"
+    return "JPEG"
+
+
+def rendition_mime_type(mime_type):
+    return "image/png" if rendition_format(mime_type) == "PNG" else "image/jpeg"
+
+
+def variant_formats(mime_type):
+    # GIFs may be animated, which the variants would lose
+    if not mime_type or mime_type == "image/gif":
+        return ()
+    return VARIANT_FORMATS
+
+
+@lru_cache(maxsize=256)
+def _accepted(header, formats):
+    offered = {value.lower() for value, quality in parse_accept_header(header) if quality > 0}
+    return tuple(fmt for fmt in formats if VARIANT_MIME_TYPES[fmt] in offered)
+
+
+def generate_rendition(src_path, dest_path, size, fmt):
+    """Write a copy of src_path in fmt scaled to fit size x size; runs in a worker
+
+    A size of None keeps the full dimensions.
+    """
+    with PILImage.open(src_path) as img:
+        icc_profile = img.info.get("icc_profile")
+        if size is not None:
+            # let the JPEG decoder skip straight to a reduced scale
+            img.draft("RGB", (size, size))
+        img = ImageOps.exif_transpose(img)
+        if size is not None:
+            img.thumbnail((size, size), PILImage.LANCZOS)
+        if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        elif fmt in ("WEBP", "AVIF") and img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if img.has_transparency_data else "RGB")
+        options = dict(SAVE_OPTIONS[fmt])
+        if icc_profile:
+            options["icc_profile"] = icc_profile
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path))
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                img.save(tmp, fmt, **options)
+            os.replace(tmp_path, dest_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    return dest_path
+
+
+class InlineExecutor(Executor):
+    """Runs each job as it is submitted, in the submitting thread"""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as exc:
+            future.set_exception(exc)
+        return future
+
+
+class RenditionPipeline:
+    """Resized copies and AVIF/WebP variants of each stored image
+
+    Variants are kept for the full size image and for every rendition,
+    under <root>/<format>/<size or "full">/. Requests pick the smallest
+    copy the client accepts; variants missing at that point are queued
+    on the pool and the request is served from what already exists.
+    With 0 workers there is no pool: every copy is drawn inline, by the
+    request or command that needs it.
+    """
+
+    def __init__(self, root, workers=2, formats=VARIANT_FORMATS):
+        if workers < 0:
+            raise ValueError("RENDITION_WORKERS must be 0 or more")
+        self.root = root
+        self.workers = workers
+        self._executor = None
+        self.formats = tuple(
+                fmt for fmt in formats
+                if fmt in VARIANT_FORMATS and PILImage is not None and features.check(fmt))
+        self.queued = set()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return PILImage is not None
+
+    def path(self, key, size):
+        return os.path.join(self.root, str(size), key[:2], key)
+
+    def variant_path(self, key, size, fmt):
+        return os.path.join(self.root, fmt, str(size or "full"), key[:2], key)
+
+    def executor(self):
+        # created on first use so every forked server worker gets its own pool
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers else InlineExecutor()
+        return self._executor
+
+    def accepted(self, accept_header):
+        """The variant formats an Accept header names, smallest first
+
+        Only explicit types count: */* comes from clients that may not
+        decode either format.
+        """
+        if not self.formats or not accept_header:
+            return ()
+        return _accepted(accept_header, self.formats)
+
+    def accept_classes(self):
+        """Every value accepted() can return"""
+        return [classes for n in range(len(self.formats) + 1) for classes in combinations(self.formats, n)]
+
+    def _queue(self, src_path, dest_path, size, fmt):
+        with self.lock:
+            if dest_path in self.queued:
+                return None
+            self.queued.add(dest_path)
+        future = self.executor().submit(generate_rendition, src_path, dest_path, size, fmt)
+        future.add_done_callback(lambda _: self.queued.discard(dest_path))
+        return future
+
+    def submit(self, src_path, key, mime_type):
+        """Queue every missing rendition and variant of a freshly uploaded image"""
+        if not self.enabled:
+            return []
+        jobs = [(self.path(key, size), size, rendition_format(mime_type)) for size in RENDITION_SIZES]
+        for fmt in self.formats if variant_formats(mime_type) else ():
+            jobs += [(self.variant_path(key, size, fmt), size, fmt.upper()) for size in (None,) + RENDITION_SIZES]
+        futures = [
+                self._queue(src_path, dest_path, size, fmt)
+                for dest_path, size, fmt in jobs
+                if not os.path.exists(dest_path)
+                ]
+        return [future for future in futures if future is not None]
+
+    def delete(self, key):
+        paths = [self.path(key, size) for size in RENDITION_SIZES]
+        for fmt in VARIANT_FORMATS:
+            paths += [self.variant_path(key, size, fmt) for size in (None,) + RENDITION_SIZES]
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def ensure(self, src_path, key, mime_type, size):
+        """Return the rendition path, generating it inline if the pool has not yet"""
+        dest_path = self.path(key, size)
+        if not os.path.exists(dest_path):
+            generate_rendition(src_path, dest_path, size, rendition_format(mime_type))
+        return dest_path
+
+    def negotiate(self, src_path, key, mime_type, size, accepted):
+        """Pick the smallest of the image and its variants in accepted
+
+        size is None for the full size image; otherwise the rendition must
+        already exist. Returns ((path, mime_type, fmt), final) where fmt is
+        None for the image itself and final is False while some accepted
+        variant is still being generated.
+        """
+        if size is None:
+            path, base_mime_type = src_path, mime_type
+        else:
+            path, base_mime_type = self.path(key, size), rendition_mime_type(mime_type)
+        best = (os.path.getsize(path), path, base_mime_type, None)
+        final = True
+        for fmt in accepted if variant_formats(mime_type) else ():
+            variant_path = self.variant_path(key, size, fmt)
+            if not os.path.exists(variant_path):
+                future = self._queue(src_path, variant_path, size, fmt.upper())
+                # already drawn when there is no pool
+                if future is None or not future.done() or future.exception() is not None:
+                    final = False
+                    continue
+            try:
+                variant = (os.path.getsize(variant_path), variant_path, VARIANT_MIME_TYPES[fmt], fmt)
+            except FileNotFoundError:
+                final = False
+                continue
+            # a variant larger than what it replaces is never sent
+            if variant[0] < best[0]:
+                best = variant
+        return best[1:], final
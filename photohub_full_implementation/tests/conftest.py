@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+"""
+fixtures running the PhotoHub app against a throwaway sqlite database
+
+The app reads its settings from the environment when it is imported, so
+they are pointed at a temporary directory before the first import.
+"""
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+
+
+WORKDIR = tempfile.mkdtemp(prefix="photohub-tests-")
+os.environ.update(
+        DATABASE_URL=f"sqlite:///{os.path.join(WORKDIR, 'photohub.sqlite3')}",
+        SEARCH_INDEX_PATH=os.path.join(WORKDIR, "search.sqlite3"),
+        BLOB_STORE_ROOT=os.path.join(WORKDIR, "uploads", "blobs"),
+        RENDITION_ROOT=os.path.join(WORKDIR, "uploads", "renditions"),
+        UPLOAD_SESSION_ROOT=os.path.join(WORKDIR, "uploads", "sessions"),
+        IMAGE_ACCEL_ROOT=os.path.join(WORKDIR, "uploads"),
+        CACHE_BACKEND="memory",
+        IMAGE_CACHE_BYTES="0",
+        )
+# uploads/images and the other relative defaults land in WORKDIR too
+os.chdir(WORKDIR)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import photographer_signup_and_login as photohub  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    photohub.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with photohub.app.app_context():
+        photohub.db.drop_all()
+        photohub.db.create_all()
+        # ids are reused from one test to the next, so nothing cached may survive
+        photohub.cache.backend.entries.clear()
+        yield photohub.app
+        photohub.db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    def make_user(username="photographer"):
+        user = photohub.User(preferred_username=username, email=f"{username}@example.com", password="unused")
+        photohub.db.session.add(user)
+        photohub.db.session.commit()
+        return user
+    return make_user
+
+
+@pytest.fixture
+def login(client):
+    def login(user):
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user.id)
+            session["_fresh"] = True
+    return login
+
+
+@pytest.fixture
+def jpeg():
+    """The bytes of a small JPEG"""
+    Image = pytest.importorskip("PIL.Image")
+    out = io.BytesIO()
+    Image.new("RGB", (640, 480), "steelblue").save(out, "JPEG")
+    return out.getvalue()
+
+
+@pytest.fixture
+def stored_image(app, make_user, jpeg):
+    """An Image row whose bytes are in the blob store"""
+    user = make_user()
+    category = photohub.Category(name="Weddings")
+    photohub.db.session.add(category)
+    photohub.db.session.flush()
+    image = photohub.Image(user_id=user.id, category_id=category.id, blob_key=photohub.blob_store.put_bytes(jpeg))
+    image.content_hash = image.blob_key
+    image.set_metadata(io.BytesIO(jpeg))
+    photohub.db.session.add(image)
+    photohub.db.session.commit()
+    return image
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+"""
+the ASGI image server, called the way uvicorn calls it
+"""
+import asyncio
+
+import pytest
+
+import asgi_images
+from renditions import RENDITION_SIZES, RenditionPipeline
+import photographer_signup_and_login as photohub
+
+
+@pytest.fixture
+def serve(app, tmp_path, monkeypatch):
+    """A request to asgi_images.app; returns (status, headers, body)"""
+    monkeypatch.setattr(photohub, "renditions", RenditionPipeline(str(tmp_path / "renditions"), workers=0, formats=()))
+    # ids are reused from one test to the next
+    asgi_images.metadata.rows.clear()
+
+    def serve(path, method="GET", headers=()):
+        scope = {
+                "type": "http",
+                "method": method,
+                "path": path,
+                "headers": [(k.lower().encode(), v.encode()) for k, v in headers],
+                }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(asgi_images.app(scope, receive, send))
+        start, *body = messages
+        assert not body[-1].get("more_body")
+        return (start["status"], {k.decode(): v.decode() for k, v in start["headers"]},
+                b"".join(message["body"] for message in body))
+    return serve
+
+
+def test_get_sends_the_image(serve, stored_image, jpeg):
+    status, headers, body = serve(f"/image/{stored_image.id}")
+    assert status == 200
+    assert body == jpeg
+    assert headers["content-type"] == "image/jpeg"
+    assert headers["content-length"] == str(len(jpeg))
+    assert headers["etag"] == f'"{stored_image.content_hash}"'
+
+
+def test_head_sends_the_headers_alone(serve, stored_image, jpeg):
+    status, headers, body = serve(f"/image/{stored_image.id}", "HEAD")
+    assert status == 200
+    assert body == b""
+    assert headers["content-length"] == str(len(jpeg))
+
+
+def test_range(serve, stored_image, jpeg):
+    status, headers, body = serve(f"/image/{stored_image.id}", headers=[("Range", "bytes=100-199")])
+    assert status == 206
+    assert body == jpeg[100:200]
+    assert headers["content-range"] == f"bytes 100-199/{len(jpeg)}"
+    assert headers["content-length"] == "100"
+
+    # a Range for another version of the file gets the whole of this one
+    status, _, body = serve(f"/image/{stored_image.id}", headers=[("Range", "bytes=100-199"), ("If-Range", '"other"')])
+    assert (status, body) == (200, jpeg)
+
+
+def test_revalidation(serve, stored_image):
+    status, _, body = serve(f"/image/{stored_image.id}", headers=[("If-None-Match", f'"{stored_image.content_hash}"')])
+    assert (status, body) == (304, b"")
+
+
+def test_renditions_are_drawn_on_demand(serve, stored_image):
+    size = RENDITION_SIZES[0]
+    status, headers, body = serve(f"/image/{stored_image.id}/{size}")
+    assert status == 200
+    assert headers["etag"] == f'"{stored_image.blob_key}-{size}"'
+    assert body[:2] == b"\xff\xd8"
+
+
+@pytest.mark.parametrize("path", ["/image/999", "/image/1/7", "/image/abc", "/elsewhere"])
+def test_not_found(serve, stored_image, path):
+    assert serve(path)[0] == 404
+
+
+def test_only_get_and_head(serve, stored_image):
+    assert serve(f"/image/{stored_image.id}", "POST")[0] == 405
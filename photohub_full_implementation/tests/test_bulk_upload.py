@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+"""
+bulk uploads: one duplicate lookup per batch, and files that are no image left out
+"""
+import io
+import zipfile
+
+import pytest
+from sqlalchemy import event
+
+import photographer_signup_and_login as photohub
+
+
+@pytest.fixture
+def photographer(app, make_user, login):
+    user = make_user()
+    photohub.db.session.add(photohub.Category(name="Weddings"))
+    photohub.db.session.commit()
+    login(user)
+    return user
+
+
+def jpegs(count):
+    Image = pytest.importorskip("PIL.Image")
+    files = []
+    for i in range(count):
+        out = io.BytesIO()
+        # different enough that none is a near duplicate of another
+        Image.effect_noise((64, 48), 40 + i * 10).convert("RGB").save(out, "JPEG")
+        files.append(out.getvalue())
+    return files
+
+
+def bulk_upload(client, files, category="1"):
+    return client.post(
+            "/upload/bulk",
+            data={"category": category, "files": [(io.BytesIO(data), name) for name, data in files]},
+            headers={"Accept": "application/json"},
+            ).get_json()["report"]
+
+
+def selects_for(client, files):
+    """SELECTs a bulk upload of files runs; rows are inserted one by one"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(photohub.db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        report = bulk_upload(client, files)
+    finally:
+        event.remove(photohub.db.engine, "before_cursor_execute", before_cursor_execute)
+    assert {item["status"] for item in report} == {"stored"}
+    return len(statements)
+
+
+def test_lookups_do_not_grow_with_files(client, photographer):
+    images = jpegs(9)
+    # the first request also fills the session user and category caches
+    bulk_upload(client, [("0.jpg", images[0])])
+    few = selects_for(client, [(f"{i}.jpg", data) for i, data in enumerate(images[1:3], 1)])
+    many = selects_for(client, [(f"{i}.jpg", data) for i, data in enumerate(images[3:], 3)])
+    assert few == many
+    assert photohub.instrumentation.repeated_statements.values.get("upload_bulk", 0) == 0
+
+
+def test_duplicates_and_files_that_are_no_image(client, photographer):
+    first, second = jpegs(2)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        z.writestr("Weddings/again.jpg", first)
+        z.writestr("Weddings/broken.jpg", b"notanimage")
+    report = bulk_upload(client, [
+            ("first.jpg", first),
+            ("bad.jpg", b"notanimage"),
+            ("second.jpg", second),
+            ("first-again.jpg", first),
+            ("album.zip", archive.getvalue()),
+            ])
+    by_name = {item["name"]: item for item in report}
+
+    assert by_name["first.jpg"]["status"] == "stored"
+    assert by_name["second.jpg"]["status"] == "stored"
+    assert by_name["first-again.jpg"] == dict(by_name["first-again.jpg"], status="duplicate",
+                                              image_id=by_name["first.jpg"]["image_id"])
+    assert by_name["album.zip/Weddings/again.jpg"]["status"] == "duplicate"
+    for name in ("bad.jpg", "album.zip/Weddings/broken.jpg"):
+        assert by_name[name] == {"name": name, "status": "skipped", "reason": "not an image"}
+
+    assert photohub.db.session.scalar(photohub.db.select(photohub.db.func.count(photohub.Image.id))) == 2
+    assert photohub.db.session.get(photohub.CategoryStats, 1).image_count == 2
+
+
+@pytest.mark.parametrize("category", ["abc", "999"])
+def test_unknown_default_category_is_refused(client, photographer, category):
+    [image] = jpegs(1)
+    response = client.post(
+            "/upload/bulk",
+            data={"category": category, "files": [(io.BytesIO(image), "a.jpg")]},
+            headers={"Accept": "application/json"},
+            )
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Unknown category"}
+    assert photohub.Image.query.count() == 0
+
+
+def test_folders_name_the_category(client, photographer):
+    first, second = jpegs(2)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        z.writestr("weddings/a.jpg", first)
+        z.writestr("Portraits/b.jpg", second)
+    report = bulk_upload(client, [("album.zip", archive.getvalue())], category="")
+    by_name = {item["name"]: item for item in report}
+    assert by_name["album.zip/weddings/a.jpg"]["status"] == "stored"
+    # no such category, and no default to fall back on
+    assert by_name["album.zip/Portraits/b.jpg"] == {
+            "name": "album.zip/Portraits/b.jpg", "status": "skipped", "reason": "no category"}
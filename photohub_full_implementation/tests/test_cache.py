@@ -0,0 +1,39 @@
+#!/usr/bin/python3
+"""
+the application cache, and invalidation from commands run beside the servers
+"""
+from photohub_db.cache import MISSING, Cache, LRUBackend, SQLiteBackend
+import photographer_signup_and_login as photohub
+
+
+def test_invalidating_a_namespace_drops_its_entries():
+    cache = Cache(LRUBackend())
+    cache.set("category:1", "page", "one")
+    cache.set("category:2", "page", "two")
+    cache.invalidate("category:1")
+    assert cache.get("category:1", "page") is MISSING
+    assert cache.get("category:2", "page") == "two"
+
+
+def test_a_shared_backend_carries_invalidation_across_processes(tmp_path):
+    # a server worker and a command, each with its own connection to the file
+    server = Cache(SQLiteBackend(str(tmp_path / "cache.sqlite3")))
+    command = Cache(SQLiteBackend(str(tmp_path / "cache.sqlite3")))
+    server.set("categories", "all", ["Weddings"])
+    command.invalidate("categories")
+    assert server.get("categories", "all") is MISSING
+
+
+def test_commands_warn_that_a_memory_cache_is_not_shared(app):
+    result = app.test_cli_runner().invoke(args=["create-category", "Portraits"])
+    assert result.exit_code == 0
+    assert "warning: CACHE_BACKEND=memory" in result.stderr
+    assert result.stderr.count("warning") == 1
+    assert photohub.Category.query.filter_by(name="Portraits").count() == 1
+
+
+def test_commands_are_quiet_with_a_shared_cache(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(photohub, "cache", Cache(SQLiteBackend(str(tmp_path / "cache.sqlite3"))))
+    result = app.test_cli_runner().invoke(args=["create-category", "Portraits"])
+    assert result.exit_code == 0
+    assert result.stderr == ""
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+"""
+contact sheets follow the photographer's newest images in a category
+"""
+import io
+import os
+
+import pytest
+
+from contact_sheets import ContactSheets, SHEET_DENSITIES
+from renditions import RenditionPipeline
+import photographer_signup_and_login as photohub
+
+Image = pytest.importorskip("PIL.Image")
+
+
+@pytest.fixture
+def sheets(tmp_path, monkeypatch):
+    """Renditions and sheets drawn inline, so files exist once a request returns"""
+    renditions = RenditionPipeline(str(tmp_path / "renditions"), workers=0, formats=())
+    monkeypatch.setattr(photohub, "renditions", renditions)
+    monkeypatch.setattr(photohub, "contact_sheets", ContactSheets(str(tmp_path / "sheets"), renditions))
+    return photohub.contact_sheets
+
+
+def photo(colour):
+    out = io.BytesIO()
+    Image.new("RGB", (320, 240), colour).save(out, "JPEG")
+    return out.getvalue()
+
+
+def sheet_of(user_id, category_id):
+    photohub.db.session.expire_all()
+    return photohub.db.session.get(photohub.ContactSheet, (category_id, user_id))
+
+
+def test_deleting_an_image_redraws_the_sheet_without_it(client, make_user, login, sheets):
+    user = make_user()
+    login(user)
+    category = photohub.Category(name="Weddings")
+    photohub.db.session.add(category)
+    photohub.db.session.commit()
+    user_id, category_id = user.id, category.id
+    for colour in ("steelblue", "tomato"):
+        client.post("/upload", data={"file": (io.BytesIO(photo(colour)), "photo.jpg"), "category": str(category_id)})
+    kept, deleted = [image.id for image in photohub.Image.query.order_by(photohub.Image.id)]
+
+    before = sheet_of(user_id, category_id)
+    old_version = before.version
+    assert sorted(tile["id"] for tile in before.tiles) == [kept, deleted]
+    assert all(os.path.exists(sheets.path(old_version, density)) for density in SHEET_DENSITIES)
+
+    assert client.post(f"/image/{deleted}/delete").status_code == 302
+    after = sheet_of(user_id, category_id)
+    assert after.version != old_version
+    assert [tile["id"] for tile in after.tiles] == [kept]
+    assert all(os.path.exists(sheets.path(after.version, density)) for density in SHEET_DENSITIES)
+    assert not any(os.path.exists(sheets.path(old_version, density)) for density in SHEET_DENSITIES)
+    assert client.get(f"/contact_sheet/{user_id}/{category_id}/{old_version}/1").status_code == 404
+    response = client.get(f"/contact_sheet/{user_id}/{category_id}/{after.version}/1")
+    assert response.status_code == 200
+    assert response.mimetype == "image/jpeg"
+
+    # the last image takes its sheet with it
+    assert client.post(f"/image/{kept}/delete").status_code == 302
+    assert sheet_of(user_id, category_id) is None
+    assert list(sheets.versions()) == []
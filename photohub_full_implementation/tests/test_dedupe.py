@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+"""
+perceptual hashes and the multi-index hash table behind near duplicate detection
+"""
+import io
+import random
+
+import pytest
+
+from dedupe import NEAR_DUPLICATE_DISTANCE, MultiIndexHash, dhash, hamming
+
+
+def flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+BASE = 0x9E3779B97F4A7C15
+# bits 0-15 are the first chunk, 16-31 the second, and so on
+NEAR = {
+        "same": [],
+        "one bit": [5],
+        "all in one chunk": [0, 1, 2, 3, 4, 5],
+        "spread over every chunk": [3, 20, 21, 40, 50, 63],
+        }
+FAR = {
+        "one bit too many": [3, 20, 21, 40, 50, 60, 63],
+        "two in every chunk": [1, 2, 17, 18, 33, 34, 49, 50],
+        "everything": range(64),
+        }
+
+
+def test_finds_hashes_within_the_distance_and_no_others():
+    index = MultiIndexHash()
+    for name, bits in {**NEAR, **FAR}.items():
+        index.add(flip(BASE, bits), name)
+    found = index.search(BASE, NEAR_DUPLICATE_DISTANCE)
+    assert sorted(name for _, name in found) == sorted(NEAR)
+    assert [distance for distance, _ in found] == sorted(len(bits) for bits in NEAR.values())
+
+
+def test_agrees_with_a_linear_scan():
+    rng = random.Random(7)
+    values = [rng.getrandbits(64) for _ in range(500)]
+    # near copies of a few, so there is something to find
+    values += [flip(value, rng.sample(range(64), rng.randint(0, 8))) for value in values[:100]]
+    index = MultiIndexHash()
+    for item, value in enumerate(values):
+        index.add(value, item)
+    for query in values[:100]:
+        expected = sorted((hamming(query, value), item) for item, value in enumerate(values)
+                          if hamming(query, value) <= NEAR_DUPLICATE_DISTANCE)
+        assert index.search(query, NEAR_DUPLICATE_DISTANCE) == expected
+
+
+def test_dhash_sees_through_recompression():
+    Image = pytest.importorskip("PIL.Image")
+
+    def jpeg(img, quality):
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=quality)
+        out.seek(0)
+        return out
+
+    gradient = Image.linear_gradient("L").rotate(90).resize((640, 480)).convert("RGB")
+    other = gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    original = int(dhash(jpeg(gradient, 95)), 16)
+    assert hamming(original, int(dhash(jpeg(gradient, 30)), 16)) <= NEAR_DUPLICATE_DISTANCE
+    assert hamming(original, int(dhash(jpeg(other, 95)), 16)) > NEAR_DUPLICATE_DISTANCE
+    assert dhash(io.BytesIO(b"not an image")) is None
@@ -0,0 +1,37 @@
+#!/usr/bin/python3
+"""
+deleting an image: the CSRF check and how long caches keep serving it
+"""
+import re
+
+import image_cache
+from image_cache import CachedImage, ImageCache
+import photographer_signup_and_login as photohub
+
+
+def test_delete_needs_the_dashboard_token(client, app, monkeypatch, login, stored_image):
+    monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", True)
+    image_id = stored_image.id
+    login(stored_image.user)
+
+    assert client.post(f"/image/{image_id}/delete").status_code == 400
+    assert photohub.db.session.get(photohub.Image, image_id) is not None
+
+    page = client.get("/dashboard").get_data(as_text=True)
+    token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+    response = client.post(f"/image/{image_id}/delete", data={"csrf_token": token})
+    assert response.status_code == 302
+    photohub.db.session.expire_all()
+    assert photohub.db.session.get(photohub.Image, image_id) is None
+
+
+def test_cached_images_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(image_cache.time, "monotonic", lambda: now[0])
+    cache = ImageCache(1024 * 1024, ttl=60)
+    cache.put(1, CachedImage(b"jpeg", "image/jpeg", "etag", None))
+    now[0] += 59
+    assert cache.get(1).data == b"jpeg"
+    now[0] += 2
+    assert cache.get(1) is None
+    assert cache.stats()["entries"] == 0
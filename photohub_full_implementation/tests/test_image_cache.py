@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+"""
+the W-TinyLFU image cache: byte budget, admission and scan resistance
+"""
+from image_cache import CachedImage, ImageCache
+
+
+def image(size):
+    return CachedImage(b"x" * size, "image/jpeg", "etag", None)
+
+
+def request(cache, key, size=5000):
+    """What get_image does: look up, and store the file on a miss"""
+    if cache.get(key) is not None:
+        return True
+    cache.put(key, image(size))
+    return False
+
+
+def test_stays_within_its_byte_budget():
+    cache = ImageCache(100_000, 10_000)
+    for key in range(200):
+        request(cache, key, 3000 + key * 29 % 7000)
+        stats = cache.stats()
+        assert stats["bytes"] <= 100_000
+    assert stats["evictions"] + stats["rejections"] > 0
+    assert stats["entries"] < 200
+
+
+def test_oversized_images_are_never_admitted():
+    cache = ImageCache(100_000, 10_000)
+    assert not cache.put("big", image(10_001))
+    assert cache.get("big") is None
+    assert cache.put("fits", image(10_000))
+    assert cache.get("fits").data == b"x" * 10_000
+    # a budget of 0 turns the cache off
+    off = ImageCache(0)
+    assert not off.put("small", image(1))
+    assert off.stats()["bytes"] == 0
+
+
+def test_a_scan_does_not_flush_the_hot_images():
+    cache = ImageCache(100_000, 10_000)
+    hot = range(10)
+    for _ in range(4):
+        for key in hot:
+            request(cache, key)
+    # a crawler requests 1000 other images once each while the popular
+    # ten keep being viewed; the cache holds 20 images, so an LRU would
+    # have pushed every popular one out between two of its views
+    hot_misses = 0
+    for i, key in enumerate(range(1000, 2000)):
+        request(cache, key)
+        if i % 3 == 0:
+            hot_misses += not request(cache, hot[i // 3 % len(hot)])
+    assert hot_misses == 0
+    assert cache.stats()["rejections"] > 0
+    assert cache.stats()["bytes"] <= 100_000
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+"""
+image responses sent directly and handed to nginx or Apache by internal redirect
+"""
+import os
+
+import pytest
+
+import photographer_signup_and_login as photohub
+
+
+@pytest.fixture
+def delivery(app, monkeypatch):
+    def delivery(mode, accel_root=None):
+        monkeypatch.setitem(app.config, "IMAGE_DELIVERY", mode)
+        if accel_root is not None:
+            monkeypatch.setitem(app.config, "IMAGE_ACCEL_ROOT", accel_root)
+    return delivery
+
+
+def test_direct_sends_bytes_with_validators(client, delivery, stored_image, jpeg):
+    delivery("direct")
+    response = client.get(f"/image/{stored_image.id}")
+    assert response.status_code == 200
+    assert response.data == jpeg
+    assert response.mimetype == "image/jpeg"
+    assert response.headers["ETag"] == f'"{stored_image.content_hash}"'
+    assert "X-Accel-Redirect" not in response.headers
+    assert "X-Sendfile" not in response.headers
+
+
+def test_direct_range(client, delivery, stored_image, jpeg):
+    delivery("direct")
+    response = client.get(f"/image/{stored_image.id}", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 10-19/{len(jpeg)}"
+    assert response.data == jpeg[10:20]
+
+
+@pytest.mark.parametrize("mode", ["direct", "x-accel-redirect", "x-sendfile"])
+def test_revalidation_is_not_modified(client, delivery, stored_image, mode):
+    delivery(mode)
+    etag = client.get(f"/image/{stored_image.id}").headers["ETag"]
+    response = client.get(f"/image/{stored_image.id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert "X-Accel-Redirect" not in response.headers
+    assert "X-Sendfile" not in response.headers
+
+
+def test_x_accel_redirect_names_the_blob_under_the_prefix(client, app, delivery, stored_image):
+    delivery("x-accel-redirect")
+    response = client.get(f"/image/{stored_image.id}")
+    assert response.status_code == 200
+    assert response.data == b""
+    assert response.mimetype == "image/jpeg"
+    assert response.headers["ETag"] == f'"{stored_image.content_hash}"'
+    assert "immutable" in response.headers["Cache-Control"]
+    blob_path = os.path.relpath(photohub.blob_store.path(stored_image.blob_key), app.config["IMAGE_ACCEL_ROOT"])
+    assert response.headers["X-Accel-Redirect"] == app.config["IMAGE_ACCEL_PREFIX"] + blob_path.replace(os.sep, "/")
+
+
+def test_x_accel_redirect_leaves_ranges_to_the_front_server(client, delivery, stored_image):
+    delivery("x-accel-redirect")
+    response = client.get(f"/image/{stored_image.id}", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 200
+    assert "X-Accel-Redirect" in response.headers
+    assert response.data == b""
+
+
+def test_x_sendfile_names_the_absolute_path(client, delivery, stored_image):
+    delivery("x-sendfile")
+    response = client.get(f"/image/{stored_image.id}")
+    assert response.status_code == 200
+    assert response.data == b""
+    assert response.headers["X-Sendfile"] == os.path.abspath(photohub.blob_store.path(stored_image.blob_key))
+
+
+def test_x_accel_redirect_falls_back_outside_the_accel_root(client, delivery, stored_image, jpeg, tmp_path):
+    # nginx cannot reach a file outside its alias, so the worker sends it
+    delivery("x-accel-redirect", accel_root=str(tmp_path))
+    response = client.get(f"/image/{stored_image.id}")
+    assert response.status_code == 200
+    assert "X-Accel-Redirect" not in response.headers
+    assert response.data == jpeg
+
+
+def test_x_accel_redirect_for_renditions(client, app, delivery, stored_image):
+    pytest.importorskip("PIL")
+    delivery("x-accel-redirect")
+    response = client.get(f"/image/{stored_image.id}/256")
+    assert response.status_code == 200
+    assert response.headers["X-Accel-Redirect"].startswith(app.config["IMAGE_ACCEL_PREFIX"] + "renditions/")
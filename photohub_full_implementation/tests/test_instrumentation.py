@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+"""
+the N+1 detector: one statement shape repeated in a request is flagged once
+"""
+import logging
+
+from flask import Flask
+import pytest
+from sqlalchemy import bindparam, create_engine, text
+
+from photohub_db import Instrumentation
+
+
+@pytest.fixture
+def client(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'notes.sqlite3'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE note (id INTEGER PRIMARY KEY, body TEXT)"))
+        conn.execute(text("INSERT INTO note (body) VALUES ('a'), ('b'), ('c'), ('d'), ('e'), ('f'), ('g')"))
+
+    app = Flask(__name__)
+    app.config["N_PLUS_ONE_THRESHOLD"] = 5
+    instrumentation = Instrumentation(app, engine)
+
+    def one_by_one(count):
+        with engine.connect() as conn:
+            for note_id in range(1, count + 1):
+                conn.execute(text("SELECT body FROM note WHERE id = :id"), {"id": note_id})
+        return "ok"
+
+    app.add_url_rule("/loop", "loop", lambda: one_by_one(7))
+    app.add_url_rule("/few", "few", lambda: one_by_one(5))
+
+    @app.route("/batched")
+    def batched():
+        # seven lookups whose IN lists all differ in length
+        with engine.connect() as conn:
+            for size in range(1, 8):
+                conn.execute(text("SELECT body FROM note WHERE id IN :ids").bindparams(
+                        bindparam("ids", expanding=True)), {"ids": list(range(1, size + 1))})
+        return "ok"
+
+    @app.route("/inserts")
+    def inserts():
+        with engine.begin() as conn:
+            for n in range(10):
+                conn.execute(text("INSERT INTO note (body) VALUES (:body)"), {"body": str(n)})
+        return "ok"
+
+    client = app.test_client()
+    client.instrumentation = instrumentation
+    return client
+
+
+def warnings_for(client):
+    return client.instrumentation.repeated_statements.values
+
+
+def test_a_looped_query_is_flagged_once(client, caplog):
+    with caplog.at_level(logging.WARNING, "photohub.instrumentation"):
+        assert client.get("/loop").status_code == 200
+    assert warnings_for(client) == {"loop": 1}
+    [record] = caplog.records
+    assert "loop ran the same statement more than 5 times" in record.getMessage()
+    assert "SELECT body FROM note WHERE id = ?" in record.getMessage()
+    assert 'photohub_repeated_statement_warnings_total{route="loop"} 1' in client.get("/metrics").get_data(as_text=True)
+
+    # counted per request, not per process lifetime
+    client.get("/loop")
+    assert warnings_for(client) == {"loop": 2}
+
+
+def test_in_lists_of_any_length_are_one_shape(client):
+    assert client.get("/batched").status_code == 200
+    assert warnings_for(client) == {"batched": 1}
+
+
+@pytest.mark.parametrize("url", ["/few", "/inserts"])
+def test_statements_up_to_the_threshold_and_inserts_are_not_flagged(client, url):
+    assert client.get(url).status_code == 200
+    assert warnings_for(client) == {}
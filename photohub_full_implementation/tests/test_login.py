@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+"""
+login throttling, the bounded password hasher, and the cached session user
+"""
+import pytest
+
+from passwords import PasswordHasher, RateLimiter
+from photohub_db.cache import MISSING
+import photographer_signup_and_login as photohub
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """Fresh buckets: 3 attempts per address, 2 per username, no refill"""
+    monkeypatch.setattr(photohub, "ip_attempts", RateLimiter(1e-9, 3))
+    monkeypatch.setattr(photohub, "username_attempts", RateLimiter(1e-9, 2))
+
+
+def attempt(client, username, password="wrong"):
+    return client.post("/photographer_login", data={"username": username, "password": password})
+
+
+def test_repeated_logins_for_a_username_are_refused(client, make_user, limits):
+    make_user("ada")
+    assert attempt(client, "ada").status_code == 200
+    assert attempt(client, "ADA").status_code == 200
+    response = attempt(client, "ada")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_repeated_logins_from_an_address_are_refused(client, make_user, limits):
+    for username in ("ada", "grace", "edsger"):
+        assert attempt(client, username).status_code == 200
+    assert attempt(client, "barbara").status_code == 429
+
+
+def test_logins_are_refused_while_the_hasher_is_saturated(client, make_user, limits, monkeypatch):
+    hasher = PasswordHasher(1, 0)
+    monkeypatch.setattr(photohub, "password_hasher", hasher)
+    make_user("ada")
+    # another login holds the only slot
+    hasher.slots.acquire()
+    try:
+        response = attempt(client, "ada")
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+    finally:
+        hasher.slots.release()
+    assert attempt(client, "ada").status_code == 200
+
+
+def test_the_cached_user_is_dropped_when_a_change_commits(app, make_user):
+    user = make_user("ada")
+    key = f"user:{user.id}"
+    old = {name: getattr(user, name) for name in photohub.SESSION_USER_COLUMNS}
+    user.email = "ada@example.org"
+    photohub.db.session.flush()
+    # a request that read the row before the commit caches the old email
+    photohub.cache.set(key, "session", old)
+    photohub.db.session.commit()
+    assert photohub.cache.get(key, "session") is MISSING
+    user_id = user.id
+    photohub.db.session.expunge_all()
+    assert photohub.load_user(user_id).email == "ada@example.org"
+
+
+def test_a_rolled_back_change_leaves_the_cached_user(app, make_user):
+    user = make_user("ada")
+    key = f"user:{user.id}"
+    photohub.load_user(user.id)
+    user.email = "ada@example.org"
+    photohub.db.session.flush()
+    photohub.db.session.rollback()
+    photohub.db.session.commit()
+    assert photohub.cache.get(key, "session")["email"] == "ada@example.com"
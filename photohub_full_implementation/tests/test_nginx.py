@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+"""
+deploy/nginx.conf in front of the app, when nginx is installed
+"""
+import http.client
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+
+import pytest
+from werkzeug.serving import make_server
+
+NGINX = shutil.which("nginx")
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "deploy", "nginx.conf")
+
+pytestmark = pytest.mark.skipif(NGINX is None, reason="nginx is not installed")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_config_is_valid(tmp_path):
+    result = subprocess.run([NGINX, "-t", "-p", str(tmp_path), "-c", os.path.abspath(CONFIG)],
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+@pytest.fixture
+def nginx(app, monkeypatch, tmp_path):
+    """Base URL of nginx running deploy/nginx.conf in front of the app"""
+    monkeypatch.setitem(app.config, "IMAGE_DELIVERY", "x-accel-redirect")
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    port = free_port()
+    with open(CONFIG) as f:
+        config = f.read()
+    for old, new in (
+            ("server 127.0.0.1:5000;", f"server 127.0.0.1:{server.server_port};"),
+            ("listen 8080;", f"listen 127.0.0.1:{port};"),
+            ("alias uploads/;", f"alias {app.config['IMAGE_ACCEL_ROOT']}/;"),
+            ("/tmp/photohub-nginx", f"{tmp_path}/nginx"),
+            ):
+        assert old in config
+        config = config.replace(old, new)
+    # workers started as root drop to nobody, who cannot read the test files
+    config = "daemon off;\n" + ("user root;\n" if os.geteuid() == 0 else "") + config
+    conf = tmp_path / "nginx.conf"
+    conf.write_text(config)
+    process = subprocess.Popen([NGINX, "-p", str(tmp_path), "-c", str(conf)],
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    pytest.fail(f"nginx did not start: {process.stdout.read().decode()}")
+                time.sleep(0.05)
+        yield port
+    finally:
+        process.terminate()
+        process.wait(10)
+        server.shutdown()
+
+
+def get(port, path, **headers):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        return response, response.read()
+    finally:
+        conn.close()
+
+
+def test_nginx_sends_the_file(nginx, stored_image, jpeg):
+    response, body = get(nginx, f"/image/{stored_image.id}")
+    assert response.status == 200
+    assert body == jpeg
+    assert response.getheader("Content-Type") == "image/jpeg"
+    assert response.getheader("ETag") == f'"{stored_image.content_hash}"'
+    assert "immutable" in response.getheader("Cache-Control")
+    assert response.getheader("X-Accel-Redirect") is None
+
+
+def test_nginx_revalidation(nginx, stored_image):
+    response, body = get(nginx, f"/image/{stored_image.id}", **{"If-None-Match": f'"{stored_image.content_hash}"'})
+    assert response.status == 304
+    assert body == b""
+
+
+def test_nginx_ranges(nginx, stored_image, jpeg):
+    response, body = get(nginx, f"/image/{stored_image.id}", Range="bytes=10-19")
+    assert response.status == 206
+    assert response.getheader("Content-Range") == f"bytes 10-19/{len(jpeg)}"
+    assert body == jpeg[10:20]
+
+
+def test_files_are_not_reachable_directly(nginx, app, stored_image):
+    response, _ = get(nginx, app.config["IMAGE_ACCEL_PREFIX"] + "blobs/")
+    assert response.status == 404
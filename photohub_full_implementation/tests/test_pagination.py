@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+"""
+keyset pagination: ties on the timestamp, the last page, and bad cursors
+"""
+import base64
+from datetime import datetime
+import importlib.util
+import os
+
+import pytest
+
+from photohub_db.pagination import BadCursor, decode_cursor, encode_cursor
+import photographer_signup_and_login as photohub
+
+
+NOON = datetime(2024, 5, 1, 12, 0, 0)
+EVENING = datetime(2024, 5, 1, 18, 0, 0)
+
+
+def b64(raw):
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+BAD_CURSORS = [
+        "not a cursor!",
+        b64(b"not json"),
+        b64(b"null"),
+        b64(b"[1]"),
+        b64(b'["yesterday", 1]'),
+        b64(b'[null, 1]'),
+        b64(b'["2024-05-01T12:00:00", "one"]'),
+        b64(b"\xff\xfe"),
+        ]
+
+
+def walk(client, url, page_size, **args):
+    """Every item of every page, and the number of pages"""
+    items, pages, cursor = [], 0, ""
+    # a cursor that does not move on would otherwise page forever
+    while pages < 20:
+        response = client.get(url, query_string=dict(args, page_size=page_size, cursor=cursor))
+        assert response.status_code == 200
+        pages += 1
+        items += response.json["items"]
+        cursor = response.json["next_cursor"]
+        if cursor is None:
+            return items, pages
+    pytest.fail(f"{url} did not reach its last page")
+
+
+def test_a_cursor_round_trips():
+    assert decode_cursor(encode_cursor(NOON, 7)) == (NOON, 7)
+    assert decode_cursor("") is None
+
+
+@pytest.mark.parametrize("cursor", BAD_CURSORS)
+def test_a_tampered_cursor_is_refused(cursor):
+    with pytest.raises(BadCursor):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 3, 7, 100])
+def test_images_sharing_a_timestamp_are_each_listed_once(client, stored_image, page_size):
+    user_id, category_id = stored_image.user_id, stored_image.category_id
+    for uploaded_at in [NOON] * 5 + [EVENING]:
+        photohub.db.session.add(photohub.Image(user_id=user_id, category_id=category_id,
+                                               blob_key=stored_image.blob_key, uploaded_at=uploaded_at))
+    photohub.db.session.commit()
+    expected = [row.id for row in photohub.db.session.execute(
+            photohub.db.select(photohub.Image.id).order_by(
+                photohub.Image.uploaded_at.desc(), photohub.Image.id.desc()))]
+
+    items, pages = walk(client, f"/api/photographers/{user_id}/images", page_size, category=category_id)
+    assert [item["id"] for item in items] == expected
+    # a last page that is exactly full has no cursor to an empty page
+    assert pages == -(-len(expected) // page_size)
+
+
+def test_categories_sharing_a_timestamp_are_each_listed_once(client, app):
+    for name in ("Weddings", "Portraits", "Events", "Food"):
+        photohub.db.session.add(photohub.Category(name=name, created_at=NOON))
+    photohub.db.session.commit()
+    items, pages = walk(client, "/api/categories", 2)
+    assert [item["name"] for item in items] == ["Weddings", "Portraits", "Events", "Food"]
+    assert pages == 2
+
+
+@pytest.mark.parametrize("cursor", BAD_CURSORS)
+def test_listings_answer_a_tampered_cursor_with_400(client, stored_image, login, cursor):
+    login(stored_image.user)
+    category = stored_image.category_id
+    for url in ("/api/categories",
+                f"/api/categories/{category}/photographers",
+                f"/api/photographers/{stored_image.user_id}/images",
+                "/dashboard"):
+        response = client.get(url, query_string={"category": category, "cursor": cursor})
+        assert response.status_code == 400, url
+
+
+@pytest.fixture
+def profiles(tmp_path, monkeypatch):
+    """Profile_Creation's app, on a database of its own"""
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'profiles.sqlite3'}")
+    monkeypatch.setenv("SEARCH_INDEX_PATH", str(tmp_path / "search.sqlite3"))
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "Profile_Creation", "profile.py")
+    # loaded under another name, profile.py would shadow the standard library's profile
+    spec = importlib.util.spec_from_file_location("profile_creation", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.app.config.update(TESTING=True)
+    with module.app.app_context():
+        module.db.execute(
+                "CREATE TABLE photographers_profiles (id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT,"
+                " user_name TEXT, email TEXT, phone_number TEXT, location TEXT, created_at DATETIME NOT NULL)")
+        for n, created_at in enumerate([NOON] * 4 + [EVENING] * 2):
+            module.db.execute(
+                    "INSERT INTO photographers_profiles (first_name, last_name, user_name, email, phone_number,"
+                    " location, created_at) VALUES ('Ada', 'L', :user_name, 'ada@example.com', '1', 'London', :created_at)",
+                    {"user_name": f"ada{n}", "created_at": created_at})
+        module.db.commit()
+    return module
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 4, 6])
+def test_profiles_sharing_a_timestamp_are_each_listed_once(profiles, page_size):
+    items, pages = walk(profiles.app.test_client(), "/api/profiles", page_size)
+    # newest first, and the higher id first within a timestamp
+    assert [item["id"] for item in items] == [6, 5, 4, 3, 2, 1]
+    assert pages == -(-6 // page_size)
+
+
+def test_profiles_answer_a_tampered_cursor_with_400(profiles):
+    client = profiles.app.test_client()
+    for cursor in BAD_CURSORS:
+        assert client.get("/api/profiles", query_string={"cursor": cursor}).status_code == 400
@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+"""
+placeholders stay within the column that stores them, whatever the image
+"""
+import base64
+import io
+import os
+
+import pytest
+
+import image_meta
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def noise(width, height):
+    """An image JPEG cannot compress, the worst case for a placeholder"""
+    out = io.BytesIO()
+    Image.frombytes("RGB", (width, height), os.urandom(width * height * 3)).save(out, "PNG")
+    out.seek(0)
+    return out
+
+
+@pytest.fixture(params=["webp", "jpeg"])
+def fmt(request, monkeypatch):
+    # Pillow builds without WebP fall back to JPEG
+    monkeypatch.setattr(image_meta.features, "check", lambda feature: request.param == "webp")
+    return request.param
+
+
+@pytest.mark.parametrize("size", [(16, 16), (640, 480), (17, 3000)])
+def test_within_the_column(fmt, size):
+    uri = image_meta.placeholder(noise(*size))
+    assert uri.startswith(f"data:image/{fmt};base64,")
+    assert len(uri) <= image_meta.PLACEHOLDER_MAX_LENGTH
+    with Image.open(io.BytesIO(base64.b64decode(uri.split(",", 1)[1]))) as preview:
+        assert max(preview.size) <= image_meta.PLACEHOLDER_SIZE
+
+
+def test_smaller_budgets_shrink_the_preview(fmt):
+    full = image_meta.placeholder(noise(16, 16))
+    budget = len(full) - 1
+    smaller = image_meta.placeholder(noise(16, 16), max_length=budget)
+    assert smaller is not None and len(smaller) <= budget
+
+
+def test_nothing_rather_than_too_much(fmt):
+    assert image_meta.placeholder(noise(16, 16), max_length=40) is None
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+"""
+portfolio downloads: the streamed archive, its ranges and its checksums
+"""
+from datetime import datetime
+import io
+import zipfile
+import zlib
+
+import pytest
+
+import photographer_signup_and_login as photohub
+from portfolio_zip import StreamedZip, ZipEntry
+
+
+@pytest.fixture
+def portfolio(app, make_user):
+    """A photographer with three images in two categories, one without a stored CRC"""
+    Image = pytest.importorskip("PIL.Image")
+    user = make_user()
+    weddings, birthdays = photohub.Category(name="Weddings"), photohub.Category(name="Birthdays")
+    photohub.db.session.add_all([weddings, birthdays])
+    photohub.db.session.flush()
+    blobs = {}
+    for i, category in enumerate((weddings, weddings, birthdays)):
+        out = io.BytesIO()
+        Image.effect_noise((64 + i, 48), 30 + i).convert("RGB").save(out, "JPEG")
+        image = photohub.Image(user_id=user.id, category_id=category.id,
+                               blob_key=photohub.blob_store.put_bytes(out.getvalue()))
+        image.content_hash = image.blob_key
+        image.set_metadata(io.BytesIO(out.getvalue()))
+        photohub.db.session.add(image)
+        photohub.db.session.flush()
+        blobs[image.id] = out.getvalue()
+    # uploaded before checksums were kept
+    image.crc32 = None
+    photohub.db.session.commit()
+    return user, blobs
+
+
+def download(client, user, **headers):
+    return client.get(f"/photographer_profile/{user.id}/download", headers=headers)
+
+
+def test_members_are_the_stored_blobs(client, portfolio):
+    user, blobs = portfolio
+    response = download(client, user)
+    assert response.status_code == 200
+    assert response.mimetype == "application/zip"
+    assert response.content_length == len(response.data)
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.testzip() is None
+        members = archive.infolist()
+        assert len(members) == len(blobs)
+        for member in members:
+            image_id = int(member.filename.rsplit("-", 1)[1].split(".")[0])
+            assert archive.read(member) == blobs[image_id]
+            assert member.CRC == zlib.crc32(blobs[image_id])
+    folders = sorted({member.filename.split("/")[0] for member in members})
+    assert folders == ["Birthdays", "Weddings"]
+
+
+@pytest.mark.parametrize("first, last", [(0, 0), (0, 29), (17, 4000), (100, None), (None, 50)])
+def test_ranges_are_slices_of_the_whole(client, portfolio, first, last):
+    user, _ = portfolio
+    whole = download(client, user).data
+    if first is None:
+        spec, expected = f"-{last}", whole[-last:]
+    elif last is None:
+        spec, expected = f"{first}-", whole[first:]
+    else:
+        spec, expected = f"{first}-{last}", whole[first:last + 1]
+    response = download(client, user, Range=f"bytes={spec}")
+    assert response.status_code == 206
+    assert response.data == expected
+    start = len(whole) - len(expected) if first is None else first
+    assert response.headers["Content-Range"] == f"bytes {start}-{start + len(expected) - 1}/{len(whole)}"
+
+
+def test_every_chunk_boundary():
+    # slicing inside headers, file bodies and the central directory alike
+    entries = [ZipEntry(f"{i}.bin", len(data), None, datetime(2024, 1, 2, 3, 4, 5),
+                        lambda data=data: io.BytesIO(data))
+               for i, data in enumerate([b"a" * 7, b"", b"bc" * 300])]
+    archive = StreamedZip(entries)
+    whole = b"".join(archive.iter_bytes())
+    assert len(whole) == archive.size
+    for start in range(0, archive.size, 13):
+        for stop in (start, start + 1, start + 97, archive.size):
+            assert b"".join(archive.iter_bytes(start, min(stop, archive.size))) == whole[start:stop]
+
+
+def test_mismatched_if_range_sends_the_whole_archive(client, portfolio):
+    user, _ = portfolio
+    whole = download(client, user)
+    response = download(client, user, Range="bytes=10-20", **{"If-Range": '"not-the-etag"'})
+    assert response.status_code == 200
+    assert response.data == whole.data
+    response = download(client, user, Range="bytes=10-20", **{"If-Range": whole.headers["ETag"]})
+    assert response.status_code == 206
+    assert response.data == whole.data[10:21]
+
+
+def test_unsatisfiable_range(client, portfolio):
+    user, _ = portfolio
+    size = len(download(client, user).data)
+    response = download(client, user, Range=f"bytes={size}-")
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{size}"
+
+
+def test_revalidation(client, portfolio):
+    user, _ = portfolio
+    etag = download(client, user).headers["ETag"]
+    assert download(client, user, **{"If-None-Match": etag}).status_code == 304
+
+
+def test_one_category(client, portfolio):
+    user, blobs = portfolio
+    category = photohub.Category.query.filter_by(name="Birthdays").one()
+    response = client.get(f"/photographer_profile/{user.id}/download?category={category.id}")
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert [member.filename.split("/")[0] for member in archive.infolist()] == ["Birthdays"]
+
+
+def test_missing_crc_is_computed_from_the_bytes():
+    data = b"photo bytes" * 1000
+    opened = []
+
+    def open_data():
+        opened.append(True)
+        return io.BytesIO(data)
+
+    archive = StreamedZip([ZipEntry("a.jpg", len(data), None, datetime(2024, 5, 6), open_data)])
+    body = b"".join(archive.iter_bytes())
+    with zipfile.ZipFile(io.BytesIO(body)) as unzipped:
+        assert unzipped.getinfo("a.jpg").CRC == zlib.crc32(data)
+        assert unzipped.read("a.jpg") == data
+    # once for the checksum, once for the body; the directory reuses it
+    assert len(opened) == 2
+
+
+def test_zip64_past_65535_entries():
+    entries = [ZipEntry(f"{i}", 1, None, datetime(2024, 1, 1), lambda: io.BytesIO(b"x"))
+               for i in range(0xFFFF)]
+    archive = StreamedZip(entries)
+    assert archive.zip64
+    body = b"".join(archive.iter_bytes())
+    assert len(body) == archive.size
+    with zipfile.ZipFile(io.BytesIO(body)) as unzipped:
+        names = unzipped.namelist()
+        assert len(names) == 0xFFFF
+        assert unzipped.read(names[-1]) == b"x"
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+"""
+the dashboard and profile pages cost the same statements for any number of categories
+"""
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+import photographer_signup_and_login as photohub
+
+
+@contextmanager
+def count_statements():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(photohub.db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(photohub.db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def add_catalog(user, categories):
+    """categories categories holding one image of user each"""
+    for i in range(categories):
+        category = photohub.Category(name=f"category {i}")
+        photohub.db.session.add(category)
+        photohub.db.session.flush()
+        photohub.db.session.add(photohub.Image(
+                user_id=user.id, category_id=category.id, blob_key=f"{i:064x}",
+                mime_type="image/jpeg", width=640, height=480))
+    photohub.db.session.commit()
+
+
+def statements_for(client, url):
+    # a cold cache, so the category list is counted every time
+    photohub.cache.backend.entries.clear()
+    with count_statements() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.mark.parametrize("page", ["dashboard", "photographer_profile"])
+def test_statement_count_does_not_grow_with_categories(page, app, client, make_user, login):
+    counts = []
+    for categories in (2, 20):
+        photohub.db.session.remove()
+        photohub.db.drop_all()
+        photohub.db.create_all()
+        user = make_user()
+        add_catalog(user, categories)
+        login(user)
+        url = "/dashboard" if page == "dashboard" else f"/photographer_profile/{user.id}"
+        counts.append(statements_for(client, url))
+    assert 0 < counts[0] == counts[1]
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+"""
+renditions and AVIF/WebP variants, on a pool or drawn inline
+"""
+import os
+
+import pytest
+
+from renditions import RENDITION_SIZES, RenditionPipeline
+import photographer_signup_and_login as photohub
+
+PIL = pytest.importorskip("PIL")
+
+
+@pytest.fixture
+def source(tmp_path, jpeg):
+    path = tmp_path / "source.jpg"
+    path.write_bytes(jpeg)
+    return str(path)
+
+
+def test_no_workers_draws_inline(tmp_path, source):
+    pipeline = RenditionPipeline(str(tmp_path / "renditions"), workers=0, formats=())
+    futures = pipeline.submit(source, "abcdef", "image/jpeg")
+    assert futures and all(future.done() and future.exception() is None for future in futures)
+    for size in RENDITION_SIZES:
+        assert os.path.exists(pipeline.path("abcdef", size))
+
+
+def test_no_workers_serves_a_variant_drawn_on_demand(tmp_path, source):
+    pipeline = RenditionPipeline(str(tmp_path / "renditions"), workers=0, formats=("webp",))
+    if not pipeline.formats:
+        pytest.skip("Pillow cannot write WebP")
+    (path, mime_type, fmt), final = pipeline.negotiate(source, "abcdef", "image/jpeg", None, ("webp",))
+    assert final
+    assert os.path.exists(pipeline.variant_path("abcdef", None, "webp"))
+    # a noisy source may keep its JPEG if the WebP is no smaller
+    assert (mime_type, fmt) in (("image/webp", "webp"), ("image/jpeg", None))
+
+
+def test_negative_workers_are_refused(tmp_path):
+    with pytest.raises(ValueError):
+        RenditionPipeline(str(tmp_path), workers=-1)
+
+
+@pytest.fixture
+def webp(tmp_path, monkeypatch):
+    pipeline = RenditionPipeline(str(tmp_path / "renditions"), workers=0, formats=("webp",))
+    if not pipeline.formats:
+        pytest.skip("Pillow cannot write WebP")
+    monkeypatch.setattr(photohub, "renditions", pipeline)
+    return pipeline
+
+
+def test_accept_picks_the_variant_and_its_etag(client, webp, stored_image):
+    image_id, content_hash = stored_image.id, stored_image.content_hash
+
+    response = client.get(f"/image/{image_id}", headers={"Accept": "image/webp,*/*"})
+    assert response.mimetype == "image/webp"
+    assert response.get_etag() == (f"{content_hash}.webp", False)
+    assert "Accept" in response.vary
+    assert response.data[8:12] == b"WEBP"
+
+    response = client.get(f"/image/{image_id}", headers={"Accept": "*/*"})
+    assert response.mimetype == "image/jpeg"
+    assert response.get_etag() == (content_hash, False)
+    assert "Accept" in response.vary
+
+
+def test_a_variant_etag_only_revalidates_that_variant(client, webp, stored_image):
+    url = f"/image/{stored_image.id}"
+    etag = f'"{stored_image.content_hash}.webp"'
+    assert client.get(url, headers={"Accept": "image/webp", "If-None-Match": etag}).status_code == 304
+    assert client.get(url, headers={"Accept": "image/jpeg", "If-None-Match": etag}).status_code == 200
+
+
+def test_renditions_negotiate_too(client, webp, stored_image):
+    size = RENDITION_SIZES[0]
+    response = client.get(f"/image/{stored_image.id}/{size}", headers={"Accept": "image/webp"})
+    assert response.mimetype == "image/webp"
+    assert response.get_etag() == (f"{stored_image.blob_key}-{size}.webp", False)
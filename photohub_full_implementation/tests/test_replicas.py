@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+"""
+read/write splitting between a primary and a replica, two sqlite files here
+"""
+import os
+import sqlite3
+
+from flask import Flask, jsonify, request
+from flask_sqlalchemy import SQLAlchemy
+import pytest
+
+import photohub_db
+from photohub_db.orm import RoutingSession
+from photohub_db.replicas import PIN_COOKIE
+
+
+def sqlite_file(path, notes):
+    with sqlite3.connect(path) as conn:
+        if notes is not None:
+            conn.execute("CREATE TABLE notes (id INTEGER PRIMARY KEY, text VARCHAR(50))")
+            conn.executemany("INSERT INTO notes (text) VALUES (?)", [(note,) for note in notes])
+    return f"sqlite:///{path}"
+
+
+def make_app(primary, replica):
+    app = Flask(__name__)
+    app.config.update(
+            DATABASE_URL=primary,
+            DATABASE_REPLICA_URLS=replica,
+            )
+    app.config["SQLALCHEMY_DATABASE_URI"] = primary
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = photohub_db.engine_options(app.config)
+    db = SQLAlchemy(app, session_options={"class_": RoutingSession})
+
+    class Note(db.Model):
+        __tablename__ = "notes"
+        id = db.Column(db.Integer, primary_key=True)
+        text = db.Column(db.String(50))
+
+    raw = photohub_db.Database()
+    with app.app_context():
+        replicas = photohub_db.ReadReplicas(app, db.engine)
+        # the hand-written SQL of the other apps, over the same engines
+        raw.engine, raw.replicas = db.engine, replicas
+    # no background probes, the tests run check() themselves
+    replicas.replicas.checker_pid = os.getpid()
+    app.teardown_appcontext(raw._release)
+
+    @app.route("/notes", methods=["GET", "POST"])
+    def notes():
+        if request.method == "POST":
+            db.session.add(Note(text="written"))
+            db.session.commit()
+        return jsonify(sorted(db.session.scalars(db.select(Note.text))))
+
+    @app.route("/raw")
+    def raw_notes():
+        return jsonify(sorted(row["text"] for row in raw.fetch_all("SELECT text FROM notes")))
+
+    return app, replicas
+
+
+@pytest.fixture
+def primary(tmp_path):
+    return sqlite_file(str(tmp_path / "primary.db"), ["primary"])
+
+
+def test_reads_of_get_requests_go_to_the_replica(tmp_path, primary):
+    app, _ = make_app(primary, sqlite_file(str(tmp_path / "replica.db"), ["replica"]))
+    client = app.test_client()
+    assert client.get("/notes").json == ["replica"]
+    assert client.get("/raw").json == ["replica"]
+
+
+def test_writes_go_to_the_primary_and_pin_the_client(tmp_path, primary):
+    app, replicas = make_app(primary, sqlite_file(str(tmp_path / "replica.db"), ["replica"]))
+    client = app.test_client()
+    response = client.post("/notes")
+    assert response.json == ["primary", "written"]
+    assert PIN_COOKIE in response.headers["Set-Cookie"]
+    with sqlite3.connect(tmp_path / "replica.db") as conn:
+        assert conn.execute("SELECT count(*) FROM notes").fetchone() == (1,)
+    # the client reads its own write until the pin runs out
+    assert client.get("/notes").json == ["primary", "written"]
+    client.delete_cookie(PIN_COOKIE)
+    assert client.get("/notes").json == ["replica"]
+
+
+def test_a_pin_longer_than_the_app_sets_is_ignored(tmp_path, primary):
+    app, replicas = make_app(primary, sqlite_file(str(tmp_path / "replica.db"), ["replica"]))
+    client = app.test_client()
+    client.set_cookie(PIN_COOKIE, "9999999999")
+    assert client.get("/notes").json == ["replica"]
+
+
+def test_a_dead_replica_fails_over(tmp_path, primary):
+    app, replicas = make_app(primary, f"sqlite:///{tmp_path}/missing/replica.db")
+    client = app.test_client()
+    assert client.get("/notes").json == ["primary"]
+    assert client.get("/raw").json == ["primary"]
+    [replica] = replicas.replicas.replicas
+    assert not replica.healthy
+    assert replicas.replicas.pick() is None
+
+
+@pytest.mark.parametrize("path", ["/notes", "/raw"])
+def test_a_broken_replica_falls_back_to_the_primary(tmp_path, primary, path):
+    # reachable, but behind on the migration that created the table
+    app, replicas = make_app(primary, sqlite_file(str(tmp_path / "replica.db"), None))
+    client = app.test_client()
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.json == ["primary"]
+    [replica] = replicas.replicas.replicas
+    assert not replica.healthy
+    # a probe that succeeds puts it back in rotation
+    replicas.replicas.check()
+    assert replica.healthy
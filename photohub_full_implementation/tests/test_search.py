@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+"""
+photographer search: prefixes, pages, and updates without a rebuild
+"""
+from datetime import datetime, timedelta
+import io
+
+import pytest
+
+import photohub_db
+import photographer_signup_and_login as photohub
+
+
+@pytest.fixture
+def index(tmp_path):
+    return photohub_db.PhotographerSearch(str(tmp_path / "search.db"))
+
+
+@pytest.fixture
+def app_index(app):
+    photohub.search_index.rebuild([], [])
+    return photohub.search_index
+
+
+def usernames(rows):
+    return [row["username"] for row in rows]
+
+
+def test_every_word_matches_as_a_prefix(index):
+    index.upsert("alice_photo", name="Alice Wanjiru", location="Nairobi")
+    index.upsert("bob", name="Bob Otieno", location="Mombasa")
+    index.upsert("alina", name="Alina Smith", location="Nakuru")
+    assert sorted(usernames(index.search("ali")[0])) == ["alice_photo", "alina"]
+    assert usernames(index.search("al wan")[0]) == ["alice_photo"]
+    assert usernames(index.search("o")[0]) == ["bob"]
+    assert usernames(index.search(location="na")[0]) == ["alina", "alice_photo"]
+    # the location filter only looks at the location
+    assert index.search(location="bob")[0] == []
+    assert index.search("zzz")[0] == []
+    # punctuation is no FTS5 syntax error
+    assert usernames(index.search('ali" OR *')[0]) == []
+
+
+def test_profiles_fill_in_the_signup_row(index):
+    index.upsert("carol", user_id=7)
+    index.upsert("carol", name="Carol Njeri", location="Kisumu")
+    [row], _ = index.search("njeri")
+    assert (row["user_id"], row["location"]) == (7, "Kisumu")
+
+
+def test_pages_follow_the_cursor(index):
+    start = datetime(2024, 1, 1)
+    for i in range(7):
+        # pairs share a created_at, the id breaks the tie
+        index.upsert(f"photographer{i}", created_at=start + timedelta(minutes=i // 2))
+    seen, cursor = [], None
+    while True:
+        rows, cursor = index.search("photographer", cursor=cursor, page_size=3)
+        seen += usernames(rows)
+        if cursor is None:
+            break
+    assert seen == [f"photographer{i}" for i in (6, 5, 4, 3, 2, 1, 0)]
+    rows, cursor = index.search("photographer", page_size=7)
+    assert len(rows) == 7 and cursor is None
+
+
+def test_signups_are_found_at_once(client, app_index):
+    response = client.post("/photographers_signup", data={
+            "preferred_username": "wanjiku_shoots",
+            "email": "wanjiku@example.com",
+            "password": "secret123",
+            "confirm_password": "secret123",
+            })
+    assert response.status_code == 302
+    items = client.get("/api/search?q=wanj").json["items"]
+    assert [item["username"] for item in items] == ["wanjiku_shoots"]
+    assert items[0]["url"] == f"/photographer_profile/{items[0]['user_id']}"
+
+
+def test_uploads_and_deletes_change_the_category_filter(client, app_index, make_user, login, jpeg):
+    user = make_user("kamau")
+    app_index.upsert(user.preferred_username, user_id=user.id)
+    category = photohub.Category(name="Weddings")
+    photohub.db.session.add(category)
+    photohub.db.session.commit()
+    login(user)
+
+    assert client.get(f"/api/search?category={category.id}").json["items"] == []
+    client.post("/upload", data={"file": (io.BytesIO(jpeg), "a.jpg"), "category": str(category.id)})
+    items = client.get(f"/api/search?category={category.id}&q=kam").json["items"]
+    assert [item["username"] for item in items] == ["kamau"]
+
+    image = photohub.Image.query.one()
+    client.post(f"/image/{image.id}/delete")
+    assert client.get(f"/api/search?category={category.id}").json["items"] == []
+
+
+def test_api_pages(client, app_index):
+    for i in range(5):
+        app_index.upsert(f"p{i}", created_at=datetime(2024, 1, 1) + timedelta(days=i))
+    first = client.get("/api/search?q=p&page_size=2").json
+    assert [item["username"] for item in first["items"]] == ["p4", "p3"]
+    second = client.get(f"/api/search?q=p&page_size=2&cursor={first['next_cursor']}").json
+    assert [item["username"] for item in second["items"]] == ["p2", "p1"]
+    last = client.get(f"/api/search?q=p&page_size=2&cursor={second['next_cursor']}").json
+    assert [item["username"] for item in last["items"]] == ["p0"]
+    assert last["next_cursor"] is None
@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+"""
+single image uploads from the dashboard
+"""
+import io
+import re
+
+import pytest
+
+import photographer_signup_and_login as photohub
+
+
+@pytest.fixture
+def photographer(make_user, login):
+    user = make_user()
+    login(user)
+    return user
+
+
+def upload(client, jpeg, category):
+    return client.post("/upload", data={"file": (io.BytesIO(jpeg), "photo.jpg"), "category": category})
+
+
+def test_upload_stores_the_image(client, photographer, jpeg):
+    category = photohub.Category(name="Weddings")
+    photohub.db.session.add(category)
+    photohub.db.session.commit()
+    assert upload(client, jpeg, str(category.id)).status_code == 302
+    [image] = photohub.Image.query.all()
+    assert (image.category_id, image.mime_type, image.width) == (category.id, "image/jpeg", 640)
+
+
+@pytest.mark.parametrize("category", ["abc", "", "999"])
+def test_unknown_categories_are_refused(client, photographer, jpeg, category):
+    response = upload(client, jpeg, category)
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert ("error", "Choose a category to upload to.") in session["_flashes"]
+    assert photohub.Image.query.count() == 0
+    assert photohub.CategoryStats.query.count() == 0
+
+
+def test_uploads_need_the_dashboard_token(client, app, monkeypatch, photographer, jpeg):
+    monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", True)
+    category = photohub.Category(name="Weddings")
+    photohub.db.session.add(category)
+    photohub.db.session.commit()
+    single = {"file": (io.BytesIO(jpeg), "photo.jpg"), "category": str(category.id)}
+    bulk = {"files": [(io.BytesIO(jpeg), "photo.jpg")], "category": str(category.id)}
+
+    assert client.post("/upload", data=single).status_code == 400
+    assert client.post("/upload/bulk", data=bulk).status_code == 400
+    assert photohub.Image.query.count() == 0
+
+    page = client.get("/dashboard").get_data(as_text=True)
+    token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+    single.update(file=(io.BytesIO(jpeg), "photo.jpg"), csrf_token=token)
+    assert client.post("/upload", data=single).status_code == 302
+    bulk.update(files=[(io.BytesIO(jpeg[:-1]), "other.jpg")], csrf_token=token)
+    assert client.post("/upload/bulk", data=bulk).status_code == 302
+    assert photohub.Image.query.count() == 2
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+"""
+resumable upload sessions: expiry, the per-user limit and concurrent chunks
+"""
+import io
+import os
+import time
+
+import pytest
+
+import photographer_signup_and_login as photohub
+from uploads import UploadError, UploadSessions
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    return UploadSessions(str(tmp_path), 100, ttl=60, max_open=2)
+
+
+def age(sessions, upload_id, user_id, seconds):
+    data = os.path.join(sessions._dir(upload_id, user_id), "data")
+    then = time.time() - seconds
+    os.utime(data, (then, then))
+
+
+def test_stale_uploads_are_swept(sessions):
+    stale = sessions.create(1, 1, 10)
+    fresh = sessions.create(2, 1, 10)
+    age(sessions, stale, 1, 120)
+    assert sessions.sweep() == 1
+    with pytest.raises(UploadError) as error:
+        sessions.status(stale, 1)
+    assert error.value.status == 404
+    assert sessions.status(fresh, 2)["received"] == 0
+
+
+def test_open_uploads_are_limited_per_user(sessions):
+    first = sessions.create(1, 1, 10)
+    sessions.create(1, 1, 10)
+    with pytest.raises(UploadError) as error:
+        sessions.create(1, 1, 10)
+    assert error.value.status == 429
+    # other photographers are not held up
+    sessions.create(2, 1, 10)
+    # a finished or expired upload frees its place
+    sessions.discard(first, 1)
+    third = sessions.create(1, 1, 10)
+    age(sessions, third, 1, 120)
+    sessions.create(1, 1, 10)
+
+
+def test_a_chunk_is_refused_while_another_is_written(sessions):
+    upload_id = sessions.create(1, 1, 10)
+
+    class Racing(io.BytesIO):
+        # a second request at the same offset arrives mid-chunk
+        def read(self, size=-1):
+            chunk = super().read(size)
+            if chunk:
+                with pytest.raises(UploadError) as error:
+                    sessions.append(upload_id, 1, 0, io.BytesIO(b"x" * 5))
+                assert error.value.status == 409
+            return chunk
+
+    assert sessions.append(upload_id, 1, 0, Racing(b"y" * 5)) == 5
+    with pytest.raises(UploadError) as error:
+        sessions.append(upload_id, 1, 0, io.BytesIO(b"x" * 5))
+    assert error.value.status == 409
+    assert sessions.append(upload_id, 1, 5, io.BytesIO(b"z" * 5)) == 10
+    meta, data = sessions.open_complete(upload_id, 1)
+    with data:
+        assert data.read() == b"yyyyyzzzzz"
+
+
+def test_init_refuses_unknown_categories(client, make_user, login):
+    login(make_user())
+    for category in ("abc", "999"):
+        response = client.post("/uploads", json={"category": category, "size": 10})
+        assert response.status_code == 400
+        assert response.json == {"error": "Unknown category"}
+
+
+def test_finalize_stores_the_upload(client, make_user, login, jpeg):
+    login(make_user())
+    category = photohub.Category(name="Weddings")
+    photohub.db.session.add(category)
+    photohub.db.session.commit()
+    upload_id = client.post("/uploads", json={"category": category.id, "size": len(jpeg)}).json["upload_id"]
+    assert client.put(f"/uploads/{upload_id}?offset=0", data=jpeg).json["received"] == len(jpeg)
+    response = client.post(f"/uploads/{upload_id}/finalize")
+    assert response.status_code == 200
+    image = photohub.db.session.get(photohub.Image, response.json["image_id"])
+    assert image.category_id == category.id
+    assert photohub.CategoryStats.query.one().image_count == 1
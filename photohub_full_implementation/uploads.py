@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+"""
+resumable chunked uploads, kept on disk until they are finalized
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    """Raised when a chunk does not fit the upload it is sent to"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadSessions:
+    """Partial uploads, one directory each under a directory per user
+
+    An upload nothing was sent to for ttl seconds is removed, and a user
+    can have at most max_open uploads in progress, so abandoned uploads
+    cannot fill the disk.
+    """
+
+    def __init__(self, root, max_bytes, ttl=24 * 60 * 60, max_open=10):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_open = max_open
+        self.swept_at = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _user_dir(self, user_id):
+        return os.path.join(self.root, str(int(user_id)))
+
+    def _dir(self, upload_id, user_id):
+        # ids are generated here, anything else is treated as unknown
+        try:
+            upload_id = uuid.UUID(upload_id).hex
+        except ValueError:
+            raise UploadError("Unknown upload", 404)
+        return os.path.join(self._user_dir(user_id), upload_id)
+
+    def _sweep_user_dir(self, path, now):
+        """Remove the stale uploads in one user's directory; returns the ones left"""
+        try:
+            names = os.listdir(path)
+        except FileNotFoundError:
+            return 0
+        left = 0
+        for name in names:
+            upload = os.path.join(path, name)
+            try:
+                # appends touch the data file, so its mtime is the last activity
+                idle = now - os.path.getmtime(os.path.join(upload, "data"))
+            except FileNotFoundError:
+                # still being created, or already removed
+                continue
+            if idle > self.ttl:
+                shutil.rmtree(upload, ignore_errors=True)
+            else:
+                left += 1
+        return left
+
+    def sweep(self):
+        """Remove every upload idle for longer than the ttl; returns how many are left"""
+        now = time.time()
+        self.swept_at = now
+        left = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                left += self._sweep_user_dir(path, now)
+        return left
+
+    def create(self, user_id, category_id, size, filename=""):
+        if size <= 0 or size > self.max_bytes:
+            raise UploadError(f"Uploads are limited to {self.max_bytes} bytes", 413)
+        now = time.time()
+        # other users' stale uploads go at most every tenth of the ttl
+        if now - self.swept_at > self.ttl / 10:
+            self.sweep()
+        if self._sweep_user_dir(self._user_dir(user_id), now) >= self.max_open:
+            raise UploadError(f"Finish or wait out your {self.max_open} uploads in progress first", 429)
+        upload_id = uuid.uuid4().hex
+        path = self._dir(upload_id, user_id)
+        os.makedirs(path)
+        meta = {
+            "user_id": user_id,
+            "category_id": category_id,
+            "size": size,
+            "filename": filename,
+        }
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        open(os.path.join(path, "data"), "wb").close()
+        return upload_id
+
+    def status(self, upload_id, user_id):
+        path = self._dir(upload_id, user_id)
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise UploadError("Unknown upload", 404)
+        if meta["user_id"] != user_id:
+            raise UploadError("Unknown upload", 404)
+        meta["upload_id"] = upload_id
+        meta["received"] = os.path.getsize(os.path.join(path, "data"))
+        return meta
+
+    def append(self, upload_id, user_id, offset, stream):
+        """Append a chunk read from stream at offset; returns bytes received"""
+        meta = self.status(upload_id, user_id)
+        try:
+            f = open(os.path.join(self._dir(upload_id, user_id), "data"), "ab")
+        except FileNotFoundError:
+            # swept or finalized since
+            raise UploadError("Unknown upload", 404)
+        with f:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise UploadError("Another chunk of this upload is being written", 409)
+            # read under the lock, so two requests at one offset cannot both append
+            received = os.fstat(f.fileno()).st_size
+            if offset != received:
+                # the client resumes from the "received" value of GET /uploads/<id>
+                raise UploadError(f"Expected offset {received}", 409)
+            start = offset
+            remaining = meta["size"] - offset
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(chunk) > remaining:
+                    # drop the whole chunk so the client can resend it
+                    f.truncate(start)
+                    raise UploadError("Chunk runs past the declared size", 413)
+                f.write(chunk)
+                remaining -= len(chunk)
+                offset += len(chunk)
+        return offset
+
+    def open_complete(self, upload_id, user_id):
+        meta = self.status(upload_id, user_id)
+        if meta["received"] != meta["size"]:
+            raise UploadError(f"Only {meta['received']} of {meta['size']} bytes received", 409)
+        return meta, open(os.path.join(self._dir(upload_id, user_id), "data"), "rb")
+
+    def discard(self, upload_id, user_id):
+        shutil.rmtree(self._dir(upload_id, user_id), ignore_errors=True)